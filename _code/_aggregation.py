@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+
+class DealObligorMap(object):
+    """
+    Integer map of deals to obligor positions, built once and reused to scatter obligor values to deals and to
+    reduce deal values to obligors with array operations instead of merges and groupby
+    """
+
+    def __init__(self, deal_cis_codes, cis_codes=None):
+        """
+        :param deal_cis_codes: obligor identifier of each deal
+        :param cis_codes: obligor identifiers defining order of obligor arrays, None for sorted unique identifiers
+                          of deals (the order of groupby)
+        """
+        if cis_codes is None:
+            self.deal_obligor, self.cis_codes = pd.factorize(np.asarray(deal_cis_codes), sort=True)
+        else:
+            self.cis_codes = np.asarray(cis_codes)
+            self.deal_obligor = pd.Index(self.cis_codes).get_indexer(deal_cis_codes)
+        assert (self.deal_obligor < 0).sum() == 0
+
+        self.deal_obligor = self.deal_obligor.astype(np.int32)
+        self.n_deals = len(self.deal_obligor)
+        self.n_obligors = len(self.cis_codes)
+        self._matrix = None
+
+    @property
+    def matrix(self):
+        """
+        Sparse obligor x deal matrix with ones at deals of each obligor
+        """
+        if self._matrix is None:
+            from scipy import sparse
+            self._matrix = sparse.csr_matrix(
+                (np.ones(self.n_deals), (self.deal_obligor, np.arange(self.n_deals))),
+                shape=(self.n_obligors, self.n_deals))
+        return self._matrix
+
+    def to_deals(self, values):
+        """
+        Scatters obligor values to deals, array of shape (n_obligors,) or (n_scenarios, n_obligors)
+        """
+        return np.asarray(values)[..., self.deal_obligor]
+
+    def sum(self, values):
+        """
+        Sums deal values by obligor, skipping missing values as groupby does
+        :param values: array of shape (n_deals,) or (n_scenarios, n_deals)
+        :return: array of shape (n_obligors,) or (n_scenarios, n_obligors)
+        """
+        values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+        if values.ndim == 1:
+            return np.bincount(self.deal_obligor, weights=values, minlength=self.n_obligors)
+        return (self.matrix @ values.T).T
+
+    def first(self, values):
+        """
+        Returns first non-missing deal value of each obligor, missing if obligor has none
+        """
+        values = np.asarray(values)
+        valid = np.flatnonzero(~pd.isnull(values))
+        obligors, first = np.unique(self.deal_obligor[valid], return_index=True)
+        return pd.Series(values[valid[first]], index=obligors).reindex(range(self.n_obligors)).to_numpy()
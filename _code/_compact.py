@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+
+def downcast_integer(values):
+    """
+    Returns integer values in the smallest signed type holding their range
+    """
+    if len(values) == 0:
+        return values
+    value_min = values.min()
+    value_max = values.max()
+    for dtype in [np.int8, np.int16, np.int32]:
+        if np.iinfo(dtype).min <= value_min and value_max <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+    return values
+
+
+def downcast_float(values, rtol=1e-6, block_size=2 ** 16):
+    """
+    Returns float values as float32 if relative error of every value is within tolerance, otherwise unchanged
+    :param values: Series with float values
+    :param rtol: maximum relative error allowed for any value
+    :param block_size: number of values checked at once, limits size of temporary arrays
+    """
+    values_64 = values.to_numpy(dtype=np.float64)
+    values_32 = values_64.astype(np.float32)
+
+    for start in range(0, len(values_64), block_size):
+        block_64 = values_64[start:start + block_size]
+        block_32 = values_32[start:start + block_size].astype(np.float64)
+
+        # Values out of float32 range or losing precision (e.g. subnormals) keep column in float64
+        finite = np.isfinite(block_64)
+        if not (np.isfinite(block_32) == finite).all():
+            return values
+        error = np.abs(block_32[finite] - block_64[finite])
+        if (error > rtol * np.abs(block_64[finite])).any():
+            return values
+
+    return pd.Series(values_32, index=values.index, name=values.name)
+
+
+def compact_series(values, rtol=1e-6, max_category_share=0.5):
+    """
+    Returns column in compact dtype - integers downcast to the smallest type holding them (int32 codes for
+    identifiers, int8 for grades), floats to float32 within tolerance, repeated strings as categoricals
+    :param values: Series
+    :param rtol: maximum relative error of float values, see downcast_float
+    :param max_category_share: strings are made categorical if number of unique values is below this share of rows
+    """
+    if pd.api.types.is_bool_dtype(values) or isinstance(values.dtype, pd.CategoricalDtype):
+        return values
+    if pd.api.types.is_integer_dtype(values):
+        return downcast_integer(values)
+    if pd.api.types.is_float_dtype(values):
+        return downcast_float(values, rtol)
+    if pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+        if values.nunique(dropna=True) <= max_category_share * len(values):
+            return values.astype('category')
+    return values
+
+
+def compact_data(df, rtol=1e-6, exact_columns=()):
+    """
+    Returns DataFrame with all columns in compact dtypes, see compact_series
+    :param df: DataFrame
+    :param rtol: maximum relative error of float values
+    :param exact_columns: columns kept in original dtype
+    """
+    return pd.DataFrame({c: df[c] if c in exact_columns else compact_series(df[c], rtol) for c in df.columns})
+
+
+def compact_column(column, rtol=1e-6, max_category_share=0.5):
+    """
+    Converts pyarrow column to Series in compact dtype, see compact_series. Repeated strings are dictionary
+    encoded in Arrow, without creating Python string per row
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    repeated_strings = (pa.types.is_string(column.type)
+                        and pc.count_distinct(column).as_py() <= max_category_share * len(column))
+    if repeated_strings:
+        values = column.dictionary_encode().to_pandas()
+        return values.cat.set_categories(sorted(values.cat.categories))
+
+    return compact_series(column.to_pandas(), rtol, max_category_share)
+
+
+def compact_table(table, rtol=1e-6, exact_columns=(), max_category_share=0.5):
+    """
+    Converts pyarrow Table to DataFrame in compact dtypes column by column, so that the whole table is never
+    held in pandas with default dtypes
+    """
+    columns = {}
+    for c in table.column_names:
+        if c in exact_columns:
+            columns[c] = table.column(c).to_pandas()
+        else:
+            columns[c] = compact_column(table.column(c), rtol, max_category_share)
+    return pd.DataFrame(columns)
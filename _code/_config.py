@@ -1,6 +1,19 @@
+import os
+
+
 class Confs(object):
 
     def __init__(self):
 
-        # Relative data path - needs to be changed if run on different machine
+        # Relative data path - needs to be changed if run on different machine, can be overridden by environment
+        # variable RWA_SENSITIVITY_DATA_PATH (set by --data-path of cli)
         self.data_path = 'C://Users/Dmitry.frolov/Desktop/python/NWM_NV_RWA_Sensitivity/'
+        if os.environ.get('RWA_SENSITIVITY_DATA_PATH'):
+            self.data_path = os.path.join(os.environ['RWA_SENSITIVITY_DATA_PATH'], '')
+
+        # Format of clean_data artifacts - 'feather' (uncompressed Arrow IPC, memory-mapped on read without copies),
+        # 'parquet' or 'csv'
+        self.storage_format = 'feather'
+
+        # If True, clean_data artifacts are additionally exported to csv
+        self.export_csv = False
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+from _code._online_stats import RunningMoments
+
+
+def relative_half_width(half_width, estimate):
+    # Half-width relative to estimate, absolute if estimate is zero (e.g. quantile of a mostly zero value)
+    if estimate == 0:
+        return half_width
+    return half_width / abs(estimate)
+
+
+class ConvergenceMonitor(object):
+    """
+    Tracks confidence intervals of mean and quantiles of a simulated value and signals when relative half-width
+    of all intervals is within tolerance. Quantile intervals are distribution-free, based on order statistics.
+    Mean is tracked with running moments of all values, order statistics of a uniform reservoir sample of at most
+    max_values values (Vitter algorithm R), so that memory does not grow with number of scenarios. Beyond
+    max_values scenarios quantile intervals are those of a sample of max_values and stay conservative.
+    """
+
+    def __init__(self, quantiles=(0.75, 0.99), tolerance=0.001, confidence=0.95,
+                 check_every=1000, min_scenarios=1000, max_values=10 ** 6, seed=0):
+        """
+        :param quantiles: quantile levels to be tracked in addition to mean
+        :param tolerance: maximum relative half-width of confidence intervals for convergence, absolute for
+                          intervals around zero
+        :param confidence: confidence level of intervals
+        :param check_every: number of scenarios between convergence checks
+        :param min_scenarios: minimum number of scenarios before convergence can be declared
+        :param max_values: size of reservoir of values for quantile intervals
+        :param seed: seed of reservoir sampling
+        """
+        from scipy.special import ndtri
+
+        self.quantiles = quantiles
+        self.tolerance = tolerance
+        self.z = ndtri(0.5 + confidence / 2)
+        self.check_every = check_every
+        self.min_scenarios = min_scenarios
+
+        self.moments = RunningMoments()
+        self.max_values = max_values
+        self.rng = np.random.default_rng(seed)
+        self.reservoir = np.empty(0)
+        self.n_sampled = 0
+        self.values = []
+        self.n = 0
+        self.n_checked = 0
+        self.trace = []
+        self.converged = False
+
+    def update(self, values):
+        """
+        Adds simulated values and checks convergence every check_every scenarios
+        :return: True if converged
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        self.moments.update(values)
+        self.values.append(values)
+        self.n += len(values)
+        if self.n - self.n_checked >= self.check_every:
+            self.check()
+        return self.converged
+
+    def sample(self, values):
+        """
+        Adds values to reservoir. Reservoir is filled first, then value number i replaces a random element of it
+        with probability max_values / (i + 1)
+        """
+        n_fill = max(min(self.max_values - len(self.reservoir), len(values)), 0)
+        self.reservoir = np.concatenate([self.reservoir, values[:n_fill]])
+        if len(values) > n_fill:
+            slots = self.rng.integers(0, np.arange(self.n_sampled + n_fill, self.n_sampled + len(values)) + 1)
+            replaced = slots < self.max_values
+            self.reservoir[slots[replaced]] = values[n_fill:][replaced]
+        self.n_sampled += len(values)
+
+    def check(self):
+        if len(self.values) > 0:
+            self.sample(np.concatenate(self.values))
+            self.values = []
+        self.n_checked = self.n
+        n = self.n
+
+        # Confidence interval of mean
+        mean = self.moments.mean
+        half_width = self.z * self.moments.std / np.sqrt(n) if n > 1 else np.inf
+        row = {
+            'n_scenarios': n,
+            'mean': mean,
+            'mean_ci_low': mean - half_width,
+            'mean_ci_high': mean + half_width
+        }
+        relative_half_widths = [relative_half_width(half_width, mean)]
+
+        # Confidence intervals of quantiles from ranks of order statistics of reservoir
+        values = self.reservoir
+        n_values = len(values)
+        for p in self.quantiles:
+            rank = p * (n_values - 1)
+            rank_half_width = self.z * np.sqrt(n_values * p * (1 - p))
+            rank_low = int(np.floor(rank - rank_half_width))
+            rank_high = int(np.ceil(rank + rank_half_width))
+            estimate = np.quantile(values, p)
+            if rank_low < 0 or rank_high > n_values - 1:
+                low, high = -np.inf, np.inf
+            else:
+                low, high = np.partition(values, [rank_low, rank_high])[[rank_low, rank_high]]
+            row[f'p{100 * p:g}'] = estimate
+            row[f'p{100 * p:g}_ci_low'] = low
+            row[f'p{100 * p:g}_ci_high'] = high
+            relative_half_widths.append(relative_half_width((high - low) / 2, estimate))
+
+        row['max_relative_half_width'] = max(relative_half_widths)
+        self.converged = (n >= self.min_scenarios) and (row['max_relative_half_width'] <= self.tolerance)
+        row['converged'] = self.converged
+        self.trace.append(row)
+
+        print(f'Convergence check: {n} scenarios, '
+              f'max relative half-width = {row["max_relative_half_width"]:.5f}, converged = {self.converged}')
+
+    def save(self, path):
+        """
+        Saves convergence trace to parquet
+        """
+        if self.n > self.n_checked:
+            self.check()
+        pd.DataFrame(self.trace).to_parquet(path, index=False)
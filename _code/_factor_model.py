@@ -0,0 +1,178 @@
+import numpy as np
+
+from _code._rwa_distribution import obligor_rwa_values
+from _code._instrumentation import timed
+
+
+class FactorMigration(object):
+    """
+    One-factor grade migration. Probit of PD of each obligor is shifted by
+    mean + std_dev * (sqrt(rho) * X + sqrt(1 - rho) * e), where systematic factor X is shared by all obligors of
+    a scenario and idiosyncratic noise e is drawn per obligor, both standard normal. New grade is the grade whose
+    PD band of the PD scale contains the shifted PD, movements are limited to upper_limit..lower_limit notches.
+    Thresholds of grade moves are precomputed from PD scale, so that moves are found by one sorted search and
+    their probabilities conditional on X are known in closed form.
+    """
+
+    def __init__(self, config_mgs, mean=0.0, std_dev=0.15, rho=0.25, upper_limit=-3, lower_limit=3):
+        """
+        :param config_mgs: DataFrame with mgs mapping, columns 'mgs', 'pd_mid' and 'pd_high'
+        :param mean: mean shift of probit of PD, positive values move obligors to worse grades
+        :param std_dev: standard deviation of shift of probit of PD (about 0.1 per notch in the middle of scale)
+        :param rho: share of variance of shift driven by systematic factor, 0 for independent movements
+        :param upper_limit: largest upgrade in notches (negative)
+        :param lower_limit: largest downgrade in notches
+        """
+        from scipy.special import ndtri
+
+        assert std_dev > 0 and 0 <= rho < 1
+        self.mean = mean
+        self.std_dev = std_dev
+        self.rho = rho
+        self.movements = np.arange(upper_limit, lower_limit + 1)
+
+        # Performing grades of scale, defaulted grade is never reached by migration
+        config_mgs = config_mgs[config_mgs['pd_mid'] < 1].sort_values('mgs')
+        mgs = config_mgs['mgs'].to_numpy(dtype=int)
+        assert (mgs == np.arange(1, len(mgs) + 1)).all()
+        self.n_grades = len(mgs)
+
+        # Probit of PD of grades, indexed directly by mgs
+        self.grade_probit = np.full(self.n_grades + 1, np.nan)
+        self.grade_probit[mgs] = ndtri(config_mgs['pd_mid'].to_numpy(dtype=np.float64))
+
+        # Upper bounds of PD bands of grades 1..n_grades-1 in probit scale, shifted probit of PD at or above bound
+        # of grade g falls into grade g + 1 or worse
+        self.boundaries = ndtri(config_mgs['pd_high'].to_numpy(dtype=np.float64)[:-1])
+        assert (np.diff(self.boundaries) > 0).all()
+
+    def movements_from_normals(self, mgs, factor, noise):
+        """
+        Returns mgs movements for standard normal draws
+        :param mgs: array (n_obligors,) with current grade of each obligor
+        :param factor: array (n_scenarios,) with systematic factor of each scenario
+        :param noise: array (n_scenarios, n_obligors) with idiosyncratic noise
+        :return: array (n_scenarios, n_obligors) of movements
+        """
+        mgs = np.asarray(mgs, dtype=np.int64)
+        shift = self.std_dev * (np.sqrt(self.rho) * np.asarray(factor)[:, None] + np.sqrt(1 - self.rho) * noise)
+        mgs_new = np.searchsorted(self.boundaries, self.grade_probit[mgs] + self.mean + shift, side='right') + 1
+        movements = np.clip(mgs_new - mgs, self.movements[0], self.movements[-1])
+        return movements.astype(np.int16)
+
+    def conditional_probabilities(self, factor):
+        """
+        Returns probabilities of movements of each grade conditional on systematic factor. Movements beyond
+        limits are accumulated at the limits, as clipping of simulated movements does
+        :param factor: array (n_factors,) of systematic factor values
+        :return: array (n_factors, n_grades + 1, n_movements) indexed by factor, mgs and movement
+        """
+        from scipy.special import ndtr
+
+        factor = np.atleast_1d(np.asarray(factor, dtype=np.float64))
+        grades = np.arange(self.n_grades + 1)
+
+        # Cumulative probability of moving by at most each movement but the last, over grades and factors
+        targets = grades[:, None] + self.movements[None, :-1]
+        inside = (targets >= 1) & (targets < self.n_grades)
+        boundaries = self.boundaries[np.clip(targets, 1, self.n_grades - 1) - 1]
+        scale = self.std_dev * np.sqrt(1 - self.rho)
+        systematic = self.mean + self.std_dev * np.sqrt(self.rho) * factor
+        z = (boundaries - self.grade_probit[grades][:, None])[None, :, :] - systematic[:, None, None]
+        cdf = np.where(inside[None, :, :], ndtr(z / scale), (targets >= self.n_grades)[None, :, :] * 1.0)
+
+        # Accumulate tails at limits
+        cdf = np.concatenate([cdf, np.ones(cdf.shape[:2] + (1,))], axis=2)
+        probabilities = np.diff(cdf, axis=2, prepend=0.0)
+        probabilities[:, 0, :] = np.nan
+        return probabilities
+
+
+def grade_rwa_moments(kernel, mgs, upper_limit=-3, lower_limit=3):
+    """
+    Returns sums of obligor RWAs and of their products over obligors of each grade, for each pair of movements,
+    so that conditional moments of RWA depend only on grade probabilities
+    :param kernel: RwaKernel for capital calculation
+    :param mgs: array with current grade of each obligor
+    :return: tuple of arrays (first, gram) of shapes (max_mgs + 1, n_movements) and
+             (max_mgs + 1, n_movements, n_movements), indexed by mgs
+    """
+    mgs = np.asarray(mgs, dtype=np.int64)
+    values = obligor_rwa_values(kernel, mgs, upper_limit, lower_limit)
+    n_movements = values.shape[1]
+    first = np.zeros((mgs.max() + 1, n_movements))
+    gram = np.zeros((mgs.max() + 1, n_movements, n_movements))
+    for g in np.unique(mgs):
+        values_grade = values[mgs == g]
+        first[g] = values_grade.sum(axis=0)
+        gram[g] = values_grade.T @ values_grade
+    return first, gram
+
+
+def conditional_rwa_moments(migration, first, gram, factor):
+    """
+    Returns mean and variance of total RWA conditional on systematic factor. Given the factor obligors move
+    independently, so variance is the sum of obligor variances.
+    :param migration: FactorMigration
+    :param first: sums of obligor RWAs by grade, see grade_rwa_moments
+    :param gram: sums of products of obligor RWAs by grade, see grade_rwa_moments
+    :param factor: array (n_factors,) of systematic factor values
+    :return: tuple of arrays (mean, variance) of shape (n_factors,)
+    """
+    probabilities = np.nan_to_num(migration.conditional_probabilities(factor)[:, :len(first), :])
+    mean = np.einsum('xgk,gk->x', probabilities, first)
+    second = np.einsum('xgk,gk->x', probabilities, np.einsum('gkk->gk', gram))
+    variance = second - np.einsum('xgk,gkl,xgl->x', probabilities, gram, probabilities)
+    return mean, np.maximum(variance, 0.0)
+
+
+@timed
+def describe_factor_rwa_distribution(kernel, mgs, migration, quantiles=(0.5, 0.75, 0.99), n_nodes=2001,
+                                     factor_limit=8.0, n_bins=50):
+    """
+    Computes distribution of RWA after one-factor migration without simulation. Conditional on the factor,
+    RWA is approximated as normal with exact conditional mean and variance, and mixed over factor values on a
+    fine grid. Conditional variance is small for granular portfolios, so tails are driven by the factor and
+    need no sampling of idiosyncratic noise.
+    :param kernel: RwaKernel for capital calculation
+    :param mgs: array with current grade of each obligor
+    :param migration: FactorMigration
+    :param quantiles: quantile levels of RWA after migration
+    :param n_nodes: number of factor values on grid over [-factor_limit, factor_limit]
+    :param n_bins: number of histogram bins in returned summary
+    :return: dictionary with the same structure as OnlineSummary of simulation results
+    """
+    from scipy.special import ndtr
+    from scipy.optimize import brentq
+
+    # Conditional moments on grid of factor values, weighted by standard normal density
+    factor = np.linspace(-factor_limit, factor_limit, n_nodes)
+    weights = np.exp(-factor ** 2 / 2)
+    weights = weights / weights.sum()
+    first, gram = grade_rwa_moments(kernel, mgs, migration.movements[0], migration.movements[-1])
+    mean_factor, variance_factor = conditional_rwa_moments(migration, first, gram, factor)
+    std_factor = np.sqrt(variance_factor)
+
+    def cdf(x):
+        x = np.atleast_1d(x)
+        z = (x[:, None] - mean_factor[None, :]) / np.maximum(std_factor[None, :], 1e-12)
+        return ndtr(z) @ weights
+
+    mean = weights @ mean_factor
+    std = np.sqrt(weights @ (variance_factor + mean_factor ** 2) - mean ** 2)
+    low = (mean_factor - 8 * std_factor).min()
+    high = (mean_factor + 8 * std_factor).max()
+
+    summary_rwa_new = {
+        'moments': {'mean': mean, 'std': std, 'min': low, 'max': high},
+        'quantiles': {str(q): brentq(lambda x: cdf(x)[0] - q, low, high, xtol=1e-6 * abs(mean)) for q in quantiles}
+    }
+
+    edges = np.linspace(max(mean - 5 * std, low), min(mean + 5 * std, high), n_bins + 1)
+    summary_rwa_new['histogram'] = {'edges': edges.tolist(), 'counts': np.diff(cdf(edges)).tolist()}
+
+    summary = {
+        'rwa': {'moments': {'mean': kernel.rwa}},
+        'rwa_new': summary_rwa_new
+    }
+    return summary
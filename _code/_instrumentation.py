@@ -0,0 +1,233 @@
+import os
+import sys
+import csv
+import json
+import time
+import resource
+import functools
+
+from contextlib import contextmanager
+
+# Instrumentation state of current process, collected only when enabled
+_enabled = False
+_stages = []
+_functions = {}
+_counters = {}
+
+
+def enable(enabled=True):
+    """
+    Switches collection of stage and function timings on or off and clears collected data
+    """
+    global _enabled
+    _enabled = enabled
+    _stages.clear()
+    _functions.clear()
+    _counters.clear()
+
+
+def is_enabled():
+    return _enabled
+
+
+def read_status_mb(field):
+    # Read memory field of current process from /proc, None where not available
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    return None
+
+
+def peak_rss_mb():
+    """
+    Returns peak resident memory of current process in MB
+    """
+    # On Linux read high-water mark of current process image, ru_maxrss is carried over from parent on exec
+    peak = read_status_mb('VmHWM')
+    if peak is not None:
+        return peak
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def reset_peak_rss():
+    """
+    Resets peak resident memory where supported (Linux), so that peak of a stage can be measured
+    :return: True if peak was reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def count(name, n=1):
+    """
+    Adds n to counter of current stage, e.g. number of finished scenarios
+    """
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+@contextmanager
+def stage(name, profile=None, profile_path=None):
+    """
+    Measures wall and CPU time, peak memory and counters of a pipeline stage
+    :param name: name of stage
+    :param profile: None, 'cprofile' or 'pyinstrument' to profile the stage
+    :param profile_path: path of profile dump without extension ('.prof' for cProfile, '.html' for pyinstrument)
+    """
+    if not _enabled:
+        yield
+        return
+
+    _counters.clear()
+    peak_reset = reset_peak_rss()
+    rss_start = read_status_mb('VmRSS')
+
+    profiler = None
+    if profile == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if profile == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+
+        if profile == 'cprofile':
+            profiler.disable()
+            profiler.dump_stats(profile_path + '.prof')
+        if profile == 'pyinstrument':
+            profiler.stop()
+            with open(profile_path + '.html', 'w') as f:
+                f.write(profiler.output_html())
+
+        record = {
+            'stage': name,
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'rss_start_mb': rss_start,
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_rss_is_stage_peak': peak_reset
+        }
+        for counter, value in _counters.items():
+            record[counter] = value
+            record[f'{counter}_per_second'] = value / wall if wall > 0 else None
+        _stages.append(record)
+
+
+def timed(function):
+    """
+    Decorator accumulating number of calls, wall and CPU time of function when instrumentation is enabled.
+    Calls made in worker processes are not collected.
+    """
+    name = f'{function.__module__}.{function.__qualname__}'
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            stats = _functions.setdefault(name, {'function': name, 'calls': 0, 'wall_seconds': 0.0,
+                                                 'cpu_seconds': 0.0, 'max_wall_seconds': 0.0})
+            stats['calls'] += 1
+            stats['wall_seconds'] += wall
+            stats['cpu_seconds'] += cpu
+            stats['max_wall_seconds'] = max(stats['max_wall_seconds'], wall)
+
+    return wrapper
+
+
+def get_report():
+    """
+    Returns collected stage and function records
+    """
+    return {
+        'stages': list(_stages),
+        'functions': sorted(_functions.values(), key=lambda stats: -stats['wall_seconds'])
+    }
+
+
+def save_report(path):
+    """
+    Saves run report as json and flat csv files for stages and functions
+    :param path: path without extension
+    """
+    report = get_report()
+    report['created'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    with open(path + '.json', 'w') as f:
+        json.dump(report, f, indent=4, default=str)
+
+    for part in ['stages', 'functions']:
+        records = report[part]
+        columns = list(dict.fromkeys(c for record in records for c in record))
+        with open(path + f'_{part}.csv', 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(records)
+
+
+class ProgressReporter(object):
+    """
+    Prints progress of a long loop at most once per interval, with rate and expected time to finish
+    """
+
+    def __init__(self, label, total, interval=5.0):
+        """
+        :param label: prefix of progress lines, e.g. 'MGS movements approach'
+        :param total: expected number of items, e.g. scenarios
+        :param interval: minimum number of seconds between progress lines
+        """
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def update(self, n=1):
+        self.done += n
+        count('scenarios', n)
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval or self.done >= self.total:
+            self.report(now)
+
+    def report(self, now=None):
+        now = time.perf_counter() if now is None else now
+        self.last_report = now
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        if self.done >= self.total:
+            remaining = 0.0
+        else:
+            remaining = (self.total - self.done) / rate if rate > 0 else float('nan')
+        percent = 100 * self.done / self.total if self.total > 0 else 100.0
+        print(f'{self.label}: {self.done:,}/{self.total:,} scenarios ({percent:.0f}%), '
+              f'{rate:,.1f} per second, {elapsed:.1f}s elapsed, {max(remaining, 0):.1f}s remaining')
+
+    def close(self):
+        # Report final state if loop stopped early, finished loop is reported by last update
+        if self.done < self.total:
+            self.report()
@@ -0,0 +1,278 @@
+import json
+
+import numpy as np
+
+
+class RunningMoments(object):
+    """
+    Running count, mean, variance, min and max (Welford algorithm, updated with batches by Chan et al. formula)
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        n_batch = len(values)
+        if n_batch == 0:
+            return
+
+        mean_batch = values.mean()
+        m2_batch = ((values - mean_batch) ** 2).sum()
+
+        n = self.n + n_batch
+        delta = mean_batch - self.mean
+        self.mean += delta * n_batch / n
+        self.m2 += m2_batch + delta ** 2 * self.n * n_batch / n
+        self.n = n
+
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def to_dict(self):
+        return {'n': self.n, 'mean': self.mean, 'std': self.std, 'min': self.min, 'max': self.max}
+
+
+class WeightedMoments(object):
+    """
+    Running weighted mean, variance, min and max of importance sampled values, weights are likelihood ratios
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.sum_weights = 0.0
+        self.sum_weights_squared = 0.0
+        self.sum_values = 0.0
+        self.sum_squares = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values, weights):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        weights = np.asarray(weights, dtype=np.float64).ravel()
+        valid = ~np.isnan(values)
+        values = values[valid]
+        weights = weights[valid]
+        if len(values) == 0:
+            return
+
+        self.n += len(values)
+        self.sum_weights += weights.sum()
+        self.sum_weights_squared += (weights ** 2).sum()
+        self.sum_values += weights @ values
+        self.sum_squares += weights @ values ** 2
+
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+    @property
+    def mean(self):
+        return self.sum_values / self.sum_weights if self.sum_weights > 0 else np.nan
+
+    @property
+    def std(self):
+        if self.sum_weights <= 0:
+            return np.nan
+        return np.sqrt(max(self.sum_squares / self.sum_weights - self.mean ** 2, 0.0))
+
+    @property
+    def effective_n(self):
+        # Kish effective sample size, small values mean that few scenarios dominate the estimates
+        return self.sum_weights ** 2 / self.sum_weights_squared if self.sum_weights_squared > 0 else 0.0
+
+    def to_dict(self):
+        return {'n': self.n, 'mean': self.mean, 'std': self.std, 'min': self.min, 'max': self.max,
+                'effective_n': self.effective_n}
+
+
+def weighted_quantile(values, weights, q):
+    """
+    Returns quantile of importance sampled values as the smallest value whose share of total weight at or below it
+    is at least q (self-normalised estimator)
+    :param values: array of values
+    :param weights: array of likelihood ratios of values
+    :param q: quantile level or array of levels
+    """
+    values = np.asarray(values, dtype=np.float64).ravel()
+    weights = np.asarray(weights, dtype=np.float64).ravel()
+    valid = ~np.isnan(values)
+    if valid.sum() == 0:
+        return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+
+    order = np.argsort(values[valid])
+    cdf = np.cumsum(weights[valid][order])
+    index = np.minimum(np.searchsorted(cdf, np.asarray(q) * cdf[-1]), len(cdf) - 1)
+    return values[valid][order][index]
+
+
+class StreamingHistogram(object):
+    """
+    Histogram with fixed number of equal bins, whose range is doubled (merging neighbouring bins)
+    whenever new values fall outside of it
+    """
+
+    def __init__(self, n_bins=50):
+        assert n_bins % 2 == 0
+        self.n_bins = n_bins
+        self.counts = None
+        self.low = None
+        self.width = None
+
+    @property
+    def high(self):
+        return self.low + self.width * self.n_bins
+
+    def update(self, values, weights=None):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64).ravel()[np.isfinite(values)]
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+
+        value_min = values.min()
+        value_max = values.max()
+
+        # Define range from first batch
+        if self.counts is None:
+            self.low = value_min
+            self.width = (value_max - value_min) / self.n_bins
+            if self.width == 0:
+                self.width = max(abs(value_min), 1.0) * 1e-6
+            self.counts = np.zeros(self.n_bins, dtype=np.int64 if weights is None else np.float64)
+
+        # Extend range until all values are covered
+        while value_min < self.low or value_max > self.high:
+            merged = self.counts.reshape(-1, 2).sum(axis=1)
+            self.counts = np.zeros(self.n_bins, dtype=merged.dtype)
+            if value_min < self.low:
+                self.low = self.low - self.width * self.n_bins
+                self.counts[self.n_bins // 2:] = merged
+            else:
+                self.counts[:self.n_bins // 2] = merged
+            self.width = self.width * 2
+
+        bins = np.clip(((values - self.low) / self.width).astype(np.int64), 0, self.n_bins - 1)
+        self.counts += np.bincount(bins, weights=weights, minlength=self.n_bins).astype(self.counts.dtype)
+
+    @property
+    def edges(self):
+        return self.low + self.width * np.arange(self.n_bins + 1)
+
+    def to_dict(self):
+        if self.counts is None:
+            return {'edges': [], 'counts': []}
+        return {'edges': self.edges.tolist(), 'counts': self.counts.tolist()}
+
+
+class HistogramQuantiles(object):
+    """
+    Streaming estimates of quantiles in constant memory from a fine StreamingHistogram, updated with whole batches
+    and optionally weighted by likelihood ratios of importance sampled scenarios. Quantiles are interpolated linearly
+    within bins, so that their error is at most one bin width. Bin width starts at range of first batch over n_bins
+    and is doubled with each extension of range, possibly several times for a single batch, so that first batch
+    should cover most of the range of values.
+    """
+
+    def __init__(self, quantiles, n_bins=2 ** 14):
+        """
+        :param quantiles: quantile levels between 0 and 1
+        :param n_bins: number of histogram bins
+        """
+        self.quantiles = quantiles
+        self.histogram = StreamingHistogram(n_bins)
+
+    def update(self, values, weights=None):
+        self.histogram.update(values, weights)
+
+    def to_dict(self):
+        counts = self.histogram.counts
+        if counts is None:
+            return {str(p): np.nan for p in self.quantiles}
+
+        cdf = np.cumsum(counts)
+        quantiles = {}
+        for p in self.quantiles:
+            target = p * cdf[-1]
+            i = min(np.searchsorted(cdf, target), len(cdf) - 1)
+            fraction = (target - (cdf[i] - counts[i])) / counts[i] if counts[i] > 0 else 0.0
+            quantiles[str(p)] = self.histogram.low + self.histogram.width * (i + fraction)
+        return quantiles
+
+
+class OnlineSummary(object):
+    """
+    Online statistics of simulation result columns - moments, streaming quantiles and histogram
+    """
+
+    def __init__(self, columns, quantiles=(0.5, 0.75, 0.99), n_bins=50, weight_column=None):
+        """
+        :param columns: list of result columns to be summarised
+        :param quantiles: quantile levels estimated for each column
+        :param n_bins: number of histogram bins for each column
+        :param weight_column: column with likelihood ratios of importance sampled scenarios, statistics are
+                              weighted by them if given
+        """
+        self.columns = columns
+        self.quantiles = quantiles
+        self.weight_column = weight_column
+        if weight_column is None:
+            self.moments = {c: RunningMoments() for c in columns}
+        else:
+            self.moments = {c: WeightedMoments() for c in columns}
+        self.estimators = {c: HistogramQuantiles(quantiles) for c in columns}
+        self.histograms = {c: StreamingHistogram(n_bins) for c in columns}
+
+    def update(self, df):
+        """
+        Updates statistics with DataFrame of finished scenarios
+        """
+        if self.weight_column is not None:
+            weights = df[self.weight_column].to_numpy(dtype=np.float64)
+            for c in self.columns:
+                values = df[c].to_numpy(dtype=np.float64)
+                self.moments[c].update(values, weights)
+                self.estimators[c].update(values, weights)
+                self.histograms[c].update(values, weights)
+            return
+
+        for c in self.columns:
+            values = df[c].to_numpy(dtype=np.float64)
+            self.moments[c].update(values)
+            self.estimators[c].update(values)
+            self.histograms[c].update(values)
+
+    def to_dict(self):
+        summary = {}
+        for c in self.columns:
+            summary[c] = {
+                'moments': self.moments[c].to_dict(),
+                'quantiles': self.estimators[c].to_dict(),
+                'histogram': self.histograms[c].to_dict()
+            }
+        return summary
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4, default=float)
+
+
+def load_summary(path):
+    """
+    Reads summary saved by OnlineSummary
+    """
+    with open(path) as f:
+        return json.load(f)
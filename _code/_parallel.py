@@ -0,0 +1,69 @@
+import os
+import sys
+import multiprocessing
+
+# Read-only data shared with worker processes, set once per worker
+_shared = None
+
+
+def _init_worker(shared):
+    global _shared
+    _shared = shared
+
+    # Workers run compiled kernels single threaded, parallelism comes from processes. Numba reads the variable on
+    # import, which happens in the worker, as pool is not forked once numba is loaded (see iterate_parallel), unless
+    # shared data already imported it
+    os.environ['NUMBA_NUM_THREADS'] = '1'
+    if 'numba' in sys.modules:
+        sys.modules['numba'].set_num_threads(1)
+
+
+def _run_task(function_task):
+    function, task = function_task
+    return function(_shared, task)
+
+
+def iterate_parallel(function, tasks, shared, n_workers=1):
+    """
+    Runs function(shared, task) for every task in a process pool and yields results in order of tasks
+    as they become available
+    :param function: module level function taking shared data and a task
+    :param tasks: list of tasks, e.g. random states or chunks of scenarios
+    :param shared: read-only data used by all tasks (obligors, deals, kernel). It is passed to each worker
+                   once at start-up - inherited without pickling where processes are forked, pickled once per
+                   worker otherwise - and never sent with individual tasks
+    :param n_workers: number of worker processes, None for number of CPUs, 1 to run in current process
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    if n_workers == 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield function(shared, task)
+        return
+
+    # Prefer fork so that shared arrays are inherited by workers. Once numba is loaded, its thread pool may have been
+    # started by a parallel kernel (e.g. swap kernel) and forked workers hang at exit on its locks, so workers are
+    # started from a fresh process instead and shared data is pickled once per worker
+    start_methods = multiprocessing.get_all_start_methods()
+    if 'numba' in sys.modules:
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in start_methods else 'spawn')
+    elif 'fork' in start_methods:
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+
+    # Send several tasks per message to keep inter-process overhead low
+    chunksize = max(1, len(tasks) // (4 * n_workers))
+
+    with context.Pool(processes=n_workers, initializer=_init_worker, initargs=(shared,)) as pool:
+        for result in pool.imap(_run_task, [(function, task) for task in tasks], chunksize=chunksize):
+            yield result
+
+
+def run_parallel(function, tasks, shared, n_workers=1):
+    """
+    Runs function(shared, task) for every task in a process pool and returns results in order of tasks,
+    see iterate_parallel
+    """
+    return list(iterate_parallel(function, tasks, shared, n_workers))
@@ -0,0 +1,180 @@
+import os
+import ast
+import json
+import hashlib
+import inspect
+import importlib
+import importlib.util
+
+from _code import _instrumentation as instrumentation
+
+from _code._config import Confs
+config = Confs()
+
+
+class Stage(object):
+    """
+    Pipeline stage with declared input and output files, relative to data path
+    """
+
+    def __init__(self, name, function, inputs, outputs, params=None):
+        """
+        :param name: name of stage
+        :param function: function running the stage, called with params as keyword arguments, or its dotted path
+                         (e.g. '_code.clean_data.main') so that module is imported only when stage runs
+        :param inputs: list of files read by stage
+        :param outputs: list of files written by stage
+        :param params: dictionary with parameters of stage
+        """
+        self.name = name
+        self.function = function
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = {} if params is None else params
+
+    def get_function(self):
+        # Import function given by dotted path
+        if isinstance(self.function, str):
+            module_name, function_name = self.function.rsplit('.', 1)
+            return getattr(importlib.import_module(module_name), function_name)
+        return self.function
+
+    def get_source_file(self):
+        # Locate source of function without importing its module
+        if isinstance(self.function, str):
+            return importlib.util.find_spec(self.function.rsplit('.', 1)[0]).origin
+        return inspect.getsourcefile(self.function)
+
+
+def hash_file(path, block_size=2 ** 20):
+    # Return sha256 of file content, None if file does not exist
+    if not os.path.exists(path):
+        return None
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def find_source_files(source_file):
+    """
+    Returns sorted paths of source file and of modules of its package it imports transitively, including imports
+    inside functions (e.g. lazily imported kernels), found by parsing sources without importing them
+    """
+    directory = os.path.dirname(source_file)
+    package = os.path.basename(directory)
+    found = set()
+    pending = [os.path.abspath(source_file)]
+    while pending:
+        path = pending.pop()
+        if path in found or not os.path.exists(path):
+            continue
+        found.add(path)
+        with open(path) as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module is not None and node.level == 0:
+                # from package import module or from package.module import name
+                names = [node.module] + [node.module + '.' + alias.name for alias in node.names]
+            else:
+                continue
+            for name in names:
+                parts = name.split('.')
+                if parts[0] == package and len(parts) == 2:
+                    pending.append(os.path.abspath(os.path.join(directory, parts[1] + '.py')))
+    return sorted(found)
+
+
+def hash_source(source_file):
+    """
+    Returns hash of stage source file and of modules of its package it imports transitively, so that changes of
+    helper modules imported by the stage (e.g. _rwa_kernel) invalidate its cache but changes of unrelated modules
+    do not
+    """
+    sha = hashlib.sha256()
+    for path in find_source_files(source_file):
+        sha.update(os.path.basename(path).encode())
+        sha.update(str(hash_file(path)).encode())
+    return sha.hexdigest()
+
+
+def hash_stage(stage):
+    """
+    Returns hash of stage inputs content, parameters and source code of stage and modules it imports
+    """
+    sha = hashlib.sha256()
+    sha.update(stage.name.encode())
+    sha.update(json.dumps(stage.params, sort_keys=True, default=str).encode())
+    sha.update(hash_source(stage.get_source_file()).encode())
+    for path in stage.inputs:
+        sha.update(path.encode())
+        sha.update(str(hash_file(config.data_path + path)).encode())
+    return sha.hexdigest()
+
+
+def sort_stages(stages):
+    """
+    Orders stages so that each stage runs after stages producing its inputs, keeping declared order otherwise
+    """
+    producers = {path: stage.name for stage in stages for path in stage.outputs}
+    dependencies = {stage.name: {producers[p] for p in stage.inputs if p in producers} - {stage.name}
+                    for stage in stages}
+
+    ordered = []
+    done = set()
+    while len(ordered) < len(stages):
+        ready = [s for s in stages if s.name not in done and dependencies[s.name] <= done]
+        assert len(ready) > 0, 'Pipeline stages have cyclic dependencies'
+        ordered.append(ready[0])
+        done.add(ready[0].name)
+
+    return ordered
+
+
+def run_stages(stages, use_cache=True, cache_path=None, profile=None, profile_dir=None):
+    """
+    Runs pipeline stages in dependency order. Stage is skipped if hash of its inputs, parameters and code
+    matches cached run and its outputs are unchanged since then.
+    :param stages: list of Stage
+    :param use_cache: if False, all stages are run
+    :param cache_path: path to json file with cached stage hashes
+    :param profile: None, 'cprofile' or 'pyinstrument' to dump profile of each stage run, see _instrumentation
+    :param profile_dir: directory of profile dumps
+    """
+    if cache_path is None:
+        cache_path = config.data_path + 'pipeline_cache.json'
+    if profile is not None:
+        if profile_dir is None:
+            profile_dir = config.data_path + 'result_data/profiles/'
+        os.makedirs(profile_dir, exist_ok=True)
+
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+
+    for stage in sort_stages(stages):
+        stage_hash = hash_stage(stage)
+        cached = cache.get(stage.name, {})
+        outputs_hash = {path: hash_file(config.data_path + path) for path in stage.outputs}
+
+        if use_cache and cached.get('hash') == stage_hash and cached.get('outputs') == outputs_hash \
+                and None not in outputs_hash.values():
+            print(f'Pipeline: skipping {stage.name}, inputs and parameters unchanged')
+            continue
+
+        print(f'Pipeline: running {stage.name}...')
+        profile_path = profile_dir + stage.name if profile is not None else None
+        with instrumentation.stage(stage.name, profile, profile_path):
+            stage.get_function()(**stage.params)
+
+        # Store hash of run
+        cache[stage.name] = {
+            'hash': stage_hash,
+            'outputs': {path: hash_file(config.data_path + path) for path in stage.outputs}
+        }
+        with open(cache_path, 'w') as f:
+            json.dump(cache, f, indent=4)
@@ -0,0 +1,126 @@
+import os
+
+import pandas as pd
+
+from _code._online_stats import OnlineSummary
+from _code._instrumentation import timed
+
+from _code._config import Confs
+config = Confs()
+
+
+class ResultSink(object):
+    """
+    Appends simulation results to parquet file in row groups as scenarios finish, so that the full result
+    does not need to be held in memory. Online summary of selected columns is updated with every batch and
+    saved to json on close. Xlsx copy of the result is written on close only if requested.
+    """
+
+    def __init__(self, save_path, columns, batch_size=10000, export_xlsx=False,
+                 summary_columns=None, write_rows=True, summary_quantiles=(0.5, 0.75, 0.99), weight_column=None):
+        """
+        :param save_path: path of result relative to data path, without extension
+        :param columns: list of result columns
+        :param batch_size: number of rows written per parquet row group
+        :param export_xlsx: if True, result is additionally saved to xlsx on close
+        :param summary_columns: list of columns with online summary, no summary if None
+        :param write_rows: if False, rows are not saved and only online summary is kept
+        :param summary_quantiles: quantile levels of online summary
+        :param weight_column: column with likelihood ratios of importance sampled scenarios weighting the summary
+        """
+        self.save_path = save_path
+        self.columns = columns
+        self.batch_size = batch_size
+        self.export_xlsx = export_xlsx and write_rows
+        self.write_rows = write_rows
+        self.summary = OnlineSummary(summary_columns, summary_quantiles, weight_column=weight_column) \
+            if summary_columns is not None else None
+
+        self.rows = []
+        self.frames = []
+        self.n_buffered = 0
+        self.writer = None
+        self.schema = None
+        self.n_rows = 0
+
+    def append(self, rows):
+        """
+        Appends results given as DataFrame with result columns or list of rows
+        """
+        if isinstance(rows, pd.DataFrame):
+            self.frames.append(rows[self.columns])
+        else:
+            self.rows.extend(rows)
+        self.n_buffered += len(rows)
+        if self.n_buffered >= self.batch_size:
+            self.flush()
+
+    @timed
+    def flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self.n_buffered == 0:
+            return
+
+        if len(self.rows) > 0:
+            self.frames.append(pd.DataFrame(self.rows, columns=self.columns))
+        df = pd.concat(self.frames, ignore_index=True)
+
+        # Update online summary
+        if self.summary is not None:
+            self.summary.update(df)
+
+        # Write batch as parquet row group
+        if self.write_rows:
+            if self.writer is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                self.schema = table.schema
+                self.writer = pq.ParquetWriter(config.data_path + self.save_path + '.parquet', self.schema)
+            else:
+                table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+            self.writer.write_table(table)
+
+        self.n_rows += self.n_buffered
+        self.rows = []
+        self.frames = []
+        self.n_buffered = 0
+
+    def close(self, export_xlsx=None):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+        # Result without rows replaces result of an earlier run at the same path, empty file keeps result columns
+        path = config.data_path + self.save_path + '.parquet'
+        if self.write_rows and self.n_rows == 0:
+            pd.DataFrame(columns=self.columns).to_parquet(path, index=False)
+        if not self.write_rows and os.path.exists(path):
+            os.remove(path)
+
+        # Save online summary of the result
+        if self.summary is not None:
+            self.summary.save(config.data_path + self.save_path + '_summary.json')
+
+        # Save optional xlsx copy of the result
+        if export_xlsx is None:
+            export_xlsx = self.export_xlsx
+        if export_xlsx and self.n_rows > 0:
+            df_result = read_result(self.save_path)
+            df_result.to_excel(config.data_path + self.save_path + '.xlsx', index=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(export_xlsx=self.export_xlsx and exc_type is None)
+
+
+def read_result(save_path, columns=None):
+    """
+    Reads simulation result written by ResultSink
+    :param save_path: path of result relative to data path, without extension
+    :param columns: list of columns to be read, all columns if None
+    """
+    return pd.read_parquet(config.data_path + save_path + '.parquet', columns=columns)
@@ -1,46 +1,132 @@
-from _code.clean_config import main as clean_config
-from _code.clean_data import main as clean_data
+from _code.simulate_approach_mgs_movements import get_save_path as get_save_path_mgs_movements
+from _code.simulate_sweep import get_save_path as get_save_path_sweep
 
-from _code.simulate_approach_bucket_swaps import main as simulate_approach_bucket_swaps
-from _code.simulate_approach_mgs_movements import main as simulate_approach_mgs_movements
+from _code._pipeline import Stage, run_stages
+from _code._storage import get_clean_data_path
+from _code import _instrumentation as instrumentation
 
-from _code.visualize_simulations import main as visualize_simulations
+from _code._config import Confs
+config = Confs()
 
 
-def main(params=None):
+# Pipeline parameters
+default_params = {
+    'clean_config': True,
+    'clean_data': True,
+    'simulate_approach_bucket_swaps': True,
+    'simulate_approach_mgs_movements': True,
+    'simulate_sweep': False,
+    'visualize_simulations': True,
+    'use_cache': True,
+
+    # Instrumentation - run report with stage and function timings, optional profile of each stage
+    'instrument': False,
+    'profile': None
+}
+
+# Parameters of stages, cached runs are reused only if parameters are unchanged
+default_stage_params = {
+    'clean_config': {},
+    'clean_data': {},
+    'simulate_approach_bucket_swaps': {
+        'n_simulations': 1000
+    },
+    'simulate_approach_mgs_movements': {
+        'n_simulations': 1000,
+        'approach': 'normal',
+        'approach_params': {'mean': 0.0, 'std_dev': 1.5}
+    },
+    'simulate_sweep': {
+        'n_simulations': 1000,
+        'grid': [
+            {'simulator': 'mgs_movements', 'approach': 'linear'},
+            {'simulator': 'mgs_movements', 'approach': 'normal', 'mean': 0.0, 'std_dev': 1.5},
+            {'simulator': 'mgs_movements', 'approach': 'normal', 'mean': 0.0, 'std_dev': 2.0},
+            {'simulator': 'bucket_swaps', 'swaps_variant': 'base', 'swaps_scale': 1.0}
+        ]
+    },
+    'visualize_simulations': {}
+}
+
+
+def main(params=None, stage_params=None):
 
     # Define pipeline parameters
-    if params is None:
-        params = {
-            'clean_config': True,
-            'clean_data': True,
-            'simulate_approach_bucket_swaps': True,
-            'simulate_approach_mgs_movements': True,
-            'visualize_simulations': True
-        }
-
-    # Run configurations parsing
-    if params['clean_config']:
-        clean_config()
-
-    # Run input data cleaning
-    if params['clean_data']:
-        clean_data()
-
-    # Run RWA simulation approach with obligor swaps between buckets
-    if params['simulate_approach_bucket_swaps']:
-        simulate_approach_bucket_swaps(n_simulations=1000)
-
-    # Run RWA simulation approach with mgs movements at the obligor level
-    if params['simulate_approach_mgs_movements']:
-        simulate_approach_mgs_movements(
-            n_simulations=1000,
-            approach='normal',
-            approach_params={'mean': 0.0, 'std_dev': 1.5})
-
-    # Run creation of distribution graphs
-    if params['visualize_simulations']:
-        visualize_simulations()
+    params = {**default_params, **(params if params is not None else {})}
+    stage_params = stage_params if stage_params is not None else {}
+    stage_params = {s: {**default_stage_params[s], **stage_params.get(s, {})} for s in default_stage_params}
+
+    # Define stages with their inputs and outputs, stage modules are imported only when stage runs
+    mgs_movements_params = stage_params['simulate_approach_mgs_movements']
+    stages = [
+        # Run configurations parsing
+        Stage('clean_config', '_code.clean_config.main',
+              inputs=['config_data/config_pd_swaps.xlsx'],
+              outputs=[get_clean_data_path('config_swaps_matrix', relative=True),
+                       get_clean_data_path('config_mgs_mapping', relative=True),
+                       get_clean_data_path('config_transition_matrix', relative=True)],
+              params=stage_params['clean_config']),
+
+        # Run input data cleaning
+        Stage('clean_data', '_code.clean_data.main',
+              inputs=['raw_data/OWC_EXTRACT2.xlsx',
+                      'raw_data/OWC_EXTRACT3.xlsx',
+                      get_clean_data_path('config_mgs_mapping', relative=True)],
+              outputs=[get_clean_data_path('interim_deal_data_incumbent', relative=True),
+                       get_clean_data_path('interim_obligor_data_updated', relative=True),
+                       get_clean_data_path('clean_deal_data_merged', relative=True),
+                       get_clean_data_path('clean_obligor_data_merged', relative=True)],
+              params=stage_params['clean_data']),
+
+        # Run RWA simulation approach with obligor swaps between buckets
+        Stage('simulate_approach_bucket_swaps', '_code.simulate_approach_bucket_swaps.main',
+              inputs=[get_clean_data_path('clean_obligor_data_merged', relative=True),
+                      get_clean_data_path('clean_deal_data_merged', relative=True),
+                      get_clean_data_path('config_mgs_mapping', relative=True),
+                      get_clean_data_path('config_swaps_matrix', relative=True)],
+              outputs=['result_data/result_bucket_swaps.parquet'],
+              params=stage_params['simulate_approach_bucket_swaps']),
+
+        # Run RWA simulation approach with mgs movements at the obligor level
+        Stage('simulate_approach_mgs_movements', '_code.simulate_approach_mgs_movements.main',
+              inputs=[get_clean_data_path('clean_obligor_data_merged', relative=True),
+                      get_clean_data_path('clean_deal_data_merged', relative=True),
+                      get_clean_data_path('config_mgs_mapping', relative=True),
+                      get_clean_data_path('config_transition_matrix', relative=True)],
+              outputs=[get_save_path_mgs_movements(mgs_movements_params['n_simulations'],
+                                                   mgs_movements_params.get('approach', 'linear'),
+                                                   mgs_movements_params.get('approach_params'),
+                                                   mgs_movements_params.get('tilt')) + '.parquet'],
+              params=mgs_movements_params),
+
+        # Run grid of simulation parameters sharing loaded data and RWA kernel
+        Stage('simulate_sweep', '_code.simulate_sweep.main',
+              inputs=[get_clean_data_path('clean_obligor_data_merged', relative=True),
+                      get_clean_data_path('clean_deal_data_merged', relative=True),
+                      get_clean_data_path('config_mgs_mapping', relative=True),
+                      get_clean_data_path('config_swaps_matrix', relative=True),
+                      get_clean_data_path('config_transition_matrix', relative=True)],
+              outputs=[get_save_path_sweep(stage_params['simulate_sweep'].get('name', 'sweep')) + '_points.parquet'],
+              params=stage_params['simulate_sweep']),
+
+        # Run creation of distribution graphs
+        Stage('visualize_simulations', '_code.visualize_simulations.main',
+              inputs=['result_data/result_bucket_swaps.parquet'],
+              outputs=['result_data/graphs/result_bucket_swaps_rwa_new_distribution.png',
+                       'result_data/graphs/result_bucket_swaps_weighted_pd_new_distribution.png'],
+              params=stage_params['visualize_simulations'])
+    ]
+
+    # Run enabled stages, skipping the ones with unchanged inputs and parameters
+    stages = [stage for stage in stages if params[stage.name]]
+    if params['instrument'] or params['profile'] is not None:
+        instrumentation.enable()
+    try:
+        run_stages(stages, use_cache=params['use_cache'], profile=params['profile'])
+    finally:
+        if instrumentation.is_enabled():
+            instrumentation.save_report(config.data_path + 'result_data/run_report')
+            instrumentation.enable(False)
 
 
 if __name__ == '__main__':
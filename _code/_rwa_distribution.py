@@ -0,0 +1,266 @@
+import numpy as np
+
+from _code._instrumentation import timed
+
+
+def movement_probabilities(approach='linear', approach_params=None):
+    """
+    Returns probabilities of mgs movements -3..3 used by simulate_approach_mgs_movements
+    :param approach: 'linear' (uniform integer movements) or 'normal' (rounded normal movements clipped to +-3)
+    :param approach_params: parameters of the approach, same as in run_movements
+    """
+    upper_limit = -3
+    lower_limit = 3
+    movements = np.arange(upper_limit, lower_limit + 1)
+
+    if approach == 'linear':
+        probabilities = np.full(len(movements), 1 / len(movements))
+    if approach == 'normal':
+        mean = approach_params['mean']
+        std_dev = approach_params['std_dev']
+
+        from scipy.special import ndtr
+
+        # Probability of rounding to each movement, tails are accumulated at the limits
+        edges = (np.append(movements - 0.5, lower_limit + 0.5) - mean) / std_dev
+        cdf = ndtr(edges)
+        cdf[0] = 0.0
+        cdf[-1] = 1.0
+        probabilities = np.diff(cdf)
+
+    return probabilities
+
+
+def tilt_probabilities(probabilities, movements, tilt):
+    """
+    Exponentially tilts movement probabilities towards downgrades, q_k = p_k * exp(tilt * k) / M(tilt), for
+    importance sampling of RWA tails. Likelihood ratio of a drawn movement k is exp(log M(tilt) - tilt * k).
+    :param probabilities: array (..., n_movements) with probabilities of movements, e.g. rows of transition matrix
+    :param movements: array (n_movements,) or broadcastable to probabilities with movements in notches
+    :param tilt: tilt per notch, positive values favour downgrades
+    :return: tuple (tilted probabilities, log M(tilt) with shape of probabilities without the last axis)
+    """
+    exponents = tilt * np.asarray(movements, dtype=np.float64)
+    shift = np.max(np.where(probabilities > 0, exponents, -np.inf), axis=-1, keepdims=True)
+    scaled = probabilities * np.exp(exponents - shift)
+    total = scaled.sum(axis=-1, keepdims=True)
+    return scaled / total, (np.log(total) + shift)[..., 0]
+
+
+def obligor_rwa_values(kernel, mgs, upper_limit=-3, lower_limit=3):
+    """
+    Returns RWA of each obligor for each mgs movement, taking clipping of grades to 1..26 into account
+    :param kernel: RwaKernel for capital calculation
+    :param mgs: array with current grade of each obligor
+    :return: array of shape (n_obligors, n_movements)
+    """
+    movements = np.arange(upper_limit, lower_limit + 1)
+    mgs_new = np.clip(np.asarray(mgs)[:, None] + movements[None, :], 1, 26)
+    return (kernel.grade_factor_a[mgs_new] * kernel.weight_a[:, None]
+            + kernel.grade_factor_b[mgs_new] * kernel.weight_b[:, None])
+
+
+def deviation_bound(variance, max_deviation, tail_probability):
+    """
+    Returns Bernstein bound on absolute value of a sum of independent centred variables, exceeded with probability
+    of at most tail_probability
+    :param variance: variance of the sum
+    :param max_deviation: bound on absolute value of each variable
+    :param tail_probability: probability of exceeding the bound
+    """
+    log_tail = np.log(2 / tail_probability)
+    return np.sqrt(2 * variance * log_tail) + 2 / 3 * max_deviation * log_tail
+
+
+def lattice_step(values_range, probabilities, n_grid, tail_probability=1e-12):
+    """
+    Returns lattice step of rwa_distribution_fft for the narrower of the whole range and the window of total RWA,
+    both widened by rounding of obligor values by at most half a step, i.e. by n_obligors / 2 steps over the whole
+    range and by deviation of rounding error from its mean exceeded with at most tail_probability over the window
+    :param values_range: array (n_obligors, n_movements) with RWA of each obligor for each movement relative to
+                         its minimum
+    """
+    n_obligors = values_range.shape[0]
+    deviations = values_range - (values_range @ probabilities)[:, None]
+
+    steps = []
+    if n_grid - 1 > n_obligors / 2:
+        steps.append(values_range.max(axis=1).sum() / (n_grid - 1 - n_obligors / 2))
+    half_width = deviation_bound((deviations ** 2 @ probabilities).sum(), np.abs(deviations).max(), tail_probability)
+    half_width_rounding = deviation_bound(n_obligors / 4, 1.0, tail_probability)
+    if n_grid - 1 > 2 * half_width_rounding:
+        steps.append(2 * half_width / (n_grid - 1 - 2 * half_width_rounding))
+    if len(steps) == 0:
+        raise ValueError(f'Lattice of {n_grid} points is too small for {n_obligors} obligors, '
+                         f'use n_grid of at least {int(2 * half_width_rounding) + 2}')
+    return min(steps) if min(steps) > 0 else 1.0
+
+
+def rwa_distribution_fft(values, probabilities, n_grid=2 ** 18, chunk_size=16, tail_probability=1e-12):
+    """
+    Computes distribution of total RWA as sum of independent obligor RWAs by FFT convolution on a lattice.
+    Lattice spans the window around mean of total RWA beyond which Bernstein inequality leaves at most
+    tail_probability, or the whole range of total RWA if narrower. Window grows with square root of number of
+    obligors, so that books of any size fit the lattice, mass beyond the window wraps around it. Obligor values are
+    rounded to the lattice and mean rounding error is removed from the grid. Characteristic functions are multiplied
+    over obligors with distinct rounded values only, raised to number of obligors sharing them, so that cost is
+    O(n_distinct * n_grid) and temporaries hold chunk_size * n_grid values.
+    Remaining rounding error of total RWA is a sum of independent centred terms of at most one lattice step, its
+    bound grows with square root of number of obligors times the step, i.e. relative to standard deviation of RWA
+    as sqrt(n_obligors) / n_grid. Large books need larger n_grid, see describe_rwa_distribution.
+    :param values: array (n_obligors, n_movements) with RWA of each obligor for each movement
+    :param probabilities: array (n_movements,) with movement probabilities
+    :param n_grid: number of lattice points
+    :param chunk_size: number of distinct obligor values processed at once
+    :param tail_probability: probability of total RWA beyond the lattice window and of rounding error beyond
+                             max_abs_error
+    :return: tuple (grid, pmf, max_abs_error), where max_abs_error bounds the shift of any quantile caused
+             by rounding obligor values to the lattice, except for probability tail_probability
+    """
+    # Express obligor values relative to their minimum
+    values_min = values.min(axis=1)
+    values_range = values - values_min[:, None]
+    step = lattice_step(values_range, probabilities, n_grid, tail_probability)
+
+    # Round obligor values to lattice, mean rounding error shifts the grid
+    indices = np.rint(values_range / step).astype(np.int64)
+    errors = indices * step - values_range
+    mean_errors = errors @ probabilities
+    error_deviations = errors - mean_errors[:, None]
+
+    # Remaining rounding error is bounded by Bernstein inequality and by the sum of largest deviations
+    max_abs_error = min(deviation_bound((error_deviations ** 2 @ probabilities).sum(), np.abs(error_deviations).max(),
+                                        tail_probability),
+                        np.abs(error_deviations).max(axis=1).sum())
+
+    # First lattice point of the window centred at mean, lattice over the whole range starts at zero
+    index_start = 0
+    if indices.max(axis=1).sum() >= n_grid:
+        index_start = int(np.floor((indices @ probabilities).sum() - (n_grid - 1) / 2))
+
+    # Multiply characteristic functions of distinct obligor values, raised to number of obligors sharing them, using
+    # table of roots of unity instead of complex exponents
+    indices_distinct, counts = np.unique(indices, axis=0, return_counts=True)
+    frequencies = np.arange(n_grid // 2 + 1, dtype=np.int64)
+    roots = np.exp(-2j * np.pi * np.arange(n_grid) / n_grid)
+    characteristic = np.ones(len(frequencies), dtype=np.complex128)
+    for start in range(0, len(indices_distinct), chunk_size):
+        indices_chunk = indices_distinct[start:start + chunk_size]
+        counts_chunk = counts[start:start + chunk_size]
+        characteristic_chunk = np.zeros((len(indices_chunk), len(frequencies)), dtype=np.complex128)
+        for j, p in enumerate(probabilities):
+            if p > 0:
+                characteristic_chunk += p * roots[np.outer(indices_chunk[:, j], frequencies) % n_grid]
+        shared = counts_chunk > 1
+        characteristic_chunk[shared] **= counts_chunk[shared, None]
+        characteristic *= characteristic_chunk.prod(axis=0)
+
+    pmf = np.fft.irfft(characteristic, n=n_grid)
+    pmf = np.clip(pmf, 0, None)
+    pmf = np.roll(pmf / pmf.sum(), -index_start)
+
+    grid = values_min.sum() - mean_errors.sum() + step * (index_start + np.arange(n_grid))
+
+    return grid, pmf, max_abs_error
+
+
+def rwa_distribution_normal(values, probabilities):
+    """
+    Computes normal approximation of total RWA with Berry-Esseen bound on error of its CDF
+    :param values: array (n_obligors, n_movements) with RWA of each obligor for each movement
+    :param probabilities: array (n_movements,) with movement probabilities
+    :return: tuple (mean, std, cdf_error_bound)
+    """
+    means = values @ probabilities
+    deviations = values - means[:, None]
+    variance = (deviations ** 2) @ probabilities
+    third_moments = np.abs(deviations) ** 3 @ probabilities
+
+    mean = means.sum()
+    std = np.sqrt(variance.sum())
+
+    # Berry-Esseen constant for sums of non-identically distributed variables (Shevtsova, 2010)
+    cdf_error_bound = 0.5600 * third_moments.sum() / std ** 3
+
+    return mean, std, cdf_error_bound
+
+
+def quantile_from_pmf(grid, pmf, q):
+    """
+    Returns smallest lattice value with cumulative probability of at least q
+    """
+    cdf = np.cumsum(pmf)
+    return grid[min(np.searchsorted(cdf, q), len(grid) - 1)]
+
+
+@timed
+def describe_rwa_distribution(kernel, mgs, approach='linear', approach_params=None,
+                              quantiles=(0.5, 0.75, 0.99), method='fft', n_grid=2 ** 18, n_bins=50):
+    """
+    Computes distribution of RWA after independent mgs movements without random sampling
+    :param kernel: RwaKernel for capital calculation
+    :param mgs: array with current grade of each obligor
+    :param approach: 'linear' or 'normal', same as in run_movements
+    :param approach_params: parameters of the approach, same as in run_movements
+    :param quantiles: quantile levels of RWA after movements
+    :param method: 'fft' for lattice convolution, 'normal' for normal approximation. 'fft' falls back to normal
+                   approximation for large books, whose lattice rounding error exceeds error of normal approximation
+    :param n_grid: number of lattice points for 'fft' method, error of 'fft' relative to standard deviation of RWA
+                   grows as sqrt(n_obligors) / n_grid and its cost as n_distinct * n_grid, see rwa_distribution_fft
+    :param n_bins: number of histogram bins in returned summary
+    :return: dictionary with the same structure as OnlineSummary of simulation results
+    """
+    probabilities = movement_probabilities(approach, approach_params)
+    values = obligor_rwa_values(kernel, mgs)
+    mean, std, cdf_error_bound = rwa_distribution_normal(values, probabilities)
+
+    summary_rwa_new = {
+        'moments': {'mean': mean, 'std': std, 'min': values.min(axis=1).sum(), 'max': values.max(axis=1).sum()}
+    }
+
+    # Lattice rounding error grows with size of book relative to standard deviation of RWA, normal approximation
+    # is used instead when its error bound is smaller at all quantile levels
+    if method == 'fft':
+        from scipy.special import ndtri
+
+        normal_error = max(std * (ndtri(min(q + cdf_error_bound, 1 - 1e-12))
+                                  - ndtri(max(q - cdf_error_bound, 1e-12))) / 2 for q in quantiles)
+        step = lattice_step(values - values.min(axis=1)[:, None], probabilities, n_grid)
+        fft_error = deviation_bound(len(values) / 4 * step ** 2, step, tail_probability=1e-12)
+        if fft_error > normal_error:
+            print(f'Analytic RWA distribution: lattice of {n_grid:,} points bounds error by {fft_error:,.0f}, '
+                  f'normal approximation by {normal_error:,.0f}, using normal approximation')
+            method = 'normal'
+
+    if method == 'fft':
+        grid, pmf, max_abs_error = rwa_distribution_fft(values, probabilities, n_grid)
+        summary_rwa_new['quantiles'] = {str(q): quantile_from_pmf(grid, pmf, q) for q in quantiles}
+        summary_rwa_new['max_abs_error'] = max_abs_error
+
+        # Aggregate lattice to histogram over range with non-negligible probability
+        cdf = np.cumsum(pmf)
+        low = grid[np.searchsorted(cdf, 1e-9)]
+        high = grid[min(np.searchsorted(cdf, 1 - 1e-9), len(grid) - 1)]
+        edges = np.linspace(low, high, n_bins + 1)
+        counts, _ = np.histogram(grid, bins=edges, weights=pmf)
+        summary_rwa_new['histogram'] = {'edges': edges.tolist(), 'counts': counts.tolist()}
+
+    if method == 'normal':
+        from scipy.special import ndtr, ndtri
+
+        summary_rwa_new['quantiles'] = {str(q): mean + std * ndtri(q) for q in quantiles}
+        summary_rwa_new['quantiles_low'] = {str(q): mean + std * ndtri(max(q - cdf_error_bound, 1e-12))
+                                            for q in quantiles}
+        summary_rwa_new['quantiles_high'] = {str(q): mean + std * ndtri(min(q + cdf_error_bound, 1 - 1e-12))
+                                             for q in quantiles}
+        summary_rwa_new['cdf_error_bound'] = cdf_error_bound
+
+        edges = np.linspace(mean - 4 * std, mean + 4 * std, n_bins + 1)
+        counts = np.diff(ndtr((edges - mean) / std))
+        summary_rwa_new['histogram'] = {'edges': edges.tolist(), 'counts': counts.tolist()}
+
+    summary = {
+        'rwa': {'moments': {'mean': kernel.rwa}},
+        'rwa_new': summary_rwa_new
+    }
+    return summary
@@ -0,0 +1,245 @@
+import numpy as np
+import pandas as pd
+
+from _code._utilities import calculate_rw_components
+from _code._aggregation import DealObligorMap
+from _code._storage import load_clean_data
+from _code._instrumentation import timed
+
+
+# Deal columns defining segments of RWA breakdowns
+segment_columns = {
+    'pd_model': 'pd_model',
+    'approach': 'approach',
+    'cascade_flag': 'adjusted_cascade_flag',
+    'bucket': 'bucket'
+}
+
+
+def calculate_rw_factors(pd):
+    """
+    Calculates PD-only factors of CRR par 153 formula, so that RW = LGD * (factor_a + (M - 2.5) * factor_b)
+    :param pd: array with pd estimation (any shape)
+    :return: tuple of arrays (factor_a, factor_b) with the same shape as pd
+    """
+    components = calculate_rw_components(pd, lgd=1.0, maturity=2.5)
+    factor_a = components['rw']
+    factor_b = factor_a * components['rw_calc_b']
+    return factor_a, factor_b
+
+
+class RwaKernel(object):
+    """
+    RWA engine with deal level LGD, EAD and maturity terms precomputed and aggregated to obligor level.
+    RWA of a scenario is obtained from obligor grades or PDs as an index gather and a dot product with
+    obligor weights, without re-running Basel formula on every facility.
+    """
+
+    def __init__(self, df_deals, config_mgs, cis_codes,
+                 lgd='lgd', ead='ead', maturity='maturity', rwa='rwa_updated_calc', compact=False):
+        """
+        :param df_deals: DataFrame on facility level
+        :param config_mgs: DataFrame with mgs mapping, columns 'mgs' and 'pd_mid'
+        :param cis_codes: obligor identifiers defining order of obligor arrays used by the kernel
+        :param lgd: column to be used as lgd estimation
+        :param ead: column to be used as ead estimation
+        :param maturity: column to be used as effective maturity
+        :param rwa: column with baseline RWA of facility
+        :param compact: if True, deal level arrays are kept in float32, obligor level arrays stay in float64
+        """
+
+        # Map deals to obligor positions
+        self.deal_map = DealObligorMap(df_deals['cis_code'], cis_codes)
+        self.cis_codes = self.deal_map.cis_codes
+        self.deal_obligor = self.deal_map.deal_obligor
+        self.n_obligors = self.deal_map.n_obligors
+
+        # Aggregate scenario independent terms to obligor level (facilities with missing inputs carry no RWA)
+        weight_lgd_ead = (df_deals[lgd] * df_deals[ead]).to_numpy(dtype=np.float64)
+        weight_maturity = weight_lgd_ead * (df_deals[maturity].to_numpy(dtype=np.float64) - 2.5)
+        deal_dtype = np.float32 if compact else np.float64
+        self.deal_weight_a = np.nan_to_num(weight_lgd_ead).astype(deal_dtype, copy=False)
+        self.deal_weight_b = np.nan_to_num(weight_maturity).astype(deal_dtype, copy=False)
+        self.weight_a = self.deal_map.sum(np.nan_to_num(weight_lgd_ead))
+        self.weight_b = self.deal_map.sum(np.nan_to_num(weight_maturity))
+        del weight_lgd_ead, weight_maturity
+
+        # Baseline RWA
+        self.rwa = df_deals[rwa].sum()
+        self.deal_rwa = df_deals[rwa].to_numpy(dtype=deal_dtype)
+
+        # Segments of RWA breakdowns, see add_segment
+        self.segments = {}
+        self.segment_rwa = {}
+
+        # Precompute PD and RW factors per grade, indexed directly by mgs
+        mgs = config_mgs['mgs'].to_numpy(dtype=int)
+        self.grade_pd = np.full(mgs.max() + 1, np.nan)
+        self.grade_pd[mgs] = config_mgs['pd_mid'].to_numpy(dtype=np.float64)
+        self.grade_factor_a = np.full(mgs.max() + 1, np.nan)
+        self.grade_factor_b = np.full(mgs.max() + 1, np.nan)
+        self.grade_factor_a[mgs], self.grade_factor_b[mgs] = calculate_rw_factors(self.grade_pd[mgs])
+
+    def add_segment(self, name, deal_labels):
+        """
+        Adds segment to RWA breakdowns. Deal weights are aggregated once to obligor x segment level, so that RWA
+        by segment is obtained with the same factors and one more dot product as total RWA
+        :param name: name of segmentation, e.g. 'pd_model'
+        :param deal_labels: segment label of each deal, missing labels form segment 'missing'
+        """
+        codes, labels = pd.factorize(pd.Series(deal_labels), sort=True)
+        labels = [str(label) for label in labels]
+        if (codes < 0).any():
+            codes = np.where(codes < 0, len(labels), codes)
+            labels.append('missing')
+        n_labels = len(labels)
+
+        # Grouped sums of deal weights over obligor and segment codes
+        index = self.deal_obligor.astype(np.int64) * n_labels + codes
+        size = self.n_obligors * n_labels
+        weight_a = np.bincount(index, weights=self.deal_weight_a, minlength=size).reshape(self.n_obligors, n_labels)
+        weight_b = np.bincount(index, weights=self.deal_weight_b, minlength=size).reshape(self.n_obligors, n_labels)
+        self.segments[name] = (list(labels), weight_a, weight_b)
+
+        # Baseline RWA by segment
+        rwa = np.bincount(codes, weights=np.nan_to_num(self.deal_rwa), minlength=n_labels)
+        for label, value in zip(labels, rwa):
+            self.segment_rwa[f'{name}_{label}'] = value
+
+    def segment_names(self):
+        """
+        Returns names of RWA breakdown values, '<segmentation>_<label>'
+        """
+        return [f'{name}_{label}' for name, (labels, _, _) in self.segments.items() for label in labels]
+
+    def rwa_breakdown(self, factor_a, factor_b):
+        """
+        Returns portfolio RWA and dictionary with RWA by segment for obligor RW factors,
+        arrays of shape (n_obligors,) or (n_scenarios, n_obligors)
+        """
+        rwa = factor_a @ self.weight_a + factor_b @ self.weight_b
+        rwa_segments = {}
+        for name, (labels, weight_a, weight_b) in self.segments.items():
+            rwa_segment = factor_a @ weight_a + factor_b @ weight_b
+            for i, label in enumerate(labels):
+                rwa_segments[f'{name}_{label}'] = rwa_segment[:, i] if rwa_segment.ndim > 1 else rwa_segment[i]
+        return rwa, rwa_segments
+
+    def rwa_breakdown_from_grades(self, mgs):
+        """
+        Returns portfolio RWA and RWA by segment for obligor grades, see rwa_breakdown
+        """
+        return self.rwa_breakdown(self.grade_factor_a[mgs], self.grade_factor_b[mgs])
+
+    def rwa_breakdown_from_pd(self, pd_obligor):
+        """
+        Returns portfolio RWA and RWA by segment for obligor PDs, see rwa_breakdown
+        """
+        return self.rwa_breakdown(*calculate_rw_factors(pd_obligor))
+
+    def pd_from_grades(self, mgs):
+        """
+        Returns PDs for array of obligor grades (any shape)
+        """
+        return self.grade_pd[mgs]
+
+    def rwa_from_grades(self, mgs):
+        """
+        Returns portfolio RWA for obligor grades, array of shape (n_obligors,) or (n_scenarios, n_obligors)
+        """
+        return self.grade_factor_a[mgs] @ self.weight_a + self.grade_factor_b[mgs] @ self.weight_b
+
+    def rwa_from_pd(self, pd_obligor):
+        """
+        Returns portfolio RWA for obligor PDs, array of shape (n_obligors,) or (n_scenarios, n_obligors)
+        """
+        factor_a, factor_b = calculate_rw_factors(pd_obligor)
+        return factor_a @ self.weight_a + factor_b @ self.weight_b
+
+    def obligor_rwa_from_pd(self, pd_obligor):
+        """
+        Returns RWA of each obligor for obligor PDs, array of shape (n_obligors,) or (n_scenarios, n_obligors)
+        """
+        factor_a, factor_b = calculate_rw_factors(pd_obligor)
+        return factor_a * self.weight_a + factor_b * self.weight_b
+
+    def deal_rwa_from_pd(self, pd_obligor):
+        """
+        Returns RWA of each deal for obligor PDs scattered to deals, array of shape (n_deals,) or
+        (n_scenarios, n_deals)
+        """
+        factor_a, factor_b = calculate_rw_factors(pd_obligor)
+        return (self.deal_map.to_deals(factor_a) * self.deal_weight_a
+                + self.deal_map.to_deals(factor_b) * self.deal_weight_b)
+
+    def grade_obligor_table(self):
+        """
+        Returns table of RWA by grade (rows, indexed by mgs) and obligor (columns)
+        """
+        return np.outer(self.grade_factor_a, self.weight_a) + np.outer(self.grade_factor_b, self.weight_b)
+
+
+class IncrementalRwa(object):
+    """
+    RWA evaluator for scenarios changing PD of few obligors. RW factors of baseline obligor PDs and RWA they give are
+    held, and for each scenario RW factors are recomputed only for obligors whose PD changed, adding their RWA
+    deltas to the baseline. Cost of a scenario is proportional to number of changed obligors, not size of the book.
+    """
+
+    def __init__(self, kernel, pd_base):
+        """
+        :param kernel: RwaKernel for capital calculation
+        :param pd_base: array (n_obligors,) with baseline PD of each obligor, ordered as obligors of kernel
+        """
+        self.kernel = kernel
+        self.pd_base = np.asarray(pd_base, dtype=np.float64)
+        self.factor_a, self.factor_b = calculate_rw_factors(self.pd_base)
+        self.rwa, self.segment_rwa = kernel.rwa_breakdown(self.factor_a, self.factor_b)
+
+    def rwa_breakdown(self, positions, pd_new):
+        """
+        Returns portfolio RWA and dictionary with RWA by segment after PD change of given obligors, see
+        RwaKernel.rwa_breakdown
+        :param positions: array (n_changed,) or (n_scenarios, n_changed) with positions of obligors whose PD
+                          changed, each obligor at most once per scenario
+        :param pd_new: array with new PD of obligors at positions, same shape as positions
+        """
+        factor_a, factor_b = calculate_rw_factors(np.asarray(pd_new, dtype=np.float64))
+        delta_a = factor_a - self.factor_a[positions]
+        delta_b = factor_b - self.factor_b[positions]
+
+        rwa = self.rwa + (delta_a * self.kernel.weight_a[positions]
+                          + delta_b * self.kernel.weight_b[positions]).sum(axis=-1)
+        rwa_segments = {}
+        for name, (labels, weight_a, weight_b) in self.kernel.segments.items():
+            delta_segment = (delta_a[..., None] * weight_a[positions]
+                             + delta_b[..., None] * weight_b[positions]).sum(axis=-2)
+            for i, label in enumerate(labels):
+                rwa_segments[f'{name}_{label}'] = self.segment_rwa[f'{name}_{label}'] + delta_segment[..., i]
+        return rwa, rwa_segments
+
+
+@timed
+def load_rwa_kernel(cis_codes, segments=(), compact=False):
+    """
+    Builds RwaKernel from clean deal data and mgs mapping
+    :param cis_codes: obligor identifiers defining order of obligor arrays used by the kernel
+    :param segments: names of segmentations for RWA breakdowns, keys of segment_columns
+    :param compact: if True, deal data is loaded in compact dtypes and deal level arrays are kept in float32
+    """
+    columns = ['cis_code', 'lgd', 'ead', 'maturity', 'rwa_updated_calc']
+    columns = columns + [segment_columns[s] for s in segments if s != 'bucket']
+    if 'bucket' in segments:
+        columns = columns + ['mgs_updated']
+    df_deals = load_clean_data('clean_deal_data_merged', columns=columns, compact=compact)
+    config_mgs = load_clean_data('config_mgs_mapping', columns=['mgs', 'pd_mid', 'bucket'])
+
+    # Attach bucket of current grade of obligor
+    if 'bucket' in segments:
+        df_deals = pd.merge(df_deals, config_mgs[['mgs', 'bucket']].rename(columns={'mgs': 'mgs_updated'}),
+                            on=['mgs_updated'], how='left', validate='m:1')
+
+    kernel = RwaKernel(df_deals, config_mgs, cis_codes, compact=compact)
+    for s in segments:
+        kernel.add_segment(s, df_deals[segment_columns[s]])
+    return kernel
@@ -0,0 +1,202 @@
+import pandas as pd
+
+from _code._compact import compact_column, compact_data
+from _code._instrumentation import timed
+
+from _code._config import Confs
+config = Confs()
+
+storage_extensions = {
+    'feather': '.feather',
+    'parquet': '.parquet',
+    'csv': '.csv'
+}
+
+
+def get_clean_data_path(name, storage_format=None, relative=False):
+    """
+    Returns path of clean_data artifact for given storage format
+    :param name: name of artifact without extension, e.g. 'clean_deal_data_merged'
+    :param storage_format: 'feather', 'parquet' or 'csv', format from config if None
+    :param relative: if True, path is returned relative to data path
+    """
+    if storage_format is None:
+        storage_format = config.storage_format
+    path = 'clean_data/' + name + storage_extensions[storage_format]
+    if relative:
+        return path
+    return config.data_path + path
+
+
+@timed
+def save_clean_data(df, name, storage_format=None, export_csv=None):
+    """
+    Saves DataFrame as clean_data artifact
+    :param df: DataFrame to be saved
+    :param name: name of artifact without extension
+    :param storage_format: 'feather', 'parquet' or 'csv', format from config if None
+    :param export_csv: if True, artifact is additionally exported to csv, setting from config if None
+    """
+    if storage_format is None:
+        storage_format = config.storage_format
+    if export_csv is None:
+        export_csv = config.export_csv
+
+    path = get_clean_data_path(name, storage_format)
+    if storage_format == 'feather':
+        df.reset_index(drop=True).to_feather(path, compression='uncompressed')
+    if storage_format == 'parquet':
+        df.to_parquet(path, index=False)
+    if storage_format == 'csv' or export_csv:
+        df.to_csv(get_clean_data_path(name, 'csv'), index=False)
+
+
+@timed
+def read_data(path, storage_format, columns=None, compact=False, exact_columns=()):
+    """
+    Reads data file with preserved dtypes
+    :param path: path to file
+    :param storage_format: 'feather', 'parquet' or 'csv'
+    :param columns: list of columns to be loaded, all columns if None
+    :param compact: if True, columns are converted to compact dtypes on load (categoricals, downcast integers,
+                    float32 within tolerance), see _compact. Columnar formats are then read one column at a time,
+                    so that only one column is held in default dtype at once
+    :param exact_columns: columns kept in stored dtype if compact is True
+    """
+    if storage_format in ['feather', 'parquet']:
+        import pyarrow.parquet as pq
+        from pyarrow import feather
+
+        def read_table(columns_table):
+            if storage_format == 'feather':
+                return feather.read_table(path, columns=columns_table, memory_map=True)
+            return pq.read_table(path, columns=columns_table)
+
+        if not compact:
+            return read_table(columns).to_pandas()
+
+        if columns is None:
+            if storage_format == 'feather':
+                import pyarrow as pa
+                columns = pa.ipc.open_file(pa.memory_map(path)).schema.names
+            else:
+                columns = pq.read_schema(path).names
+        df = pd.DataFrame({c: compact_column(read_table([c]).column(c)) if c not in exact_columns
+                           else read_table([c]).column(c).to_pandas() for c in columns})
+
+    if storage_format == 'csv':
+        df = pd.read_csv(path, usecols=columns)
+        if columns is not None:
+            df = df[columns]
+        if compact:
+            df = compact_data(df, exact_columns=exact_columns)
+
+    return df
+
+
+def load_clean_data(name, columns=None, storage_format=None, compact=False, exact_columns=()):
+    """
+    Loads clean_data artifact with preserved dtypes
+    :param name: name of artifact without extension
+    :param columns: list of columns to be loaded, all columns if None
+    :param storage_format: 'feather', 'parquet' or 'csv', format from config if None
+    :param compact: if True, columns are converted to compact dtypes on load, see read_data
+    :param exact_columns: columns kept in stored dtype if compact is True
+    """
+    if storage_format is None:
+        storage_format = config.storage_format
+
+    path = get_clean_data_path(name, storage_format)
+    return read_data(path, storage_format, columns, compact, exact_columns)
+
+
+class CleanDataWriter(object):
+    """
+    Writes clean_data artifact from chunks as they arrive, so that only one chunk is held in memory. Types of a column
+    may differ between chunks (e.g. all missing values in one chunk, integers in one chunk and floats in another), so
+    columnar formats are written in two passes. Chunks are spilled to temporary Arrow files with their own schemas,
+    which are unified with type promotion on close (null to any type, integer to float), and the spilled chunks are
+    then cast to the unified schema and written one at a time as record batches (feather) or row groups (parquet).
+    A single chunk is written directly.
+    """
+
+    def __init__(self, name, storage_format=None, export_csv=None):
+        self.name = name
+        self.storage_format = config.storage_format if storage_format is None else storage_format
+        self.export_csv = config.export_csv if export_csv is None else export_csv
+        self.first_table = None
+        self.spill_paths = []
+        self.schemas = []
+        self.n_chunks = 0
+
+    def append(self, df):
+        if self.storage_format == 'csv' or self.export_csv:
+            if self.n_chunks == 0:
+                df.to_csv(get_clean_data_path(self.name, 'csv'), index=False)
+            else:
+                df.to_csv(get_clean_data_path(self.name, 'csv'), index=False, header=False, mode='a')
+        if self.storage_format != 'csv':
+            self.spill(df)
+        self.n_chunks += 1
+
+    def spill(self, df):
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata(None)
+        self.schemas.append(table.schema)
+
+        # First chunk is held until the second one arrives, so that a single chunk is not written twice
+        if self.first_table is None and len(self.spill_paths) == 0:
+            self.first_table = table
+            return
+        if self.first_table is not None:
+            self.write_spill(self.first_table)
+            self.first_table = None
+        self.write_spill(table)
+
+    def write_spill(self, table):
+        import pyarrow as pa
+
+        path = get_clean_data_path(self.name, self.storage_format) + f'.part{len(self.spill_paths)}'
+        with pa.ipc.new_file(path, table.schema) as writer:
+            writer.write_table(table)
+        self.spill_paths.append(path)
+
+    def write_tables(self, schema, tables):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        path = get_clean_data_path(self.name, self.storage_format)
+        if self.storage_format == 'feather':
+            writer = pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(compression=None))
+        if self.storage_format == 'parquet':
+            writer = pq.ParquetWriter(path, schema)
+        with writer:
+            for table in tables:
+                writer.write_table(table.cast(schema))
+
+    def read_spills(self):
+        import os
+        import pyarrow as pa
+
+        for path in self.spill_paths:
+            with pa.OSFile(path, 'rb') as source:
+                table = pa.ipc.open_file(source).read_all()
+            yield table
+            del table
+            os.remove(path)
+
+    def close(self):
+        import pyarrow as pa
+
+        if len(self.schemas) == 0:
+            return
+        schema = pa.unify_schemas(self.schemas, promote_options='permissive')
+        if self.first_table is not None:
+            self.write_tables(schema, [self.first_table])
+            self.first_table = None
+        else:
+            self.write_tables(schema, self.read_spills())
+        self.spill_paths = []
+        self.schemas = []
@@ -0,0 +1,244 @@
+import importlib.util
+
+import numpy as np
+
+from _code._instrumentation import timed
+
+# Numba is optional, kernel falls back to NumPy when it is not installed. Numba is slow to import, it is imported
+# and kernel compiled on first use
+numba_installed = importlib.util.find_spec('numba') is not None
+numba = None
+
+
+class SwapPlan(object):
+    """
+    Swap matrix translated to integer arrays. In each scenario obligors are drawn from a bucket by partial
+    Fisher-Yates shuffle and swaps consume them in order of drawing, so only as many random numbers as there are
+    swapped obligors are needed and every swap row reads a fixed slice of drawn obligors.
+    """
+
+    def __init__(self, bucket, df_swaps):
+        """
+        :param bucket: array with bucket of each obligor
+        :param df_swaps: DataFrame with columns 'from_bucket', 'to_bucket' and 'swaps'
+        """
+        buckets, bucket_codes = np.unique(np.asarray(bucket), return_inverse=True)
+        self.n_obligors = len(bucket_codes)
+
+        # Positions of obligors grouped by bucket
+        self.bucket_order = np.argsort(bucket_codes, kind='stable').astype(np.int64)
+        self.bucket_sizes = np.bincount(bucket_codes, minlength=len(buckets)).astype(np.int64)
+        self.bucket_starts = np.concatenate([[0], np.cumsum(self.bucket_sizes)[:-1]]).astype(np.int64)
+        self.bucket_taken = np.zeros(len(buckets), dtype=np.int64)
+        bucket_index = {b: i for i, b in enumerate(buckets)}
+
+        # Get number of obligors taken from bucket before each swap row
+        swaps_rows = []
+        for from_bucket, to_bucket, swaps in zip(df_swaps['from_bucket'], df_swaps['to_bucket'], df_swaps['swaps']):
+            if swaps > 0:
+                # Raise errors if number of remaining observations in buckets is not sufficient to execute swaps matrix
+                for b in [from_bucket, to_bucket]:
+                    i = bucket_index.get(b)
+                    available = self.bucket_sizes[i] - self.bucket_taken[i] if i is not None else 0
+                    if available < swaps:
+                        print(f'   Error: Not sufficient number of observation in {b} to execute swaps matrix')
+                        assert False
+
+                i_from = bucket_index[from_bucket]
+                i_to = bucket_index[to_bucket]
+                swaps_rows.append((i_from, self.bucket_taken[i_from], i_to, self.bucket_taken[i_to], swaps))
+                self.bucket_taken[i_from] += swaps
+                self.bucket_taken[i_to] += swaps
+
+        # Position of first obligor of each swap row among obligors drawn from all buckets
+        self.drawn_starts = np.concatenate([[0], np.cumsum(self.bucket_taken)[:-1]]).astype(np.int64)
+        self.n_drawn = self.bucket_taken.sum()
+        self.swap_from_start = np.array([self.drawn_starts[r[0]] + r[1] for r in swaps_rows], dtype=np.int64)
+        self.swap_to_start = np.array([self.drawn_starts[r[2]] + r[3] for r in swaps_rows], dtype=np.int64)
+        self.swap_count = np.array([r[4] for r in swaps_rows], dtype=np.int64)
+
+        # Drawn obligor whose PD is taken by each drawn obligor, all other obligors keep their PD
+        self.partner_slots = np.arange(self.n_drawn, dtype=np.int64)
+        for start_from, start_to, count in zip(self.swap_from_start, self.swap_to_start, self.swap_count):
+            self.partner_slots[start_from:start_from + count] = np.arange(start_to, start_to + count)
+            self.partner_slots[start_to:start_to + count] = np.arange(start_from, start_from + count)
+
+    def draw_uniforms(self, rng, n_scenarios):
+        """
+        Returns uniforms of shape (n_scenarios, n_drawn) driving the draws of obligors
+        """
+        return rng.random((n_scenarios, self.n_drawn))
+
+    def kernel_arguments(self):
+        return (self.bucket_order, self.bucket_starts, self.bucket_sizes, self.bucket_taken,
+                self.drawn_starts, self.n_drawn, self.swap_from_start, self.swap_to_start, self.swap_count)
+
+    def draw_arguments(self):
+        return self.kernel_arguments()[:6]
+
+
+def _draw_obligors_numpy(uniforms, bucket_order, bucket_starts, bucket_sizes, bucket_taken, drawn_starts, n_drawn):
+    n_scenarios = uniforms.shape[0]
+    scenarios = np.arange(n_scenarios)
+
+    # Draw obligors of each bucket by partial Fisher-Yates shuffle, vectorized over scenarios
+    drawn = np.empty((n_scenarios, n_drawn), dtype=np.int64)
+    for start, size, taken, drawn_start in zip(bucket_starts, bucket_sizes, bucket_taken, drawn_starts):
+        if taken > 0:
+            positions = np.tile(bucket_order[start:start + size], (n_scenarios, 1))
+            for t in range(taken):
+                j = t + np.minimum((uniforms[:, drawn_start + t] * (size - t)).astype(np.int64), size - t - 1)
+                drawn[:, drawn_start + t] = positions[scenarios, j]
+                positions[scenarios, j] = positions[:, t]
+    return drawn
+
+
+def _swap_sources_numpy(uniforms, bucket_order, bucket_starts, bucket_sizes, bucket_taken, drawn_starts, n_drawn,
+                        swap_from_start, swap_to_start, swap_count):
+    n_scenarios = uniforms.shape[0]
+    n_obligors = len(bucket_order)
+    drawn = _draw_obligors_numpy(uniforms, bucket_order, bucket_starts, bucket_sizes, bucket_taken, drawn_starts,
+                                 n_drawn)
+
+    # Swap drawn obligors
+    source = np.tile(np.arange(n_obligors, dtype=np.int64), (n_scenarios, 1))
+    for start_from, start_to, count in zip(swap_from_start, swap_to_start, swap_count):
+        index_from = drawn[:, start_from:start_from + count]
+        index_to = drawn[:, start_to:start_to + count]
+        np.put_along_axis(source, index_from, index_to, axis=1)
+        np.put_along_axis(source, index_to, index_from, axis=1)
+    return source
+
+
+def _swap_sources_loop(uniforms, bucket_order, bucket_starts, bucket_sizes, bucket_taken, drawn_starts, n_drawn,
+                       swap_from_start, swap_to_start, swap_count):
+    n_scenarios = uniforms.shape[0]
+    n_obligors = len(bucket_order)
+    source = np.empty((n_scenarios, n_obligors), dtype=np.int64)
+    for s in numba.prange(n_scenarios):
+        # Draw obligors of each bucket by partial Fisher-Yates shuffle
+        drawn = np.empty(n_drawn, dtype=np.int64)
+        for b in range(len(bucket_starts)):
+            taken = bucket_taken[b]
+            if taken > 0:
+                size = bucket_sizes[b]
+                positions = bucket_order[bucket_starts[b]:bucket_starts[b] + size].copy()
+                for t in range(taken):
+                    j = t + min(np.int64(uniforms[s, drawn_starts[b] + t] * (size - t)), size - t - 1)
+                    drawn[drawn_starts[b] + t] = positions[j]
+                    positions[j] = positions[t]
+
+        # Swap drawn obligors
+        for i in range(n_obligors):
+            source[s, i] = i
+        for k in range(len(swap_count)):
+            for t in range(swap_count[k]):
+                index_from = drawn[swap_from_start[k] + t]
+                index_to = drawn[swap_to_start[k] + t]
+                source[s, index_from] = index_to
+                source[s, index_to] = index_from
+    return source
+
+
+def _draw_obligors_loop(uniforms, bucket_order, bucket_starts, bucket_sizes, bucket_taken, drawn_starts, n_drawn,
+                        n_blocks):
+    n_scenarios = uniforms.shape[0]
+    drawn = np.empty((n_scenarios, n_drawn), dtype=np.int64)
+    block_size = (n_scenarios + n_blocks - 1) // n_blocks
+    for block in numba.prange(n_blocks):
+        # Working copy of obligor positions is restored after each scenario, so that a scenario costs
+        # O(drawn obligors) instead of O(obligors)
+        positions = bucket_order.copy()
+        for s in range(block * block_size, min((block + 1) * block_size, n_scenarios)):
+            for b in range(len(bucket_starts)):
+                start = bucket_starts[b]
+                size = bucket_sizes[b]
+                for t in range(bucket_taken[b]):
+                    j = t + min(np.int64(uniforms[s, drawn_starts[b] + t] * (size - t)), size - t - 1)
+                    drawn[s, drawn_starts[b] + t] = positions[start + j]
+                    positions[start + j] = positions[start + t]
+
+                # Undo partial shuffle in reverse order, each step overwrote the obligor it has drawn
+                for t in range(bucket_taken[b] - 1, -1, -1):
+                    j = t + min(np.int64(uniforms[s, drawn_starts[b] + t] * (size - t)), size - t - 1)
+                    positions[start + j] = drawn[s, drawn_starts[b] + t]
+    return drawn
+
+
+_swap_sources_numba = None
+_draw_obligors_numba = None
+
+
+def get_swap_sources_numba():
+    # Return compiled kernel, importing numba on first call
+    global numba, _swap_sources_numba
+    if _swap_sources_numba is None:
+        import numba
+        _swap_sources_numba = numba.njit(parallel=True, cache=True)(_swap_sources_loop)
+    return _swap_sources_numba
+
+
+def get_draw_obligors_numba():
+    # Return compiled kernel, importing numba on first call
+    global numba, _draw_obligors_numba
+    if _draw_obligors_numba is None:
+        import numba
+        _draw_obligors_numba = numba.njit(parallel=True, cache=True)(_draw_obligors_loop)
+    return _draw_obligors_numba
+
+
+@timed
+def swap_sources(plan, uniforms, engine=None):
+    """
+    Executes swap matrix for many scenarios at once
+    :param plan: SwapPlan of the portfolio
+    :param uniforms: array of shape (n_scenarios, n_drawn) from SwapPlan.draw_uniforms
+    :param engine: 'numba' or 'numpy', None to use numba when installed. Both engines give identical results,
+                   numpy engine loops over drawn obligors in Python and is fast only for large chunks of scenarios
+    :return: array (n_scenarios, n_obligors) with position of obligor whose PD is taken by each obligor
+    """
+    if engine is None:
+        engine = 'numba' if numba_installed else 'numpy'
+
+    if engine == 'numba':
+        return get_swap_sources_numba()(uniforms, *plan.kernel_arguments())
+    if engine == 'numpy':
+        return _swap_sources_numpy(uniforms, *plan.kernel_arguments())
+
+
+def swap_pd(plan, pd_obligor, uniforms, engine=None):
+    """
+    Returns new PD vector of each scenario, array of shape (n_scenarios, n_obligors), see swap_sources
+    """
+    return np.asarray(pd_obligor, dtype=np.float64)[swap_sources(plan, uniforms, engine)]
+
+
+@timed
+def draw_obligors(plan, uniforms, engine=None):
+    """
+    Draws obligors to be swapped for many scenarios at once, in the same way as swap_sources
+    :param plan: SwapPlan of the portfolio
+    :param uniforms: array of shape (n_scenarios, n_drawn) from SwapPlan.draw_uniforms
+    :param engine: 'numba' or 'numpy', None to use numba when installed. Numba engine costs O(drawn obligors) per
+                   scenario, numpy engine copies buckets with drawn obligors for each scenario
+    :return: array (n_scenarios, n_drawn) with positions of drawn obligors, grouped by swap rows of plan
+    """
+    if engine is None:
+        engine = 'numba' if numba_installed else 'numpy'
+
+    if engine == 'numba':
+        from numba import get_num_threads
+
+        n_blocks = max(1, min(get_num_threads(), len(uniforms)))
+        return get_draw_obligors_numba()(uniforms, *plan.draw_arguments(), n_blocks)
+    if engine == 'numpy':
+        return _draw_obligors_numpy(uniforms, *plan.draw_arguments())
+
+
+def swap_changes(plan, pd_obligor, uniforms, engine=None):
+    """
+    Returns swapped obligors and their new PDs for each scenario, without touching obligors that keep their PD
+    :return: tuple (positions, pd_new) of arrays of shape (n_scenarios, n_drawn), see draw_obligors
+    """
+    positions = draw_obligors(plan, uniforms, engine)
+    return positions, np.asarray(pd_obligor, dtype=np.float64)[positions[:, plan.partner_slots]]
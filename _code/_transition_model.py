@@ -0,0 +1,90 @@
+import numpy as np
+
+from _code._rwa_distribution import tilt_probabilities
+
+
+class TransitionMigration(object):
+    """
+    Grade migration driven by a grade-to-grade transition matrix. New grade of an obligor is drawn from the row of
+    its current grade by inverse CDF of a uniform draw. Cumulative rows of all grades are laid out in one sorted
+    array, each row shifted by its index, so that new grades of all obligors and scenarios are found by a single
+    sorted search. Migrations over several periods use matrix powers, which are cached per horizon together with
+    their cumulative rows. Rows can be exponentially tilted towards downgrades for importance sampling.
+    """
+
+    def __init__(self, config_transitions):
+        """
+        :param config_transitions: DataFrame with transition matrix, columns 'from_mgs', 'to_mgs' and
+                                   'probability', see clean_transition_matrix of clean_config
+        """
+        assert len(config_transitions) > 0, 'Transition matrix is missing in config, see clean_transition_matrix'
+        self.n_grades = int(config_transitions[['from_mgs', 'to_mgs']].to_numpy().max())
+
+        # One period matrix over grades 1..n_grades, row and column i - 1 of grade i
+        self.matrix = np.zeros((self.n_grades, self.n_grades))
+        self.matrix[config_transitions['from_mgs'].to_numpy(dtype=int) - 1,
+                    config_transitions['to_mgs'].to_numpy(dtype=int) - 1] = \
+            config_transitions['probability'].to_numpy(dtype=np.float64)
+        assert np.allclose(self.matrix.sum(axis=1), 1)
+
+        # Matrix powers by horizon, tilted matrices and their shifted cumulative rows by horizon and tilt
+        self.powers = {1: self.matrix}
+        self.tilted = {}
+        self.search_tables = {}
+
+    def matrix_power(self, horizon=1):
+        """
+        Returns transition matrix over horizon periods, computed once per horizon
+        """
+        if horizon not in self.powers:
+            self.powers[horizon] = np.linalg.matrix_power(self.matrix, horizon)
+        return self.powers[horizon]
+
+    def tilted_matrix(self, horizon=1, tilt=0.0):
+        """
+        Returns transition matrix over horizon with rows tilted towards downgrades, see tilt_probabilities, and
+        log M(tilt) of each row
+        """
+        if (horizon, tilt) not in self.tilted:
+            grades = np.arange(self.n_grades)
+            movements = grades[None, :] - grades[:, None]
+            self.tilted[horizon, tilt] = tilt_probabilities(self.matrix_power(horizon), movements, tilt)
+        return self.tilted[horizon, tilt]
+
+    def log_mgf(self, mgs, horizon=1, tilt=0.0):
+        """
+        Returns log M(tilt) of rows of obligor grades, zero for grades not covered by the matrix
+        """
+        mgs = np.asarray(mgs, dtype=np.int64)
+        inside = (mgs >= 1) & (mgs <= self.n_grades)
+        return np.where(inside, self.tilted_matrix(horizon, tilt)[1][np.clip(mgs, 1, self.n_grades) - 1], 0.0)
+
+    def search_table(self, horizon=1, tilt=0.0):
+        """
+        Returns cumulative rows of transition matrix over horizon, row i - 1 shifted by i - 1 and flattened, so that
+        the table is sorted and u + i - 1 for uniform u falls into the row of grade i
+        """
+        if (horizon, tilt) not in self.search_tables:
+            matrix = self.matrix_power(horizon) if tilt == 0 else self.tilted_matrix(horizon, tilt)[0]
+            cumulative = np.cumsum(matrix, axis=1)
+            cumulative[:, -1] = 1.0
+            self.search_tables[horizon, tilt] = (cumulative + np.arange(self.n_grades)[:, None]).ravel()
+        return self.search_tables[horizon, tilt]
+
+    def grades_from_uniforms(self, mgs, uniforms, horizon=1, tilt=0.0):
+        """
+        Returns new grades for uniform draws. Obligors in grades not covered by the matrix (e.g. defaulted)
+        keep their grade
+        :param mgs: array (n_obligors,) with current grade of each obligor
+        :param uniforms: array (n_scenarios, n_obligors) of uniforms on [0, 1)
+        :param horizon: number of periods of migration
+        :param tilt: tilt of rows towards downgrades for importance sampling, see tilted_matrix
+        :return: array (n_scenarios, n_obligors) of new grades
+        """
+        mgs = np.asarray(mgs, dtype=np.int64)
+        inside = (mgs >= 1) & (mgs <= self.n_grades)
+        row = np.clip(mgs, 1, self.n_grades) - 1
+
+        index = np.searchsorted(self.search_table(horizon, tilt), uniforms + row, side='right') - row * self.n_grades
+        mgs_new = np.clip(index, 0, self.n_grades - 1) + 1
+        return np.where(inside, mgs_new, mgs).astype(np.int16)
@@ -1,9 +1,71 @@
 import numpy as np
 
-from statistics import NormalDist
-from scipy.stats import norm
+from _code._instrumentation import timed
 
 
+def calculate_rw_components(pd, lgd, maturity):
+    """
+    Calculates interim components of CRR par 153 risk weight formula on NumPy arrays
+    :param pd: array with pd estimation
+    :param lgd: array with lgd estimation
+    :param maturity: array with effective maturity
+    :return: dictionary with arrays of interim components and risk weight under key 'rw'
+    """
+    from scipy.special import ndtr, ndtri
+
+    pd = np.asarray(pd, dtype=np.float64)
+    lgd = np.asarray(lgd, dtype=np.float64)
+    maturity = np.asarray(maturity, dtype=np.float64)
+
+    # Calculate maturity adjustment factor [b]
+    b = (0.11852 - 0.05478 * np.log(pd)) ** 2
+    assert np.isnan(b).sum() == 0
+
+    # Calculate maturity component
+    part_maturity = (1 + (maturity - 2.5) * b) / (1 - 1.5 * b)
+    assert np.isnan(part_maturity).sum() == 0
+
+    # Calculate coefficient of correlation
+    r = 0.12 * (1 - np.e ** (-50 * pd)) / (1 - np.e ** (-50)) \
+        + 0.24 * (1 - (1 - np.e ** (-50 * pd)) / (1 - np.e ** (-50)))
+    assert np.isnan(r).sum() == 0
+
+    # Calculate sum of inverse cumulative distribution function components
+    inverse_comp_sum = (1 / np.sqrt(1 - r)) * ndtri(pd) + np.sqrt(r / (1 - r)) * ndtri(0.999)
+    assert np.isnan(inverse_comp_sum).sum() == 0
+
+    # Calculate PD LGD component
+    part_pd_lgd_component = lgd * ndtr(inverse_comp_sum) - lgd * pd
+
+    # Calculate risk weight
+    rw = part_pd_lgd_component * part_maturity * 12.5 * 1.06
+
+    components = {
+        'rw_calc_b': b,
+        'rw_calc_part_maturity': part_maturity,
+        'rw_calc_r': r,
+        'rw_inverse_comp_sum': inverse_comp_sum,
+        'rw_calc_part_pd_lgd_component': part_pd_lgd_component,
+        'rw': rw
+    }
+    return components
+
+
+def calculate_rwa_array(pd, lgd, ead, maturity):
+    """
+    Calculates risk weights and RWA on facility level on NumPy arrays without per-row Python calls
+    :param pd: array with pd estimation
+    :param lgd: array with lgd estimation
+    :param ead: array with ead estimation
+    :param maturity: array with effective maturity
+    :return: tuple of arrays (risk weight, risk weighted assets)
+    """
+    rw = calculate_rw_components(pd, lgd, maturity)['rw']
+    rwa = rw * np.asarray(ead, dtype=np.float64)
+    return rw, rwa
+
+
+@timed
 def calculate_rwa(df,
                   pd='pd', lgd='lgd', ead='ead', maturity='maturity',
                   rw='rw_calc', rwa='rwa_calc',
@@ -17,39 +79,24 @@ def calculate_rwa(df,
     :param maturity: column to be used as effective maturity
     :param rw: column added to DataFrame with risk weight value
     :param rwa: column added to DataFrame with risk weighted assets value
-    :param drop_interim_columns: if True, columns used for interim calculation are dropped from returned DataFrame
+    :param drop_interim_columns: if True, columns used for interim calculation are not added to returned DataFrame
     """
 
-    # Calculate maturity adjustment factor [b]
-    df['rw_calc_b'] = (0.11852 - 0.05478 * np.log(df[pd])) ** 2
-    assert df['rw_calc_b'].isnull().sum() == 0
-
-    # Calculate maturity component
-    df['rw_calc_part_maturity'] = (1 + (df[maturity] - 2.5) * df['rw_calc_b']) / (
-                1 - 1.5 * df['rw_calc_b'])
-    assert df['rw_calc_part_maturity'].isnull().sum() == 0
-
-    # Calculate coefficient of correlation
-    df['rw_calc_r'] = 0.12 * (1 - np.e ** (-50 * df[pd])) / (1 - np.e ** (-50)) \
-                      + 0.24 * (1 - (1 - np.e ** (-50 * df[pd])) / (1 - np.e ** (-50)))
-    assert df['rw_calc_r'].isnull().sum() == 0
-
-    # Calculate sum of inverse cumulative distribution function components
-    df['rw_inverse_comp_sum'] = (1 / np.sqrt(1 - df['rw_calc_r'])) * df[pd].apply(NormalDist().inv_cdf) + \
-                                np.sqrt(df['rw_calc_r'] / (1 - df['rw_calc_r'])) * NormalDist().inv_cdf(0.999)
-    assert df['rw_inverse_comp_sum'].isnull().sum() == 0
+    # Calculate risk weight components on arrays
+    components = calculate_rw_components(
+        df[pd].to_numpy(dtype=np.float64),
+        df[lgd].to_numpy(dtype=np.float64),
+        df[maturity].to_numpy(dtype=np.float64))
 
-    # Calculate PD LGD component
-    df['rw_calc_part_pd_lgd_component'] = df[lgd] * df['rw_inverse_comp_sum'].apply(norm.cdf) - df[lgd] * df[pd]
+    # Keep columns used for interim calculation if requested
+    if not drop_interim_columns:
+        cols_interim = ['rw_calc_b', 'rw_calc_part_maturity', 'rw_calc_r',
+                        'rw_inverse_comp_sum', 'rw_calc_part_pd_lgd_component']
+        for col in cols_interim:
+            df[col] = components[col]
 
-    # Calculate risk weight and RWAs
-    df[rw] = df['rw_calc_part_pd_lgd_component'] * df['rw_calc_part_maturity'] * 12.5 * 1.06
+    # Add risk weight and RWAs
+    df[rw] = components['rw']
     df[rwa] = df[rw] * df[ead]
 
-    # Drop columns added for interim calculation
-    if drop_interim_columns:
-        cols_to_drop = ['rw_calc_b', 'rw_calc_part_maturity', 'rw_calc_r',
-                        'rw_inverse_comp_sum', 'rw_calc_part_pd_lgd_component']
-        df.drop(columns=cols_to_drop, inplace=True)
-
     return df
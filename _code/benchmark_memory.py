@@ -0,0 +1,104 @@
+import os
+import tempfile
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from _code._instrumentation import peak_rss_mb, read_status_mb
+
+
+def make_deal_book(n_deals=10 ** 6, n_obligors=200000, seed=0):
+    """
+    Returns synthetic deal book with columns of clean_deal_data_merged used by RwaKernel and segment breakdowns
+    """
+    rng = np.random.default_rng(seed)
+    cis_code = 100000 + rng.integers(0, n_obligors, n_deals)
+    mgs = (cis_code * 7919) % 26 + 1
+    df = pd.DataFrame({
+        'cis_code': cis_code,
+        'pd_model': rng.choice(['BANK', 'CORP', 'SME'], n_deals),
+        'approach': rng.choice(['AIRB', 'FIRB'], n_deals),
+        'adjusted_cascade_flag': rng.choice(['Y', 'N'], n_deals),
+        'ead': rng.lognormal(13, 1.5, n_deals),
+        'lgd': rng.uniform(0.05, 0.75, n_deals),
+        'maturity': rng.uniform(1, 5, n_deals),
+        'mgs_updated': mgs
+    })
+    df['rwa_updated_calc'] = df['ead'] * rng.uniform(0.2, 1.5, n_deals)
+    return df
+
+
+def make_config_mgs():
+    mgs = np.arange(1, 27)
+    pd_mid = np.append(np.geomspace(0.0003, 0.3, 25), 1.0)
+    return pd.DataFrame({'mgs': mgs, 'pd_mid': pd_mid})
+
+
+def run_variant(path, compact, n_scenarios):
+    """
+    Loads deal book, builds kernel with segment breakdowns and evaluates scenarios. Runs in a fresh process,
+    so that peak RSS covers only this variant
+    """
+    import pyarrow.parquet
+
+    from _code._storage import read_data
+    from _code._rwa_kernel import RwaKernel, segment_columns
+
+    rss_start = peak_rss_mb()
+
+    df_deals = read_data(path, 'feather', compact=compact)
+    rss_loaded = peak_rss_mb()
+
+    kernel = RwaKernel(df_deals, make_config_mgs(), np.sort(df_deals['cis_code'].unique()), compact=compact)
+    for segment in ['pd_model', 'approach', 'cascade_flag']:
+        kernel.add_segment(segment, df_deals[segment_columns[segment]])
+    memory_frame = df_deals.memory_usage(deep=True).sum() / 1024 ** 2
+    rss_kernel = read_status_mb('VmRSS')
+    del df_deals
+
+    rng = np.random.default_rng(0)
+    mgs = rng.integers(1, 27, (n_scenarios, kernel.n_obligors))
+    rwa, _ = kernel.rwa_breakdown_from_grades(mgs)
+    rwa_deals = kernel.deal_rwa_from_pd(kernel.pd_from_grades(mgs[0]))
+
+    return {
+        'compact': compact,
+        'frame_mb': memory_frame,
+        'rss_with_kernel_mb': rss_kernel - rss_start if rss_kernel is not None else np.nan,
+        'peak_rss_load_mb': rss_loaded - rss_start,
+        'peak_rss_mb': peak_rss_mb() - rss_start,
+        'rwa_mean': rwa.mean(),
+        'rwa_deals': rwa_deals.sum(dtype=np.float64)
+    }
+
+
+def main(n_deals=10 ** 6, n_obligors=200000, n_scenarios=4, rtol=1e-6):
+    """
+    Compares peak RSS of deal book in default dtypes (float64, object strings, int64) and in compact dtypes
+    (float32, categoricals, narrow integers). Each variant runs in a separate process.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'deal_book.feather')
+        make_deal_book(n_deals, n_obligors).to_feather(path, compression='uncompressed')
+
+        context = multiprocessing.get_context('spawn')
+        rows = []
+        for compact in [False, True]:
+            with context.Pool(processes=1) as pool:
+                rows.append(pool.apply(run_variant, (path, compact, n_scenarios)))
+
+    df_result = pd.DataFrame(rows)
+    print(df_result.to_string(index=False))
+
+    # Check that compact representation is within tolerance of default one
+    for c in ['rwa_mean', 'rwa_deals']:
+        relative_difference = abs(df_result[c].iloc[1] / df_result[c].iloc[0] - 1)
+        print(f'Relative difference of {c}: {relative_difference:.2e}')
+        assert relative_difference < rtol
+
+    return df_result
+
+
+if __name__ == '__main__':
+    main()
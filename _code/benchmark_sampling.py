@@ -0,0 +1,89 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from _code._rwa_kernel import load_rwa_kernel
+from _code._storage import load_clean_data
+from _code.simulate_approach_mgs_movements import result_columns, run_movements, run_movements_batched
+
+
+def run_replicate(df, kernel, n_scenarios, approach, approach_params, sampling, seed):
+    # Return simulated RWA of one replicate and CPU time spent
+    start = time.process_time()
+    if sampling == 'sequential':
+        rows = [run_movements(df, kernel, seed * n_scenarios + i, approach, approach_params)
+                for i in range(n_scenarios)]
+        rwa_new = np.array([row[result_columns.index('rwa_new')] for row in rows])
+    else:
+        df_result = run_movements_batched(df, kernel, n_scenarios, approach, approach_params,
+                                          chunk_size=n_scenarios, seed=seed, sampling=sampling)
+        rwa_new = df_result['rwa_new'].to_numpy()
+    return rwa_new, time.process_time() - start
+
+
+def main(n_scenarios=1024, n_replicates=50, approach='normal', approach_params=None,
+         samplings=('sequential', 'random', 'antithetic', 'lhs', 'sobol'), quantile=0.75):
+    """
+    Compares standard error of mean and quantile of simulated RWA per CPU-second across sampling modes.
+    Standard errors are measured as standard deviation of estimates over independent replicates.
+    """
+    if approach_params is None:
+        approach_params = {'mean': 0.0, 'std_dev': 1.5}
+
+    # Read obligor data and build RWA kernel
+    df = load_clean_data('clean_obligor_data_merged')
+    df.rename(columns={'pd_updated': 'pd', 'mgs_updated': 'mgs'}, inplace=True)
+    kernel = load_rwa_kernel(df['cis_code'])
+
+    rows = []
+    for sampling in samplings:
+        estimates_mean = []
+        estimates_quantile = []
+        cpu_seconds = 0.0
+
+        # Sequential approach is slow, run fewer replicates
+        n_replicates_sampling = min(n_replicates, 5) if sampling == 'sequential' else n_replicates
+        for seed in range(n_replicates_sampling):
+            rwa_new, cpu_time = run_replicate(df, kernel, n_scenarios, approach, approach_params, sampling, seed)
+            estimates_mean.append(rwa_new.mean())
+            estimates_quantile.append(np.quantile(rwa_new, quantile))
+            cpu_seconds += cpu_time
+
+        cpu_seconds_per_replicate = cpu_seconds / n_replicates_sampling
+        se_mean = np.std(estimates_mean, ddof=1)
+        se_quantile = np.std(estimates_quantile, ddof=1)
+
+        row = [
+            sampling,
+            n_replicates_sampling,
+            cpu_seconds_per_replicate,
+            se_mean,
+            se_quantile,
+            1 / (se_mean ** 2 * cpu_seconds_per_replicate),
+            1 / (se_quantile ** 2 * cpu_seconds_per_replicate)
+        ]
+        rows.append(row)
+
+    columns = [
+        'sampling',
+        'n_replicates',
+        'cpu_seconds',
+        'se_mean',
+        f'se_p{100 * quantile:g}',
+        'efficiency_mean',
+        f'efficiency_p{100 * quantile:g}'
+    ]
+    df_result = pd.DataFrame(rows, columns=columns)
+
+    # Express efficiency (inverse of variance times CPU time) relative to independent batched draws
+    for c in ['efficiency_mean', f'efficiency_p{100 * quantile:g}']:
+        df_result[c] = df_result[c] / df_result.loc[df_result['sampling'] == 'random', c].values[0]
+
+    print(df_result.to_string(index=False))
+
+    return df_result
+
+
+if __name__ == '__main__':
+    main()
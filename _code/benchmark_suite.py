@@ -0,0 +1,170 @@
+import os
+import time
+import tempfile
+import subprocess
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from _code._config import Confs
+config = Confs()
+
+benchmark_cases = ['calculate_rwa', 'merge_data', 'bucket_swaps_scenario', 'mgs_movements_scenario', 'pipeline']
+
+
+def get_commit():
+    """
+    Returns short hash of checked out commit, with suffix '+dirty' if there are uncommitted changes
+    """
+    repository_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repository_path,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repository_path,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + '+dirty' if status else commit
+
+
+def time_case(function, n_repeats):
+    # Return wall times of repeats
+    timings = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_size(n_deals, cases, n_repeats, seed):
+    """
+    Generates synthetic portfolio of n_deals and times benchmark cases on it. Runs in a fresh process with
+    RWA_SENSITIVITY_DATA_PATH set to a temporary folder, so that modules read the synthetic data.
+    """
+    from _code import generate_synthetic_data
+    from _code.clean_data import merge_data
+    from _code._utilities import calculate_rwa
+    from _code._storage import load_clean_data
+    from _code._run_pipeline import main as run_pipeline
+    from _code.simulate_approach_bucket_swaps import main as simulate_approach_bucket_swaps
+    from _code.simulate_approach_mgs_movements import main as simulate_approach_mgs_movements
+
+    raw = 'pipeline' in cases and n_deals <= generate_synthetic_data.excel_max_rows
+    generate_synthetic_data.main(n_deals, seed=seed, raw=raw)
+    df_deals = load_clean_data('clean_deal_data_merged')
+
+    # Simulators are timed end to end for one scenario, i.e. including reading data and building RWA kernel
+    functions = {
+        'calculate_rwa': lambda: calculate_rwa(df_deals.copy(), pd='pd_updated'),
+        'merge_data': merge_data,
+        'bucket_swaps_scenario': lambda: simulate_approach_bucket_swaps(1),
+        'mgs_movements_scenario': lambda: simulate_approach_mgs_movements(
+            1, 'normal', {'mean': 0.0, 'std_dev': 1.5}),
+        'pipeline': lambda: run_pipeline(
+            params={'use_cache': False},
+            stage_params={'simulate_approach_bucket_swaps': {'n_simulations': 10},
+                          'simulate_approach_mgs_movements': {'n_simulations': 10, 'approach': 'normal',
+                                                              'approach_params': {'mean': 0.0, 'std_dev': 1.5}}})
+    }
+
+    rows = []
+    for case in cases:
+        # Full pipeline starts from raw Excel extracts, which are limited in size
+        if case == 'pipeline' and not raw:
+            continue
+        timings = time_case(functions[case], n_repeats)
+        rows.append([case, n_deals, n_repeats, np.min(timings), np.median(timings)])
+
+    return rows
+
+
+def compare(df_history, commit, baseline=None):
+    """
+    Compares median timings of commit with baseline commit
+    :param df_history: DataFrame with benchmark history
+    :param commit: commit to be compared
+    :param baseline: commit compared against, the latest other commit in history if None
+    :return: DataFrame with timings of both commits and their ratio, None if there is no baseline
+    """
+    if baseline is None:
+        other_commits = df_history.loc[df_history['commit'] != commit, 'commit']
+        if len(other_commits) == 0:
+            return None
+        baseline = other_commits.iloc[-1]
+
+    # Use latest run of each case and size per commit
+    def latest(c):
+        df = df_history[df_history['commit'] == c].drop_duplicates(subset=['case', 'n_deals'], keep='last')
+        return df.set_index(['case', 'n_deals'])['seconds_median']
+
+    df_compare = pd.DataFrame({'seconds_baseline': latest(baseline), 'seconds': latest(commit)}).dropna()
+    df_compare['ratio'] = df_compare['seconds'] / df_compare['seconds_baseline']
+    df_compare.reset_index(drop=False, inplace=True)
+    df_compare.insert(0, 'baseline', baseline)
+    return df_compare
+
+
+def main(n_deals_list=(10 ** 3, 10 ** 4, 10 ** 5), cases=benchmark_cases, n_repeats=3, seed=0,
+         history_path=None, baseline=None, regression_threshold=1.2):
+    """
+    Times benchmark cases on synthetic portfolios of given sizes, appends timings with commit hash to history file
+    and compares them with a baseline commit. Each size runs in a separate process on its own temporary data path.
+    :param n_deals_list: sizes of synthetic portfolios in number of deals
+    :param cases: benchmark cases, see benchmark_cases
+    :param n_repeats: number of timed repeats of each case
+    :param seed: seed of synthetic portfolio
+    :param history_path: csv file with benchmark history, result_data/benchmark_history.csv of data path if None
+    :param baseline: commit compared against, the latest other commit in history if None
+    :param regression_threshold: ratio of timings reported as regression
+    """
+    if history_path is None:
+        history_path = config.data_path + 'result_data/benchmark_history.csv'
+    commit = get_commit()
+    created = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    rows = []
+    context = multiprocessing.get_context('spawn')
+    data_path = os.environ.get('RWA_SENSITIVITY_DATA_PATH')
+    try:
+        for n_deals in n_deals_list:
+            with tempfile.TemporaryDirectory() as directory:
+                os.environ['RWA_SENSITIVITY_DATA_PATH'] = directory + '/'
+                with context.Pool(processes=1) as pool:
+                    rows += pool.apply(run_size, (n_deals, cases, n_repeats, seed))
+    finally:
+        if data_path is None:
+            os.environ.pop('RWA_SENSITIVITY_DATA_PATH', None)
+        else:
+            os.environ['RWA_SENSITIVITY_DATA_PATH'] = data_path
+
+    columns = ['case', 'n_deals', 'n_repeats', 'seconds_min', 'seconds_median']
+    df_result = pd.DataFrame(rows, columns=columns)
+    df_result.insert(0, 'commit', commit)
+    df_result.insert(1, 'created', created)
+    print(df_result.to_string(index=False))
+
+    # Append timings to history
+    if os.path.exists(history_path):
+        df_history = pd.concat([pd.read_csv(history_path), df_result], ignore_index=True)
+    else:
+        os.makedirs(os.path.dirname(history_path), exist_ok=True)
+        df_history = df_result
+    df_history.to_csv(history_path, index=False)
+
+    # Compare with baseline commit
+    df_compare = compare(df_history, commit, baseline)
+    if df_compare is not None:
+        print('')
+        print(df_compare.to_string(index=False))
+        regressions = df_compare[df_compare['ratio'] > regression_threshold]
+        for _, row in regressions.iterrows():
+            print(f'Benchmark: {row["case"]} with {row["n_deals"]:,} deals is {row["ratio"]:.2f}x slower '
+                  f'than {row["baseline"]}')
+
+    return df_result
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,15 @@
 import numpy as np
 import pandas as pd
 
+from _code._storage import save_clean_data
+from _code._instrumentation import timed
+
 from _code._config import Confs
 
 config = Confs()
 
 
+@timed
 def clean_swaps_matrix():
     # Read raw config
     swaps_matrix_path = config.data_path + 'config_data/config_pd_swaps.xlsx'
@@ -34,9 +38,10 @@ def clean_swaps_matrix():
     df_swaps.reset_index(drop=True, inplace=True)
 
     # Save cleaned data
-    df_swaps.to_csv(config.data_path + 'clean_data/config_swaps_matrix.csv', index=False)
+    save_clean_data(df_swaps, 'config_swaps_matrix')
 
 
+@timed
 def clean_mgs_mapping():
     # Read raw config
     mgs_mapping_path = config.data_path + 'config_data/config_pd_swaps.xlsx'
@@ -59,12 +64,51 @@ def clean_mgs_mapping():
     mgs_mapping.rename(columns=rename_dict, inplace=True)
 
     # Save cleaned data
-    mgs_mapping.to_csv(config.data_path + 'clean_data/config_mgs_mapping.csv', index=False)
+    save_clean_data(mgs_mapping, 'config_mgs_mapping')
+
+
+@timed
+def clean_transition_matrix():
+    # Read raw config, transition matrix is optional and its artifact is empty if the sheet is missing
+    transition_matrix_path = config.data_path + 'config_data/config_pd_swaps.xlsx'
+    if 'transition_matrix' not in pd.ExcelFile(transition_matrix_path).sheet_names:
+        df_transitions = pd.DataFrame({'from_mgs': pd.Series(dtype=np.int64), 'to_mgs': pd.Series(dtype=np.int64),
+                                       'probability': pd.Series(dtype=np.float64)})
+        save_clean_data(df_transitions, 'config_transition_matrix')
+        return
+
+    transition_matrix = pd.read_excel(transition_matrix_path, sheet_name='transition_matrix', skiprows=4)
+
+    cols_to_drop = [c for c in transition_matrix.columns if 'Unnamed' in str(c)]
+    transition_matrix.drop(columns=cols_to_drop, inplace=True)
+
+    # Matrix is square over grades 1..n, with one year transition probabilities from grade of row to grade of
+    # column
+    transition_matrix = transition_matrix.set_index('mgs')
+    transition_matrix.columns = transition_matrix.columns.astype(int)
+    grades = np.arange(1, len(transition_matrix) + 1)
+    assert (transition_matrix.index.to_numpy() == grades).all()
+    assert (transition_matrix.columns.to_numpy() == grades).all()
+
+    # Rows are normalised, so that rounding in the sheet does not leave probability mass unassigned
+    transition_matrix = transition_matrix.fillna(0).astype(np.float64)
+    assert (transition_matrix.to_numpy() >= 0).all()
+    row_sums = transition_matrix.sum(axis=1)
+    assert np.allclose(row_sums, 1, atol=1e-3)
+    transition_matrix = transition_matrix.div(row_sums, axis=0)
+
+    # Transform matrix into list of transitions
+    df_transitions = transition_matrix.stack().reset_index()
+    df_transitions.columns = ['from_mgs', 'to_mgs', 'probability']
+
+    # Save cleaned data
+    save_clean_data(df_transitions, 'config_transition_matrix')
 
 
 def main():
     clean_swaps_matrix()
     clean_mgs_mapping()
+    clean_transition_matrix()
 
 
 if __name__ == '__main__':
@@ -1,18 +1,69 @@
+import numpy as np
 import pandas as pd
 
 from _code._utilities import calculate_rwa
+from _code._aggregation import DealObligorMap
+from _code._instrumentation import timed
+from _code._storage import CleanDataWriter, load_clean_data, save_clean_data
 
 from _code._config import Confs
 config = Confs()
 
 
-def clean_data_incumbent():
-    # Read data
-    file_path = 'raw_data/OWC_EXTRACT2.xlsx'
-    df = pd.read_excel(config.data_path + file_path)
-
-    # Rename columns
+def read_excel_chunks(path, columns, chunk_size=100000):
+    """
+    Streams first sheet of Excel file in chunks without loading the whole workbook
+    :param path: path to Excel file
+    :param columns: lower case names of columns to be read, other columns are skipped
+    :param chunk_size: number of rows per chunk
+    :return: generator of DataFrames with lower case column names
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+
+        # Locate columns to be read in header
+        header = [str(c).lower() if c is not None else '' for c in next(rows)]
+        for c in columns:
+            assert c in header
+        positions = [header.index(c) for c in columns]
+
+        chunk = []
+        for row in rows:
+            chunk.append([row[i] if i < len(row) else None for i in positions])
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+
+        if len(chunk) > 0:
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        workbook.close()
+
+
+@timed
+def read_excel_columns(path, columns, streaming=False, chunk_size=100000):
+    """
+    Reads columns of Excel file either at once or in chunks
+    :param path: path to Excel file
+    :param columns: lower case names of columns to be read
+    :param streaming: if True, rows are streamed in chunks of chunk_size
+    :param chunk_size: number of rows per chunk
+    :return: iterable of DataFrames with lower case column names
+    """
+    if streaming:
+        return read_excel_chunks(path, columns, chunk_size)
+
+    df = pd.read_excel(path, usecols=lambda c: str(c).lower() in columns)
     df.columns = df.columns.str.lower()
+    return [df[columns]]
+
+
+@timed
+def clean_data_incumbent(streaming=False, chunk_size=100000):
+    # Define columns to be read
     rename_dict = {
         #'rp_cis_code': 'rp_cis_code',
         'cis_code': 'cis_code',
@@ -33,39 +84,47 @@ def clean_data_incumbent():
         'adjusted_cascade_flag': 'adjusted_cascade_flag',
     }
     columns_to_keep = list(rename_dict.keys())
-    df = df[columns_to_keep]
-    df.rename(columns=rename_dict, inplace=True)
 
-    # Assert that certain columns are unique per obligor
+    # Read data
+    file_path = 'raw_data/OWC_EXTRACT2.xlsx'
+    chunks = read_excel_columns(config.data_path + file_path, columns_to_keep, streaming, chunk_size)
+
+    writer = CleanDataWriter('interim_deal_data_incumbent')
     columns_to_test = ['pd_incumbent']
-    agg_dict = {c: 'nunique' for c in columns_to_test}
-    df_check = df.groupby(by=['cis_code'], as_index=False).agg(agg_dict)
+    values_seen = {c: pd.Series(dtype=float) for c in columns_to_test}
 
-    for c in columns_to_test:
-        assert df_check[c].max() == 1
+    for df in chunks:
+        # Rename columns
+        df.rename(columns=rename_dict, inplace=True)
 
-    del df_check
+        # Assert that certain columns are unique per obligor, also across chunks
+        agg_dict = {c: ['nunique', 'first'] for c in columns_to_test}
+        df_check = df.groupby(by=['cis_code']).agg(agg_dict)
 
-    # Exclude observations with PD = 1.0
-    mask = (df['pd_incumbent'] == 1)
-    assert df.loc[mask, 'rwa_incumbent_data'].sum() == 0
-    df = df[~mask]
+        for c in columns_to_test:
+            assert df_check[(c, 'nunique')].max() == 1
 
-    # Reset index
-    df.reset_index(drop=True, inplace=True)
+            values_chunk = df_check[(c, 'first')].dropna()
+            values_common = values_seen[c].reindex(values_chunk.index).dropna()
+            assert (values_common == values_chunk[values_common.index]).all()
+            values_seen[c] = values_seen[c].combine_first(values_chunk)
 
-    # Save DataFrame at deal level
-    df.to_csv(config.data_path + 'clean_data/interim_deal_data_incumbent.csv', index=False)
+        del df_check
 
+        # Exclude observations with PD = 1.0
+        mask = (df['pd_incumbent'] == 1)
+        assert df.loc[mask, 'rwa_incumbent_data'].sum() == 0
+        df = df[~mask]
 
-def clean_data_updated():
+        # Save DataFrame at deal level, appending chunks
+        writer.append(df)
 
-    # Read data
-    file_path = 'raw_data/OWC_EXTRACT3.xlsx'
-    df = pd.read_excel(config.data_path + file_path)
+    writer.close()
 
-    # Rename columns
-    df.columns = df.columns.str.lower()
+
+@timed
+def clean_data_updated(streaming=False, chunk_size=100000):
+    # Define columns to be read
     rename_dict = {
         'le_cis_code': 'cis_code',
         'cascade_flag': 'cascade_flag',
@@ -80,26 +139,35 @@ def clean_data_updated():
         'sum of diff_el': 'el_diff'
     }
     columns_to_keep = list(rename_dict.keys())
-    df = df[columns_to_keep]
-    df.rename(columns=rename_dict, inplace=True)
 
-    # Exclude observations with PD = 1.0
-    mask = (df['mgs_updated'] == 27)
-    assert df.loc[mask, 'rwa_incumbent_data'].sum() == 0
-    assert df.loc[mask, 'rwa_updated_data'].sum() == 0
-    df = df[~mask]
+    # Read data
+    file_path = 'raw_data/OWC_EXTRACT3.xlsx'
+    chunks = read_excel_columns(config.data_path + file_path, columns_to_keep, streaming, chunk_size)
+
+    writer = CleanDataWriter('interim_obligor_data_updated')
 
-    # Save DataFrame at obligor level
-    df.to_csv(config.data_path + 'clean_data/interim_obligor_data_updated.csv', index=False)
+    for df in chunks:
+        # Rename columns
+        df.rename(columns=rename_dict, inplace=True)
+
+        # Exclude observations with PD = 1.0
+        mask = (df['mgs_updated'] == 27)
+        assert df.loc[mask, 'rwa_incumbent_data'].sum() == 0
+        assert df.loc[mask, 'rwa_updated_data'].sum() == 0
+        df = df[~mask]
+
+        # Save DataFrame at obligor level, appending chunks
+        writer.append(df)
+
+    writer.close()
 
 
+@timed
 def merge_data():
 
     # Read data
-    path_incumbent = config.data_path + 'clean_data/interim_deal_data_incumbent.csv'
-    path_updated = config.data_path + 'clean_data/interim_obligor_data_updated.csv'
-    df_incumbent = pd.read_csv(path_incumbent)
-    df_updated = pd.read_csv(path_updated)
+    df_incumbent = load_clean_data('interim_deal_data_incumbent')
+    df_updated = load_clean_data('interim_obligor_data_updated')
 
     # Assert that two datasets match in terms of obligors
     obligors_incumbent = set(list(df_incumbent['cis_code'].unique()))
@@ -115,8 +183,7 @@ def merge_data():
     )
 
     # Add PDs for updated mgs based on scale
-    config_mgs = pd.read_csv(config.data_path + 'clean_data/config_mgs_mapping.csv',
-                             usecols=['mgs', 'pd_mid'])
+    config_mgs = load_clean_data('config_mgs_mapping', columns=['mgs', 'pd_mid'])
     df = pd.merge(
         df,
         config_mgs.rename(columns={'mgs': 'mgs_updated', 'pd_mid': 'pd_updated'}),
@@ -141,7 +208,7 @@ def merge_data():
         df[col] = df[col] * fx_rate
 
     # Save DataFrame at deal level
-    df.to_csv(config.data_path + 'clean_data/clean_deal_data_merged.csv', index=False)
+    save_clean_data(df, 'clean_deal_data_merged')
 
     # Aggregate to obligor level
     agg_dict = {
@@ -154,7 +221,13 @@ def merge_data():
         'rwa_incumbent_calc': 'sum',
         'rwa_incumbent_data': 'sum'
     }
-    df_obligor = df.groupby(by=['cis_code'], as_index=False).agg(agg_dict)
+    deal_map = DealObligorMap(df['cis_code'])
+    df_obligor = pd.DataFrame({'cis_code': deal_map.cis_codes})
+    for col, agg in agg_dict.items():
+        if agg == 'first':
+            df_obligor[col] = deal_map.first(df[col].to_numpy())
+        if agg == 'sum':
+            df_obligor[col] = deal_map.sum(df[col].to_numpy(dtype=np.float64))
 
     # Merge rwa_updated
     df_obligor = pd.merge(
@@ -164,12 +237,12 @@ def merge_data():
     )
 
     # Save DataFrame at obligor level
-    df_obligor.to_csv(config.data_path + 'clean_data/clean_obligor_data_merged.csv', index=False)
+    save_clean_data(df_obligor, 'clean_obligor_data_merged')
 
 
-def main():
-    clean_data_incumbent()
-    clean_data_updated()
+def main(streaming=False, chunk_size=100000):
+    clean_data_incumbent(streaming, chunk_size)
+    clean_data_updated(streaming, chunk_size)
     merge_data()
 
 
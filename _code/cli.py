@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import argparse
+
+# Modules of the pipeline read data path at import, so only standard library is imported before arguments are
+# parsed and data path is set
+
+
+def parse_stage_param(value):
+    """
+    Parses stage parameter given as STAGE.PARAM=VALUE, VALUE is read as json and kept as string if it is not json
+    :return: tuple (stage, param, value)
+    """
+    name, _, value = value.partition('=')
+    stage, _, param = name.partition('.')
+    if not stage or not param or not value:
+        raise argparse.ArgumentTypeError(f'Expected STAGE.PARAM=VALUE, got {name}={value}')
+    try:
+        value = json.loads(value)
+    except json.JSONDecodeError:
+        pass
+    return stage, param, value
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m _code.cli',
+        description='Runs RWA sensitivity pipeline, all stages or only the given ones')
+    parser.add_argument('stages', nargs='*',
+                        help='stages to run (clean_config, clean_data, simulate_approach_bucket_swaps, '
+                             'simulate_approach_mgs_movements, simulate_sweep, visualize_simulations), '
+                             'all enabled by default if none given')
+    parser.add_argument('--data-path', default=os.environ.get('RWA_SENSITIVITY_DATA_PATH'),
+                        help='data root with config_data, raw_data, clean_data and result_data, '
+                             'defaults to RWA_SENSITIVITY_DATA_PATH environment variable or path of _config')
+    parser.add_argument('--set', dest='stage_params', action='append', default=[], type=parse_stage_param,
+                        metavar='STAGE.PARAM=VALUE',
+                        help='parameter of stage, e.g. simulate_approach_mgs_movements.n_simulations=1, '
+                             'can be repeated')
+    parser.add_argument('--no-cache', action='store_true', help='run stages even if inputs are unchanged')
+    parser.add_argument('--instrument', action='store_true', help='save run report with stage timings')
+    parser.add_argument('--profile', choices=['cprofile', 'pyinstrument'], help='save profile of each stage')
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+
+    # Set data path before pipeline modules are imported
+    if args.data_path:
+        if not os.path.isdir(args.data_path):
+            parser.error(f'Data path {args.data_path} does not exist')
+        os.environ['RWA_SENSITIVITY_DATA_PATH'] = args.data_path
+
+    from _code import _run_pipeline
+
+    # Select stages, parameters override defaults of the stage
+    stage_names = list(_run_pipeline.default_stage_params.keys())
+    for stage in args.stages + [stage for stage, _, _ in args.stage_params]:
+        if stage not in stage_names:
+            parser.error(f'Unknown stage {stage}, expected one of {", ".join(stage_names)}')
+
+    params = {stage: stage in args.stages if args.stages else _run_pipeline.default_params[stage]
+              for stage in stage_names}
+    params['use_cache'] = not args.no_cache
+    params['instrument'] = args.instrument
+    params['profile'] = args.profile
+
+    stage_params = {stage: dict(stage_params) for stage, stage_params in _run_pipeline.default_stage_params.items()}
+    for stage, param, value in args.stage_params:
+        stage_params[stage][param] = value
+
+    _run_pipeline.main(params, stage_params)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from _code.clean_config import main as clean_config
+from _code.clean_data import merge_data
+from _code._utilities import calculate_rwa_array
+from _code._aggregation import DealObligorMap
+from _code._storage import load_clean_data, save_clean_data
+
+from _code._config import Confs
+config = Confs()
+
+# Maximum number of data rows in an Excel sheet, larger books are written to clean_data only
+excel_max_rows = 2 ** 20 - 1
+
+# Columns of OWC extracts, in names of interim clean files
+raw_columns_incumbent = {
+    'cis_code': 'CIS_CODE',
+    'pd_model': 'PD_MODEL',
+    'approach': 'APPROVED_APPROACH_CODE',
+    'ead': 'IRB_EAD',
+    'rwa_incumbent_data': 'IRB_RWA',
+    'lgd': 'LGD',
+    'pd_incumbent': 'PD',
+    'maturity': 'EFFECTIVE_MATURITY_YRS',
+    'grading_id': 'GRADING_ID',
+    'adj_cascade_rule_desc': 'ADJ_CASCADE_RULE_DESC',
+    'adjusted_parent_cis_code': 'ADJUSTED_PARENT_CIS_CODE',
+    'adjusted_cascade_flag': 'ADJUSTED_CASCADE_FLAG'
+}
+raw_columns_updated = {
+    'cis_code': 'LE_CIS_CODE',
+    'cascade_flag': 'CASCADE_FLAG',
+    'mgs_incumbent': 'ASIS_GRADE',
+    'mgs_updated': 'TOBE_GRADE',
+    'ead': 'Sum of Exposure',
+    'rwa_incumbent_data': 'Sum of Current RWA',
+    'rwa_updated_data': 'Sum of New RWA',
+    'rwa_diff': 'Sum of Diff RWA',
+    'el_incumbent': 'Sum of Current EL',
+    'el_updated': 'Sum of New EL',
+    'el_diff': 'Sum of Diff_EL'
+}
+
+
+def get_grade_weights(grade_distribution, n_grades=26):
+    """
+    Returns probabilities of performing grades 1..n_grades
+    :param grade_distribution: 'normal' (centred on middle of scale), 'uniform' or array of n_grades weights
+    """
+    if isinstance(grade_distribution, str):
+        grades = np.arange(1, n_grades + 1)
+        if grade_distribution == 'normal':
+            weights = np.exp(-0.5 * ((grades - 12) / 4) ** 2)
+        elif grade_distribution == 'uniform':
+            weights = np.ones(n_grades)
+        else:
+            raise ValueError(f'Unknown grade distribution: {grade_distribution}')
+    else:
+        weights = np.asarray(grade_distribution, dtype=np.float64)
+        assert len(weights) == n_grades
+
+    return weights / weights.sum()
+
+
+def make_obligors(n_obligors, grade_distribution, grade_change_std, rng):
+    """
+    Returns synthetic obligors with incumbent and updated grades
+    :param n_obligors: number of obligors
+    :param grade_distribution: distribution of incumbent grades, see get_grade_weights
+    :param grade_change_std: standard deviation of change between incumbent and updated grade, in notches
+    :param rng: numpy Generator
+    """
+    weights = get_grade_weights(grade_distribution)
+    mgs_incumbent = rng.choice(np.arange(1, len(weights) + 1), n_obligors, p=weights)
+    grade_change = np.rint(rng.normal(0, grade_change_std, n_obligors)).astype(np.int64)
+    mgs_updated = np.clip(mgs_incumbent + grade_change, 1, len(weights))
+
+    df_obligors = pd.DataFrame({
+        'cis_code': 1000000 + np.arange(n_obligors),
+        'cascade_flag': rng.choice(['Y', 'N'], n_obligors),
+        'mgs_incumbent': mgs_incumbent,
+        'mgs_updated': mgs_updated
+    })
+    return df_obligors
+
+
+def make_deals(df_obligors, n_deals, config_mgs, rng):
+    """
+    Returns synthetic deals of obligors, every obligor has at least one deal and the remaining deals are spread
+    uniformly over obligors
+    :param df_obligors: DataFrame from make_obligors
+    :param n_deals: number of deals, at least number of obligors
+    :param config_mgs: DataFrame with columns mgs and pd_mid
+    :param rng: numpy Generator
+    """
+    n_obligors = len(df_obligors)
+    assert n_deals >= n_obligors
+    deals_per_obligor = 1 + rng.multinomial(n_deals - n_obligors, np.full(n_obligors, 1 / n_obligors))
+    cis_code = np.repeat(df_obligors['cis_code'].to_numpy(), deals_per_obligor)
+    mgs_incumbent = np.repeat(df_obligors['mgs_incumbent'].to_numpy(), deals_per_obligor)
+
+    pd_mid = pd.Series(config_mgs['pd_mid'].to_numpy(), index=config_mgs['mgs'].to_numpy())
+    df_deals = pd.DataFrame({
+        'cis_code': cis_code,
+        'pd_model': rng.choice(['BANK', 'CORP', 'SME'], n_deals),
+        'approach': rng.choice(['AIRB', 'FIRB'], n_deals),
+        'ead': rng.lognormal(13, 1.5, n_deals),
+        'lgd': rng.uniform(0.05, 0.75, n_deals),
+        'pd_incumbent': pd_mid.reindex(mgs_incumbent).to_numpy(),
+        'maturity': rng.uniform(1, 5, n_deals),
+        'grading_id': rng.integers(1, 10 ** 6, n_deals),
+        'adj_cascade_rule_desc': rng.choice(['rule_a', 'rule_b'], n_deals),
+        'adjusted_parent_cis_code': cis_code,
+        'adjusted_cascade_flag': rng.choice(['Y', 'N'], n_deals)
+    })
+    _, df_deals['rwa_incumbent_data'] = calculate_rwa_array(
+        df_deals['pd_incumbent'], df_deals['lgd'], df_deals['ead'], df_deals['maturity'])
+
+    return df_deals[list(raw_columns_incumbent.keys())]
+
+
+def add_obligor_totals(df_obligors, df_deals, config_mgs):
+    """
+    Adds exposure, RWA and expected loss summed over deals to obligors, as in obligor level OWC extract
+    """
+    deal_map = DealObligorMap(df_deals['cis_code'], df_obligors['cis_code'])
+    pd_mid = pd.Series(config_mgs['pd_mid'].to_numpy(), index=config_mgs['mgs'].to_numpy())
+    pd_updated = pd_mid.reindex(deal_map.to_deals(df_obligors['mgs_updated'].to_numpy())).to_numpy()
+
+    _, rwa_updated = calculate_rwa_array(pd_updated, df_deals['lgd'], df_deals['ead'], df_deals['maturity'])
+    el_incumbent = df_deals['pd_incumbent'] * df_deals['lgd'] * df_deals['ead']
+    el_updated = pd_updated * df_deals['lgd'] * df_deals['ead']
+
+    df_obligors['ead'] = deal_map.sum(df_deals['ead'])
+    df_obligors['rwa_incumbent_data'] = deal_map.sum(df_deals['rwa_incumbent_data'])
+    df_obligors['rwa_updated_data'] = deal_map.sum(rwa_updated)
+    df_obligors['rwa_diff'] = df_obligors['rwa_updated_data'] - df_obligors['rwa_incumbent_data']
+    df_obligors['el_incumbent'] = deal_map.sum(el_incumbent)
+    df_obligors['el_updated'] = deal_map.sum(el_updated)
+    df_obligors['el_diff'] = df_obligors['el_updated'] - df_obligors['el_incumbent']
+
+    return df_obligors[list(raw_columns_updated.keys())]
+
+
+def copy_config(config_path=None):
+    # Copy configuration of PD scale and swaps to data path, unless it is already there
+    if config_path is None:
+        config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config_data',
+                                   'config_pd_swaps.xlsx')
+    target_path = config.data_path + 'config_data/config_pd_swaps.xlsx'
+    if not os.path.exists(target_path):
+        shutil.copyfile(config_path, target_path)
+
+
+def main(n_deals=10 ** 4, deals_per_obligor=3.0, grade_distribution='normal', grade_change_std=1.0, seed=0,
+         raw=None, config_path=None):
+    """
+    Writes synthetic portfolio to data path of config (set RWA_SENSITIVITY_DATA_PATH to use a separate folder):
+    OWC-style raw extracts, interim and merged clean files. Deals have no defaulted (PD = 1) obligors.
+    :param n_deals: number of deals, e.g. 10 ** 3 to 10 ** 7
+    :param deals_per_obligor: average number of deals per obligor
+    :param grade_distribution: distribution of incumbent grades, 'normal', 'uniform' or 26 weights
+    :param grade_change_std: standard deviation of change between incumbent and updated grade, in notches
+    :param seed: seed of random generator
+    :param raw: if True, raw Excel extracts are written, None to write them if deals fit in an Excel sheet
+    :param config_path: path to config_pd_swaps.xlsx, the one of repository if None
+    """
+    for folder in ['config_data', 'raw_data', 'clean_data', 'result_data/graphs']:
+        os.makedirs(config.data_path + folder, exist_ok=True)
+    if raw is None:
+        raw = n_deals <= excel_max_rows
+    assert not raw or n_deals <= excel_max_rows
+
+    # Parse configuration, PD scale is used to derive PDs of grades
+    copy_config(config_path)
+    clean_config()
+    config_mgs = load_clean_data('config_mgs_mapping', columns=['mgs', 'pd_mid'])
+
+    # Generate obligors and deals
+    rng = np.random.default_rng(seed)
+    n_obligors = max(1, int(round(n_deals / deals_per_obligor)))
+    df_obligors = make_obligors(n_obligors, grade_distribution, grade_change_std, rng)
+    df_deals = make_deals(df_obligors, n_deals, config_mgs, rng)
+    df_obligors = add_obligor_totals(df_obligors, df_deals, config_mgs)
+
+    # Write raw extracts in OWC column names
+    if raw:
+        df_deals.rename(columns=raw_columns_incumbent).to_excel(
+            config.data_path + 'raw_data/OWC_EXTRACT2.xlsx', index=False)
+        df_obligors.rename(columns=raw_columns_updated).to_excel(
+            config.data_path + 'raw_data/OWC_EXTRACT3.xlsx', index=False)
+
+    # Write interim files as clean_data_incumbent and clean_data_updated do and merge them
+    save_clean_data(df_deals, 'interim_deal_data_incumbent')
+    save_clean_data(df_obligors, 'interim_obligor_data_updated')
+    del df_deals, df_obligors
+    merge_data()
+
+    print(f'Synthetic data: {n_deals:,} deals of {n_obligors:,} obligors written to {config.data_path}')
+
+
+if __name__ == '__main__':
+    main()
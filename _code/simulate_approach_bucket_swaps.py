@@ -4,105 +4,110 @@ import pandas as pd
 from _code._config import Confs
 config = Confs()
 
-from _code._utilities import calculate_rwa
-
-
-def run_shuffling(df, df_deals, df_swaps, random_state):
-
-    print(f'Bucket swaps approach: starting simulation with random state = {random_state}...')
-
-    # Create deep copy to avoid over writing
-    df_deals = df_deals.copy(deep=True)
-    df = df.copy(deep=True)
-
-    # Itterate through movements and simulate swaps
-    df['bucket_new'] = np.nan
-    df['pd_new'] = np.nan
-
-    for index, row in df_swaps.iterrows():
-        # Unpack parameters
-        from_bucket = row['from_bucket']
-        to_bucket = row['to_bucket']
-        swaps = row['swaps']
+from _code._rwa_kernel import load_rwa_kernel, IncrementalRwa
+from _code._storage import load_clean_data
+from _code._parallel import iterate_parallel
+from _code._result_sink import ResultSink
+from _code._convergence import ConvergenceMonitor
+from _code._instrumentation import ProgressReporter, timed
+from _code._swap_kernel import SwapPlan, swap_pd, swap_changes
+
+
+@timed
+def sample_swaps(bucket, df_swaps, random_state, sampling='legacy'):
+    """
+    Samples obligors to be swapped between buckets according to list of swaps
+    :param bucket: array with bucket of each obligor
+    :param df_swaps: DataFrame with columns 'from_bucket', 'to_bucket' and 'swaps'
+    :param random_state: seed of the scenario
+    :param sampling: 'legacy' reproduces DataFrame.sample draws of previous implementation for given random_state,
+                     'permutation' draws one permutation per bucket and consumes it, so that a scenario costs O(obligors)
+    :return: array with position of obligor whose PD is taken by each obligor after swaps
+    """
+    n_obligors = len(bucket)
+    source = np.arange(n_obligors)
+    moved = np.zeros(n_obligors, dtype=bool)
+
+    # Get positions of obligors by bucket
+    bucket_positions = {b: np.flatnonzero(bucket == b) for b in np.unique(bucket)}
+    if sampling == 'permutation':
+        rng = np.random.default_rng(random_state)
+        bucket_positions = {b: rng.permutation(positions) for b, positions in bucket_positions.items()}
+        bucket_taken = {b: 0 for b in bucket_positions}
+
+    # Iterate through movements and simulate swaps
+    for from_bucket, to_bucket, swaps in zip(df_swaps['from_bucket'], df_swaps['to_bucket'], df_swaps['swaps']):
         # print(f'Simulating swaps between {from_bucket} and {to_bucket} for n={swaps}')
 
-        # Mark random obligors for swapping
-        df_from = df[(df['bucket_new'].isnull()) & (df['bucket'] == from_bucket)].copy(deep=True)
-        df_to = df[(df['bucket_new'].isnull()) & (df['bucket'] == to_bucket)].copy(deep=True)
-        # print(f'   Shape of availaible df_from: {df_from.shape[0]}')
-        # print(f'   Shape of availaible df_to: {df_to.shape[0]}')
-
-        # Get IDs of obligors for swaps
         if swaps > 0:
+            positions_from = bucket_positions.get(from_bucket, np.array([], dtype=int))
+            positions_to = bucket_positions.get(to_bucket, np.array([], dtype=int))
+
+            # Get obligors not yet swapped
+            if sampling == 'legacy':
+                available_from = positions_from[~moved[positions_from]]
+                available_to = positions_to[~moved[positions_to]]
+            if sampling == 'permutation':
+                available_from = positions_from[bucket_taken[from_bucket]:]
+                available_to = positions_to[bucket_taken[to_bucket]:]
 
             # Raise errors if number of remaining observations in buckets is not sufficient to execute swaps matrix
-            if df_from.shape[0] < swaps:
+            if len(available_from) < swaps:
                 print(f'   Error: Not sufficient number of observation in {from_bucket} to execute swaps matrix')
                 assert False
-            if df_to.shape[0] < swaps:
+            if len(available_to) < swaps:
                 print(f'   Error: Not sufficient number of observation in {to_bucket} to execute swaps matrix')
                 assert False
 
-            df_from = df_from.sample(n=swaps, random_state=random_state)
-            df_to = df_to.sample(n=swaps, random_state=random_state)
-
-            df_from = df_from[['cis_code', 'pd', 'bucket']]
-            df_from.rename(columns={'cis_code': 'cis_code_from', 'pd': 'pd_from', 'bucket': 'bucket_from'},
-                           inplace=True)
-            df_from.reset_index(drop=True, inplace=True)
-
-            df_to = df_to[['cis_code', 'pd', 'bucket']]
-            df_to.rename(columns={'cis_code': 'cis_code_to', 'pd': 'pd_to', 'bucket': 'bucket_to'}, inplace=True)
-            df_to.reset_index(drop=True, inplace=True)
-
-            df_swap = pd.concat([df_from, df_to], axis=1)
-
-            # Adjust PDs and buckets of from obligors
-            df = pd.merge(
-                df,
-                df_swap.rename(columns={'cis_code_from': 'cis_code'}),
-                on=['cis_code'], how='left', validate='1:1'
-            )
-            df['pd_new'] = df['pd_new'].fillna(df['pd_to'])
-            df['bucket_new'] = df['bucket_new'].fillna(df['bucket_to'])
-            df = df[['cis_code', 'pd', 'ead', 'bucket', 'pd_new', 'bucket_new']]
-
-            # Adjust PDs and buckets of to obligors
-            df = pd.merge(
-                df,
-                df_swap.rename(columns={'cis_code_to': 'cis_code'}),
-                on=['cis_code'], how='left', validate='1:1'
-            )
-            df['pd_new'] = df['pd_new'].fillna(df['pd_from'])
-            df['bucket_new'] = df['bucket_new'].fillna(df['bucket_from'])
-            df = df[['cis_code', 'pd', 'ead', 'bucket', 'pd_new', 'bucket_new']]
-
-    # For non-swaped obligors new bucket equals old bucket
-    df['pd_new'] = df['pd_new'].fillna(df['pd'])
-    df['bucket_new'] = df['bucket_new'].fillna(df['bucket'])
+            # Get IDs of obligors for swaps
+            if sampling == 'legacy':
+                index_from = available_from[np.random.RandomState(random_state).choice(
+                    len(available_from), size=swaps, replace=False)]
+                index_to = available_to[np.random.RandomState(random_state).choice(
+                    len(available_to), size=swaps, replace=False)]
+            if sampling == 'permutation':
+                index_from = available_from[:swaps]
+                index_to = available_to[:swaps]
+                bucket_taken[from_bucket] += swaps
+                bucket_taken[to_bucket] += swaps
+
+            # Swap PDs of from and to obligors
+            source[index_from] = index_to
+            source[index_to] = index_from
+            moved[index_from] = True
+            moved[index_to] = True
+
+    return source
+
+
+@timed
+def run_shuffling(df, kernel, df_swaps, random_state, sampling='legacy', evaluator=None):
+
+    # Simulate swaps on obligor positions, PDs of non-swaped obligors are not changed
+    source = sample_swaps(df['bucket'].to_numpy(), df_swaps, random_state, sampling)
+    pd_old = df['pd'].to_numpy(dtype=float)
+    pd_new = pd_old[source]
+    ead = df['ead'].to_numpy(dtype=float)
 
     # Assert that there is no change in average pd
-    average_pd = df['pd'].mean()
-    average_pd_new = df['pd_new'].mean()
+    average_pd = pd_old.mean()
+    average_pd_new = pd_new.mean()
     assert abs(average_pd - average_pd_new) < 0.00001
     # print(f'   Average PD before and after simulation: {round(100 * average_pd, 3)}%')
 
     # Check movement in weighted pd
-    weighted_pd = (df['pd'] * df['ead']).sum() / df['ead'].sum()
-    weighted_pd_new = (df['pd_new'] * df['ead']).sum() / df['ead'].sum()
+    weighted_pd = np.nansum(pd_old * ead) / np.nansum(ead)
+    weighted_pd_new = np.nansum(pd_new * ead) / np.nansum(ead)
     # print(f'   Weighted PD before simulation: {round(100 * weighted_pd, 3)}%')
     # print(f'   Weighted PD after simulation: {round(100 * weighted_pd_new, 3)}%')
 
-    # Merge new pds to deals
-    df_deals = pd.merge(
-        df_deals,
-        df[['cis_code', 'pd_new']],
-        on=['cis_code'], how='left', validate='m:1')
-
-    # Calculate RWA given new PD
-    df_deals = calculate_rwa(df_deals, pd='pd_new', rw='rw_updated_calc_new', rwa='rwa_updated_calc_new')
-    rwa = df_deals['rwa_updated_calc'].sum()
-    rwa_new = df_deals['rwa_updated_calc_new'].sum()
+    # Calculate RWA given new PD, incremental evaluator recomputes swapped obligors only
+    rwa = kernel.rwa
+    if evaluator is not None:
+        moved = np.flatnonzero(source != np.arange(len(source)))
+        rwa_new, rwa_new_segments = evaluator.rwa_breakdown(moved, pd_new[moved])
+    else:
+        rwa_new, rwa_new_segments = kernel.rwa_breakdown_from_pd(pd_new)
     # print(f'   Cumulative RWA before simulation: {round(rwa):,}')
     # print(f'   Cumulative RWA after simulation: {round(rwa_new):,}')
 
@@ -116,19 +121,154 @@ def run_shuffling(df, df_deals, df_swaps, random_state):
         rwa,
         rwa_new
     ]
+
+    # Add RWA breakdowns by segment, if any
+    row = row + [kernel.segment_rwa[s] for s in kernel.segment_names()]
+    row = row + [rwa_new_segments[s] for s in kernel.segment_names()]
+
     return row
 
 
-def main(n_simulations):
+def _run_shuffling_task(shared, random_state):
+    return run_shuffling(shared['df'], shared['kernel'], shared['df_swaps'], random_state, shared['sampling'],
+                         shared['evaluator'])
+
+
+@timed
+def run_shuffling_chunk(df, kernel, plan, first_scenario, n_scenarios, seed_sequence, engine=None, evaluator=None):
+    """
+    Simulates swaps for a chunk of scenarios with compiled swap kernel and matrix operations
+    :param df: DataFrame on obligor level, ordered as obligors of kernel
+    :param kernel: RwaKernel for capital calculation
+    :param plan: SwapPlan built from buckets of obligors and swaps matrix
+    :param first_scenario: number of the first scenario in chunk, used as random_state column (not a seed)
+    :param n_scenarios: number of scenarios in chunk
+    :param seed_sequence: numpy SeedSequence of the chunk
+    :param engine: swap kernel engine, see swap_sources
+    :param evaluator: IncrementalRwa of baseline PDs, if given only swapped obligors are evaluated in each
+                      scenario, otherwise PD vectors of all obligors are built and evaluated
+    """
+    rng = np.random.default_rng(seed_sequence)
+    uniforms = plan.draw_uniforms(rng, n_scenarios)
+
+    pd_old = df['pd'].to_numpy(dtype=float)
+    ead = df['ead'].to_numpy(dtype=float)
+    ead_valid = np.nan_to_num(ead)
+    average_pd = pd_old.mean()
+
+    if evaluator is not None:
+        # Simulate swaps for all scenarios of chunk, keeping swapped obligors only
+        positions, pd_changed = swap_changes(plan, pd_old, uniforms, engine)
+        pd_delta = pd_changed - pd_old[positions]
+        average_pd_new = average_pd + pd_delta.sum(axis=1) / len(pd_old)
+        weighted_pd_delta = ((np.nan_to_num(pd_changed) - np.nan_to_num(pd_old[positions]))
+                             * ead_valid[positions]).sum(axis=1)
+        weighted_pd_new = (np.nan_to_num(pd_old) @ ead_valid + weighted_pd_delta) / ead_valid.sum()
+
+        # Calculate RWA given new PD of swapped obligors
+        rwa_new, rwa_new_segments = evaluator.rwa_breakdown(positions, pd_changed)
+    else:
+        # Simulate swaps for all scenarios of chunk
+        pd_new = swap_pd(plan, pd_old, uniforms, engine)
+        average_pd_new = pd_new.mean(axis=1)
+        weighted_pd_new = np.nan_to_num(pd_new) @ ead_valid / ead_valid.sum()
+
+        # Calculate RWA given new PD
+        rwa_new, rwa_new_segments = kernel.rwa_breakdown_from_pd(pd_new)
+
+    # Assert that there is no change in average pd
+    assert (np.abs(average_pd - average_pd_new) < 0.00001).all()
+
+    # Reduce to per-scenario results
+    df_chunk = pd.DataFrame({
+        'random_state': np.arange(first_scenario, first_scenario + n_scenarios),
+        'average_pd': average_pd,
+        'average_pd_new': average_pd_new,
+        'weighted_pd': np.nansum(pd_old * ead) / np.nansum(ead),
+        'weighted_pd_new': weighted_pd_new,
+        'rwa': kernel.rwa,
+        'rwa_new': rwa_new
+    })
+
+    # Add RWA breakdowns by segment, if any
+    for s in kernel.segment_names():
+        df_chunk[f'rwa_{s}'] = kernel.segment_rwa[s]
+    for s in kernel.segment_names():
+        df_chunk[f'rwa_new_{s}'] = rwa_new_segments[s]
+
+    return df_chunk
+
+
+def _run_shuffling_chunk_task(shared, task):
+    first_scenario, n_scenarios, seed_sequence = task
+    return run_shuffling_chunk(shared['df'], shared['kernel'], shared['plan'], first_scenario, n_scenarios,
+                               seed_sequence, shared['engine'], shared['evaluator'])
+
+
+def iterate_shuffling_batched(df, kernel, df_swaps, n_simulations, chunk_size=1000, seed=None, n_workers=1,
+                              engine=None, incremental=True):
+    """
+    Simulates swaps for all scenarios with compiled swap kernel, processing chunk_size scenarios at a time.
+    Within each bucket obligors are drawn without replacement by partial Fisher-Yates shuffle, one uniform of the
+    chunk stream per drawn obligor, see SwapPlan.draw_uniforms and draw_obligors of _swap_kernel. Draws are equal in
+    distribution to 'legacy' and 'permutation' sampling of run_shuffling, but not the same obligors for the same seed.
+    Each chunk draws from its own stream spawned from seed, so results do not depend on number of workers.
+    :param df: DataFrame on obligor level with columns 'bucket', 'pd' and 'ead', ordered as obligors of kernel
+    :param kernel: RwaKernel for capital calculation
+    :param df_swaps: DataFrame with columns 'from_bucket', 'to_bucket' and 'swaps'
+    :param n_simulations: number of scenarios
+    :param chunk_size: number of scenarios held in memory at once by each worker
+    :param seed: seed of numpy SeedSequence from which streams of chunks are spawned
+    :param n_workers: number of worker processes
+    :param engine: swap kernel engine, see swap_sources
+    :param incremental: if True, only swapped obligors are evaluated in each scenario, see IncrementalRwa
+    :return: generator of DataFrames with results of chunks in order of scenarios
+    """
+    # Split scenarios into chunks with independent random streams
+    starts = list(range(0, n_simulations, chunk_size))
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(starts))
+    tasks = [(start, min(chunk_size, n_simulations - start), seed_sequence)
+             for start, seed_sequence in zip(starts, seed_sequences)]
+
+    evaluator = IncrementalRwa(kernel, df['pd'].to_numpy(dtype=float)) if incremental else None
+    shared = {'df': df[['pd', 'ead']], 'kernel': kernel, 'plan': SwapPlan(df['bucket'].to_numpy(), df_swaps),
+              'engine': engine, 'evaluator': evaluator}
+    return iterate_parallel(_run_shuffling_chunk_task, tasks, shared, n_workers)
+
+
+def run_shuffling_batched(df, kernel, df_swaps, n_simulations, chunk_size=1000, seed=None, n_workers=1,
+                          engine=None, incremental=True):
+    """
+    Simulates swaps for all scenarios with compiled swap kernel, see iterate_shuffling_batched
+    :return: DataFrame with one row per scenario and the same columns as sequential simulation
+    """
+    chunks = iterate_shuffling_batched(df, kernel, df_swaps, n_simulations, chunk_size, seed, n_workers, engine,
+                                       incremental)
+    df_result = pd.concat(chunks, ignore_index=True)
+
+    return df_result
+
+
+def main(n_simulations, sampling='permutation', n_workers=1, export_xlsx=False, write_rows=True,
+         adaptive=False, tolerance=0.001, check_every=1000,
+         batched=False, chunk_size=1000, seed=None, engine=None, segments=(), compact=False, incremental=True):
+    """
+    :param sampling: sampling of swapped obligors in sequential mode, see sample_swaps. 'permutation' costs
+                     O(obligors) per scenario, 'legacy' reproduces results of previous implementation at its cost
+    :param segments: segmentations of RWA breakdowns added to results, e.g. ('pd_model', 'bucket', 'cascade_flag'),
+                     see segment_columns of _rwa_kernel
+    :param compact: if True, obligor and deal data are held in compact dtypes, see _compact
+    :param incremental: if True, RWA of each scenario is baseline RWA plus deltas of swapped obligors, see
+                        IncrementalRwa, otherwise RWA of all obligors is recomputed
+    """
     # Read obligor data
-    df = pd.read_csv(config.data_path + 'clean_data/clean_obligor_data_merged.csv')
+    df = load_clean_data('clean_obligor_data_merged', compact=compact)
 
     # Rename pd and mgs columns for simplicity
     df.rename(columns={'pd_updated': 'pd', 'mgs_updated': 'mgs'}, inplace=True)
 
     # Attach bucket information
-    config_mgs = pd.read_csv(config.data_path + 'clean_data/config_mgs_mapping.csv',
-                             usecols=['mgs', 'bucket'])
+    config_mgs = load_clean_data('config_mgs_mapping', columns=['mgs', 'bucket'])
     df = pd.merge(df, config_mgs, on=['mgs'], how='left', validate='m:1')
     assert df['bucket'].isnull().sum() == 0
 
@@ -142,7 +282,7 @@ def main(n_simulations):
     print('')
 
     # Get migration scenario
-    df_swaps = pd.read_csv(config.data_path + 'clean_data/config_swaps_matrix.csv')
+    df_swaps = load_clean_data('config_swaps_matrix')
 
     # Add number of observations to be swapped
     df_swaps = pd.merge(
@@ -156,18 +296,16 @@ def main(n_simulations):
     print(df_swaps)
     print('')
 
-    # Read deals data for capital calculation
-    df_deals = pd.read_csv(config.data_path + 'clean_data/clean_deal_data_merged.csv')
+    # Build RWA kernel from deals data for capital calculation
+    kernel = load_rwa_kernel(df['cis_code'], segments, compact)
 
-    # Run simulations
+    # Run simulations, saving results as scenarios finish
     random_states = list(range(n_simulations))
-    rows = []
+    evaluator = IncrementalRwa(kernel, df['pd'].to_numpy(dtype=float)) if incremental else None
+    shared = {'df': df, 'kernel': kernel, 'df_swaps': df_swaps, 'sampling': sampling, 'evaluator': evaluator}
 
-    for random_state in random_states:
-        row = run_shuffling(df, df_deals, df_swaps, random_state)
-        rows.append(row)
-
-    # Create DataFrame to store the results
+    # Column random_state holds seed of the scenario in sequential mode and number of scenario in batched mode, see
+    # result_columns of simulate_approach_mgs_movements
     columns = [
         'random_state',
         'average_pd',
@@ -177,10 +315,41 @@ def main(n_simulations):
         'rwa',
         'rwa_new'
     ]
-    df_result = pd.DataFrame(rows, columns=columns)
-
-    # Save result
-    df_result.to_excel(config.data_path + 'result_data/result_bucket_swaps.xlsx', index=False)
+    columns = columns + [f'rwa_{s}' for s in kernel.segment_names()] + [f'rwa_new_{s}' for s in kernel.segment_names()]
+
+    # In adaptive mode n_simulations is a cap, simulation stops once RWA distribution converged
+    monitor = ConvergenceMonitor(tolerance=tolerance, check_every=check_every) if adaptive else None
+
+    save_path = 'result_data/result_bucket_swaps'
+    summary_columns = ['rwa', 'rwa_new', 'weighted_pd', 'weighted_pd_new']
+    summary_columns = summary_columns + [f'rwa_new_{s}' for s in kernel.segment_names()]
+    with ResultSink(save_path, columns, export_xlsx=export_xlsx,
+                    summary_columns=summary_columns, write_rows=write_rows) as sink:
+        progress = ProgressReporter('Bucket swaps approach', n_simulations)
+        if batched:
+            print(f'Bucket swaps approach: starting batched simulation of {n_simulations} scenarios '
+                  f'with seed = {seed}...')
+            results = iterate_shuffling_batched(df, kernel, df_swaps, n_simulations, chunk_size=chunk_size,
+                                                seed=seed, n_workers=n_workers, engine=engine,
+                                                incremental=incremental)
+            for df_chunk in results:
+                sink.append(df_chunk)
+                progress.update(len(df_chunk))
+                if monitor is not None and monitor.update(df_chunk['rwa_new']):
+                    break
+        else:
+            results = iterate_parallel(_run_shuffling_task, random_states, shared, n_workers)
+            for row in results:
+                sink.append([row])
+                progress.update()
+                if monitor is not None and monitor.update([row[columns.index('rwa_new')]]):
+                    break
+        results.close()
+        progress.close()
+
+    # Save convergence trace
+    if monitor is not None:
+        monitor.save(config.data_path + save_path + '_convergence.parquet')
 
 
 if __name__ == '__main__':
@@ -1,17 +1,64 @@
+import json
+import warnings
+
 import numpy as np
 import pandas as pd
 
 from _code._config import Confs
 config = Confs()
 
-from _code._utilities import calculate_rwa
-
-
-def run_movements(df, df_deals, random_state,
+from _code._rwa_kernel import load_rwa_kernel
+from _code._storage import load_clean_data
+from _code._parallel import iterate_parallel
+from _code._result_sink import ResultSink
+from _code._convergence import ConvergenceMonitor
+from _code._instrumentation import ProgressReporter, timed
+from _code._rwa_distribution import describe_rwa_distribution, movement_probabilities, tilt_probabilities
+from _code._factor_model import FactorMigration, grade_rwa_moments, conditional_rwa_moments
+from _code._factor_model import describe_factor_rwa_distribution
+from _code._transition_model import TransitionMigration
+
+
+# Columns of simulation result. Column random_state holds seed of np.random in sequential mode and number of scenario
+# in batched mode, where scenarios are drawn from streams of chunks spawned from seed (see run_movements_chunk), so
+# a batched scenario cannot be reproduced by run_movements with its random_state
+result_columns = [
+    'random_state',
+
+    'mgs_movement_median',
+    'mgs_movement_mean',
+
+    'average_pd',
+    'average_pd_new',
+    'rwa',
+    'rwa_new',
+
+    'mgs_-3',
+    'mgs_-2',
+    'mgs_-1',
+    'mgs_0',
+    'mgs_1',
+    'mgs_2',
+    'mgs_3'
+]
+
+# Columns of simulation result added by one-factor approach - systematic factor of scenario and RWA expected
+# conditional on it
+factor_columns = [
+    'factor',
+    'rwa_new_conditional'
+]
+
+# Columns of simulation result added by importance sampling - likelihood ratio weighting the scenario in estimates
+importance_columns = [
+    'likelihood_ratio'
+]
+
+
+@timed
+def run_movements(df, kernel, random_state,
                   approach='linear', approach_params=None):
 
-    print(f'MGS movements approach: starting simulation with random state = {random_state}...')
-
     np.random.seed(random_state)
 
     # Calculate new MGS grade after shock
@@ -35,24 +82,11 @@ def run_movements(df, df_deals, random_state,
     df.loc[df['mgs_new'] <= 1, 'mgs_new'] = 1
 
     # Attach new PD
-    config_mgs = pd.read_csv(config.data_path + 'clean_data/config_mgs_mapping.csv',
-                             usecols=['mgs', 'pd_mid'])
-    df = pd.merge(
-        df,
-        config_mgs.rename(columns={'mgs': 'mgs_new', 'pd_mid': 'pd_new'}),
-        on=['mgs_new'], how='left', validate='m:1'
-    )
-
-    # Merge new pds to deals
-    df_deals = pd.merge(
-        df_deals,
-        df[['cis_code', 'pd_new']],
-        on=['cis_code'], how='left', validate='m:1')
-
-    # Calculate RWA given new PD
-    df_deals = calculate_rwa(df_deals, pd='pd_new', rw='rw_updated_calc_new', rwa='rwa_updated_calc_new')
-    rwa = df_deals['rwa_updated_calc'].sum()
-    rwa_new = df_deals['rwa_updated_calc_new'].sum()
+    df['pd_new'] = kernel.pd_from_grades(df['mgs_new'].to_numpy(dtype=int))
+
+    # Calculate RWA given new grades
+    rwa = kernel.rwa
+    rwa_new, rwa_new_segments = kernel.rwa_breakdown_from_grades(df['mgs_new'].to_numpy(dtype=int))
     # print(f'   Cumulative RWA before simulation: {round(rwa):,}')
     # print(f'   Cumulative RWA after simulation: {round(rwa_new):,}')
 
@@ -82,64 +116,475 @@ def run_movements(df, df_deals, random_state,
         n = (df['mgs_movement'] == i).sum()
         row = row + [n]
 
+    # Add RWA breakdowns by segment, if any
+    row = row + [kernel.segment_rwa[s] for s in kernel.segment_names()]
+    row = row + [rwa_new_segments[s] for s in kernel.segment_names()]
+
     return row
 
 
-def main(n_simulations, approach='linear', approach_params=None):
+# Largest dimension of Sobol sequences of scipy (number of tabulated direction numbers)
+sobol_max_dimension = 21201
+
+
+def draw_uniforms(rng, size, sampling='random'):
+    """
+    Draws matrix of uniform variables on (0, 1) with variance reduction across scenarios
+    :param rng: numpy Generator
+    :param size: tuple (n_scenarios, n_obligors)
+    :param sampling: 'random' - independent draws,
+                     'antithetic' - second half of scenarios mirrors the first one (u -> 1 - u),
+                     'lhs' - Latin hypercube, each obligor gets one draw from each of n_scenarios strata,
+                     'sobol' - scrambled Sobol sequence, balanced for n_scenarios equal to a power of 2. Sobol
+                     directions are defined for at most sobol_max_dimension obligors, further obligors get Latin
+                     hypercube draws
+    """
+    n_scenarios, n_obligors = size
+
+    if sampling == 'random':
+        uniforms = rng.random(size)
+    if sampling == 'antithetic':
+        uniforms = rng.random(((n_scenarios + 1) // 2, n_obligors))
+        uniforms = np.concatenate([uniforms, 1 - uniforms])[:n_scenarios]
+    if sampling == 'lhs':
+        strata = rng.permuted(np.tile(np.arange(n_scenarios), (n_obligors, 1)), axis=1).T
+        uniforms = (strata + rng.random(size)) / n_scenarios
+    if sampling == 'sobol':
+        from scipy.stats import qmc
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            uniforms = qmc.Sobol(d=min(n_obligors, sobol_max_dimension), scramble=True, seed=rng).random(n_scenarios)
+        if n_obligors > sobol_max_dimension:
+            uniforms = np.hstack([uniforms, draw_uniforms(rng, (n_scenarios, n_obligors - sobol_max_dimension), 'lhs')])
+
+    return uniforms
+
+
+def draw_movements(rng, size, approach='linear', approach_params=None, sampling='random'):
+    """
+    Draws matrix of mgs movements for a batch of scenarios
+    :param rng: numpy Generator
+    :param size: tuple (n_scenarios, n_obligors)
+    :param approach: 'linear' or 'normal', same as in run_movements
+    :param approach_params: parameters of the approach, same as in run_movements
+    :param sampling: 'random' draws movements directly, 'antithetic', 'lhs' and 'sobol' map uniforms
+                     from draw_uniforms through inverse CDF of movement distribution
+    """
+    upper_limit = -3
+    lower_limit = 3
 
-    # Read obligor data
-    df = pd.read_csv(config.data_path + 'clean_data/clean_obligor_data_merged.csv')
+    if sampling == 'random':
+        if approach == 'linear':
+            movements = rng.integers(upper_limit, lower_limit + 1, size=size, dtype=np.int16)
+        if approach == 'normal':
+            mean = approach_params['mean']
+            std_dev = approach_params['std_dev']
 
-    # Read deals data for capital calculation
-    df_deals = pd.read_csv(config.data_path + 'clean_data/clean_deal_data_merged.csv')
+            movements = np.rint(rng.normal(loc=mean, scale=std_dev, size=size))
+            movements = np.clip(movements, upper_limit, lower_limit).astype(np.int16)
 
-    # Rename pd and mgs columns for simplicity
-    df.rename(columns={'pd_updated': 'pd', 'mgs_updated': 'mgs'}, inplace=True)
+        return movements
 
-    # Simulate random movements in MGS
+    uniforms = draw_uniforms(rng, size, sampling)
 
-    # Run simulations
-    random_states = list(range(n_simulations))
-    rows = []
+    if approach == 'linear':
+        n_movements = lower_limit - upper_limit + 1
+        movements = np.minimum(np.floor(uniforms * n_movements), n_movements - 1) + upper_limit
+    if approach == 'normal':
+        mean = approach_params['mean']
+        std_dev = approach_params['std_dev']
 
-    for random_state in random_states:
-        row = run_movements(df, df_deals, random_state, approach, approach_params)
-        rows.append(row)
+        from scipy.special import ndtri
+        movements = np.rint(mean + std_dev * ndtri(uniforms))
 
-    # Create DataFrame to store the results
-    columns = [
-        'random_state',
+    movements = np.clip(movements, upper_limit, lower_limit).astype(np.int16)
 
-        'mgs_movement_median',
-        'mgs_movement_mean',
+    return movements
 
-        'average_pd',
-        'average_pd_new',
-        'rwa',
-        'rwa_new',
 
-        'mgs_-3',
-        'mgs_-2',
-        'mgs_-1',
-        'mgs_0',
-        'mgs_1',
-        'mgs_2',
-        'mgs_3'
-    ]
-    df_result = pd.DataFrame(rows, columns=columns)
+def draw_tilted_movements(rng, size, approach='linear', approach_params=None, tilt=0.0, sampling='random'):
+    """
+    Draws matrix of mgs movements for a batch of scenarios from distribution tilted towards downgrades, see
+    tilt_probabilities, for importance sampling of RWA tails
+    :param rng: numpy Generator
+    :param size: tuple (n_scenarios, n_obligors)
+    :param approach: 'linear' or 'normal', same as in run_movements
+    :param approach_params: parameters of the approach, same as in run_movements
+    :param tilt: tilt per notch, positive values favour downgrades
+    :param sampling: sampling of uniforms, see draw_uniforms
+    :return: tuple (movements, log_likelihood_ratio) with arrays of shape (n_scenarios, n_obligors) and
+             (n_scenarios,)
+    """
+    upper_limit = -3
+    lower_limit = 3
+    movements_range = np.arange(upper_limit, lower_limit + 1)
+
+    probabilities, log_mgf = tilt_probabilities(movement_probabilities(approach, approach_params), movements_range,
+                                                tilt)
+    cdf = np.cumsum(probabilities)
+    cdf[-1] = 1.0
+
+    uniforms = draw_uniforms(rng, size, sampling)
+    movements = np.minimum(np.searchsorted(cdf, uniforms, side='right'), len(cdf) - 1) + upper_limit
+    movements = movements.astype(np.int16)
+
+    # Obligors move independently, so likelihood ratio of scenario is product of likelihood ratios of obligors
+    log_likelihood_ratio = size[1] * log_mgf - tilt * movements.sum(axis=1, dtype=np.int64)
+
+    return movements, log_likelihood_ratio
+
+
+def draw_factor_movements(rng, mgs, n_scenarios, migration, sampling='random', tilt=0.0):
+    """
+    Draws matrix of mgs movements of one-factor approach for a batch of scenarios
+    :param rng: numpy Generator
+    :param mgs: array (n_obligors,) with current grade of each obligor
+    :param n_scenarios: number of scenarios
+    :param migration: FactorMigration
+    :param sampling: 'random' draws normals directly, 'antithetic', 'lhs' and 'sobol' map uniforms from
+                     draw_uniforms through inverse normal CDF, with systematic factor in the first dimension
+    :param tilt: shift of mean of systematic factor for importance sampling, likelihood ratio of a scenario is
+                 exp(tilt ** 2 / 2 - tilt * factor)
+    :return: tuple (factor, movements) with arrays of shape (n_scenarios,) and (n_scenarios, n_obligors)
+    """
+    if sampling == 'random':
+        factor = rng.standard_normal(n_scenarios)
+        noise = rng.standard_normal((n_scenarios, len(mgs)))
+    else:
+        from scipy.special import ndtri
+
+        normals = ndtri(draw_uniforms(rng, (n_scenarios, len(mgs) + 1), sampling))
+        factor = normals[:, 0]
+        noise = normals[:, 1:]
+    factor = factor + tilt
+
+    return factor, migration.movements_from_normals(mgs, factor, noise)
+
+
+def draw_transition_movements(rng, mgs, n_scenarios, migration, horizon=1, sampling='random', tilt=0.0):
+    """
+    Draws matrix of mgs movements of transition matrix approach for a batch of scenarios
+    :param rng: numpy Generator
+    :param mgs: array (n_obligors,) with current grade of each obligor
+    :param n_scenarios: number of scenarios
+    :param migration: TransitionMigration
+    :param horizon: number of periods of migration
+    :param sampling: sampling of uniforms, see draw_uniforms
+    :param tilt: tilt of transition matrix rows towards downgrades for importance sampling, see TransitionMigration
+    :return: array (n_scenarios, n_obligors) of movements, not limited to upper_limit..lower_limit
+    """
+    uniforms = draw_uniforms(rng, (n_scenarios, len(mgs)), sampling)
+    return migration.grades_from_uniforms(mgs, uniforms, horizon, tilt) - mgs
+
+
+@timed
+def run_movements_chunk(df, kernel, first_scenario, n_scenarios, seed_sequence,
+                        approach='linear', approach_params=None, sampling='random', migration=None, tilt=None,
+                        rwa_moments=None):
+    """
+    Simulates mgs movements for a chunk of scenarios with matrix operations
+    :param df: DataFrame on obligor level, ordered as obligors of kernel
+    :param kernel: RwaKernel for capital calculation
+    :param first_scenario: number of the first scenario in chunk, used as random_state column (not a seed)
+    :param n_scenarios: number of scenarios in chunk
+    :param seed_sequence: numpy SeedSequence of the chunk
+    :param approach: 'linear' or 'normal', same as in run_movements, 'factor' for correlated movements or
+                     'transition' for movements drawn from transition matrix over approach_params['horizon']
+    :param approach_params: parameters of the approach, same as in run_movements
+    :param sampling: sampling of movements, see draw_uniforms
+    :param migration: FactorMigration of 'factor' approach or TransitionMigration of 'transition' approach
+    :param tilt: if given, movements are importance sampled with tilt towards downgrades and likelihood ratio of
+                 each scenario is added to results. Tilt is per notch for 'linear', 'normal' and 'transition'
+                 approaches (e.g. 0.05) and shift of systematic factor for 'factor' approach (e.g. 2.5)
+    :param rwa_moments: tuple (first, gram) of grade_rwa_moments of obligors for 'factor' approach, computed for
+                        the chunk if not given
+    """
+    rng = np.random.default_rng(seed_sequence)
 
-    # Save result
+    upper_limit = -3
+    lower_limit = 3
+
+    # Calculate new MGS grades after shock for all scenarios of chunk
+    mgs = df['mgs'].to_numpy(dtype=np.int16)
+    tilt_draw = 0.0 if tilt is None else tilt
+    if approach == 'factor':
+        factor, movements = draw_factor_movements(rng, mgs, n_scenarios, migration, sampling, tilt_draw)
+        log_likelihood_ratio = tilt_draw ** 2 / 2 - tilt_draw * factor
+    elif approach == 'transition':
+        horizon = approach_params['horizon']
+        movements = draw_transition_movements(rng, mgs, n_scenarios, migration, horizon, sampling, tilt_draw)
+        log_likelihood_ratio = migration.log_mgf(mgs, horizon, tilt_draw).sum() \
+            - tilt_draw * movements.sum(axis=1, dtype=np.int64)
+    elif tilt is not None:
+        movements, log_likelihood_ratio = draw_tilted_movements(rng, (n_scenarios, kernel.n_obligors), approach,
+                                                                approach_params, tilt, sampling)
+    else:
+        movements = draw_movements(rng, (n_scenarios, kernel.n_obligors), approach, approach_params, sampling)
+    mgs_new = np.clip(mgs + movements, 1, 26)
+    rwa_new, rwa_new_segments = kernel.rwa_breakdown_from_grades(mgs_new)
+
+    # Reduce to per-scenario results
+    df_chunk = pd.DataFrame({
+        'random_state': np.arange(first_scenario, first_scenario + n_scenarios),
+
+        'mgs_movement_median': np.median(movements, axis=1),
+        'mgs_movement_mean': movements.mean(axis=1),
+
+        'average_pd': df['pd'].mean(),
+        'average_pd_new': kernel.pd_from_grades(mgs_new).mean(axis=1),
+        'rwa': kernel.rwa,
+        'rwa_new': rwa_new
+    })
+
+    # Note number of obligors per mgs movement, transitions beyond limits are counted at the limits
+    movements_counted = np.clip(movements, upper_limit, lower_limit) if approach == 'transition' else movements
+    for i in range(upper_limit, lower_limit + 1):
+        df_chunk[f'mgs_{i}'] = (movements_counted == i).sum(axis=1)
+
+    # Add RWA breakdowns by segment, if any
+    for s in kernel.segment_names():
+        df_chunk[f'rwa_{s}'] = kernel.segment_rwa[s]
+    for s in kernel.segment_names():
+        df_chunk[f'rwa_new_{s}'] = rwa_new_segments[s]
+
+    # Add RWA expected conditional on systematic factor, a low variance estimate of RWA of the scenario
+    if approach == 'factor':
+        if rwa_moments is None:
+            rwa_moments = grade_rwa_moments(kernel, mgs, upper_limit, lower_limit)
+        first, gram = rwa_moments
+        df_chunk['factor'] = factor
+        df_chunk['rwa_new_conditional'], _ = conditional_rwa_moments(migration, first, gram, factor)
+
+    # Add likelihood ratio of importance sampled scenarios, estimates weighted by it are unbiased
+    if tilt is not None:
+        df_chunk['likelihood_ratio'] = np.exp(log_likelihood_ratio)
+
+    return df_chunk
+
+
+def _run_movements_task(shared, random_state):
+    return run_movements(shared['df'], shared['kernel'], random_state,
+                         shared['approach'], shared['approach_params'])
+
+
+def _run_movements_chunk_task(shared, task):
+    first_scenario, n_scenarios, seed_sequence = task
+    return run_movements_chunk(shared['df'], shared['kernel'], first_scenario, n_scenarios, seed_sequence,
+                               shared['approach'], shared['approach_params'], shared['sampling'],
+                               shared['migration'], shared['tilt'], shared['rwa_moments'])
+
+
+def iterate_movements_batched(df, kernel, n_simulations,
+                              approach='linear', approach_params=None,
+                              chunk_size=1000, seed=None, n_workers=1, sampling='random', migration=None,
+                              tilt=None):
+    """
+    Simulates mgs movements for all scenarios with matrix operations, processing chunk_size scenarios at a time.
+    Each chunk draws from its own stream spawned from seed, so results do not depend on number of workers.
+    :param df: DataFrame on obligor level, ordered as obligors of kernel
+    :param kernel: RwaKernel for capital calculation
+    :param n_simulations: number of scenarios
+    :param approach: 'linear' or 'normal', same as in run_movements
+    :param approach_params: parameters of the approach, same as in run_movements
+    :param chunk_size: number of scenarios held in memory at once by each worker
+    :param seed: seed of numpy SeedSequence from which streams of chunks are spawned
+    :param n_workers: number of worker processes
+    :param sampling: sampling of movements, see draw_uniforms. Variance reduction applies within each chunk
+    :param migration: FactorMigration of 'factor' approach or TransitionMigration of 'transition' approach
+    :param tilt: tilt of importance sampling, see run_movements_chunk
+    :return: generator of DataFrames with results of chunks in order of scenarios
+    """
+    # Split scenarios into chunks with independent random streams
+    starts = list(range(0, n_simulations, chunk_size))
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(starts))
+    tasks = [(start, min(chunk_size, n_simulations - start), seed_sequence)
+             for start, seed_sequence in zip(starts, seed_sequences)]
+
+    # Sums of obligor RWAs by grade of 'factor' approach do not depend on scenarios, they are computed once
+    rwa_moments = grade_rwa_moments(kernel, df['mgs'].to_numpy()) if approach == 'factor' else None
+
+    shared = {'df': df[['mgs', 'pd']], 'kernel': kernel, 'approach': approach, 'approach_params': approach_params,
+              'sampling': sampling, 'migration': migration, 'tilt': tilt, 'rwa_moments': rwa_moments}
+    return iterate_parallel(_run_movements_chunk_task, tasks, shared, n_workers)
+
+
+def run_movements_batched(df, kernel, n_simulations,
+                          approach='linear', approach_params=None,
+                          chunk_size=1000, seed=None, n_workers=1, sampling='random', migration=None, tilt=None):
+    """
+    Simulates mgs movements for all scenarios with matrix operations, see iterate_movements_batched
+    :return: DataFrame with one row per scenario and the same columns as sequential simulation
+    """
+    chunks = iterate_movements_batched(df, kernel, n_simulations, approach, approach_params,
+                                       chunk_size, seed, n_workers, sampling, migration, tilt)
+    df_result = pd.concat(chunks, ignore_index=True)
+
+    return df_result
+
+
+def load_factor_migration(approach_params):
+    """
+    Returns FactorMigration of 'factor' approach on PD scale of config
+    :param approach_params: dictionary with 'mean', 'std_dev' and 'rho', see FactorMigration
+    """
+    config_mgs = load_clean_data('config_mgs_mapping', columns=['mgs', 'pd_mid', 'pd_high'])
+    return FactorMigration(config_mgs, approach_params['mean'], approach_params['std_dev'], approach_params['rho'])
+
+
+def load_migration(approach, approach_params):
+    """
+    Returns migration model of approach drawing correlated or grade dependent movements, None for independent
+    movements of 'linear' and 'normal' approaches
+    """
+    if approach == 'factor':
+        return load_factor_migration(approach_params)
+    if approach == 'transition':
+        return TransitionMigration(load_clean_data('config_transition_matrix'))
+    return None
+
+
+def get_result_columns(kernel, approach='linear', tilt=None):
+    """
+    Returns columns of simulation result, extended with RWA breakdowns by segments of kernel
+    """
+    return (result_columns
+            + [f'rwa_{s}' for s in kernel.segment_names()]
+            + [f'rwa_new_{s}' for s in kernel.segment_names()]
+            + (factor_columns if approach == 'factor' else [])
+            + (importance_columns if tilt is not None else []))
+
+
+def get_save_path(n_simulations, approach='linear', approach_params=None, tilt=None):
+    """
+    Returns path of simulation result relative to data path, without extension
+    """
     if approach == 'linear':
-        save_path = f'result_data/result_mgs_movements_{n_simulations}_{approach}.xlsx'
+        save_path = f'result_data/result_mgs_movements_{n_simulations}_{approach}'
     if approach == 'normal':
         mean = approach_params["mean"]
         std_dev = approach_params["std_dev"]
-        save_path = f'result_data/result_mgs_movements_{n_simulations}_{approach}_{mean}_{std_dev}.xlsx'
+        save_path = f'result_data/result_mgs_movements_{n_simulations}_{approach}_{mean}_{std_dev}'
+    if approach == 'factor':
+        mean = approach_params['mean']
+        std_dev = approach_params['std_dev']
+        rho = approach_params['rho']
+        save_path = f'result_data/result_mgs_movements_{n_simulations}_{approach}_{mean}_{std_dev}_{rho}'
+    if approach == 'transition':
+        horizon = approach_params['horizon']
+        save_path = f'result_data/result_mgs_movements_{n_simulations}_{approach}_{horizon}'
+    if tilt is not None:
+        save_path = f'{save_path}_tilt_{tilt}'
+
+    return save_path
+
+
+def main(n_simulations, approach='linear', approach_params=None,
+         batched=False, chunk_size=1000, seed=None, n_workers=1, export_xlsx=False, write_rows=True,
+         adaptive=False, tolerance=0.001, check_every=1000, sampling='random', segments=(), compact=False,
+         tilt=None, quantiles=(0.5, 0.75, 0.99)):
+    """
+    :param segments: segmentations of RWA breakdowns added to results, e.g. ('pd_model', 'bucket', 'cascade_flag'),
+                     see segment_columns of _rwa_kernel
+    :param compact: if True, obligor and deal data are held in compact dtypes, see _compact
+    :param tilt: if given, scenarios are importance sampled towards downgrades and summary is weighted by their
+                 likelihood ratios, see run_movements_chunk. Use with quantiles such as (0.99, 0.999)
+    :param quantiles: quantile levels of online summary
+    """
+    # Movements of 'factor' and 'transition' approaches and importance sampling are drawn for batches of scenarios
+    # only, convergence monitor does not weight scenarios
+    assert (approach not in ['factor', 'transition'] and tilt is None) or batched
+    assert tilt is None or not adaptive
+    assert sampling == 'random' or batched, 'Variance reduction of sampling applies to batched mode only'
+
+    # Read obligor data
+    df = load_clean_data('clean_obligor_data_merged', compact=compact)
+
+    # Rename pd and mgs columns for simplicity
+    df.rename(columns={'pd_updated': 'pd', 'mgs_updated': 'mgs'}, inplace=True)
+
+    # Build RWA kernel from deals data for capital calculation
+    kernel = load_rwa_kernel(df['cis_code'], segments, compact)
+    columns = get_result_columns(kernel, approach, tilt)
+    migration = load_migration(approach, approach_params)
+
+    # Simulate random movements in MGS, saving results as scenarios finish
+    save_path = get_save_path(n_simulations, approach, approach_params, tilt)
+
+    # In adaptive mode n_simulations is a cap, simulation stops once RWA distribution converged
+    monitor = ConvergenceMonitor(tolerance=tolerance, check_every=check_every) if adaptive else None
+
+    summary_columns = ['rwa', 'rwa_new', 'average_pd', 'average_pd_new']
+    summary_columns = summary_columns + [f'rwa_new_{s}' for s in kernel.segment_names()]
+    weight_column = 'likelihood_ratio' if tilt is not None else None
+    with ResultSink(save_path, columns, export_xlsx=export_xlsx, summary_columns=summary_columns,
+                    write_rows=write_rows, summary_quantiles=quantiles, weight_column=weight_column) as sink:
+        progress = ProgressReporter('MGS movements approach', n_simulations)
+        if batched:
+            print(f'MGS movements approach: starting batched simulation of {n_simulations} scenarios '
+                  f'with seed = {seed}...')
+            results = iterate_movements_batched(df, kernel, n_simulations, approach, approach_params,
+                                                chunk_size=chunk_size, seed=seed, n_workers=n_workers,
+                                                sampling=sampling, migration=migration, tilt=tilt)
+            for df_chunk in results:
+                sink.append(df_chunk)
+                progress.update(len(df_chunk))
+                if monitor is not None and monitor.update(df_chunk['rwa_new']):
+                    break
+        else:
+            random_states = list(range(n_simulations))
+            shared = {'df': df, 'kernel': kernel, 'approach': approach, 'approach_params': approach_params}
+            results = iterate_parallel(_run_movements_task, random_states, shared, n_workers)
+            for row in results:
+                sink.append([row])
+                progress.update()
+                if monitor is not None and monitor.update([row[columns.index('rwa_new')]]):
+                    break
+        results.close()
+        progress.close()
+
+    # Save convergence trace
+    if monitor is not None:
+        monitor.save(config.data_path + save_path + '_convergence.parquet')
+
+
+@timed
+def main_analytic(approach='linear', approach_params=None, method='fft', quantiles=(0.5, 0.75, 0.99)):
+    """
+    Computes RWA distribution after mgs movements without simulation and saves it in the format of simulation
+    summary, so that it can be visualised and compared with simulated results
+    :param method: 'fft' for exact distribution up to lattice rounding, 'normal' for normal approximation,
+                   ignored by 'factor' approach which mixes normal approximations conditional on the factor. 'fft'
+                   falls back to normal approximation for large books, see describe_rwa_distribution
+    """
+
+    # Read obligor data
+    df = load_clean_data('clean_obligor_data_merged')
+    df.rename(columns={'pd_updated': 'pd', 'mgs_updated': 'mgs'}, inplace=True)
+
+    # Build RWA kernel from deals data for capital calculation
+    kernel = load_rwa_kernel(df['cis_code'])
+
+    if approach == 'factor':
+        summary = describe_factor_rwa_distribution(kernel, df['mgs'].to_numpy(), load_factor_migration(approach_params),
+                                                   quantiles=quantiles)
+    else:
+        summary = describe_rwa_distribution(kernel, df['mgs'].to_numpy(), approach, approach_params,
+                                            quantiles=quantiles, method=method)
+
+    save_path = get_save_path('analytic', approach, approach_params)
+    with open(config.data_path + save_path + '_summary.json', 'w') as f:
+        json.dump(summary, f, indent=4, default=float)
 
-    df_result.to_excel(config.data_path + save_path, index=False)
+    return summary
 
 
 if __name__ == '__main__':
     main(n_simulations=1000, approach='linear')
     # main(n_simulations=1000, approach='normal', approach_params={'mean': 0.0, 'std_dev': 1.5})
     # main(n_simulations=1000, approach='normal', approach_params={'mean': 0.0, 'std_dev': 2.0})
+    # main(n_simulations=1000, approach='factor', approach_params={'mean': 0.0, 'std_dev': 0.15, 'rho': 0.25},
+    #      batched=True)
+    # main(n_simulations=1000, approach='transition', approach_params={'horizon': 1}, batched=True)
+    # main(n_simulations=10000, approach='factor', approach_params={'mean': 0.0, 'std_dev': 0.15, 'rho': 0.25},
+    #      batched=True, tilt=2.5, quantiles=(0.5, 0.99, 0.999))
@@ -0,0 +1,223 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from _code._config import Confs
+config = Confs()
+
+from _code._rwa_kernel import load_rwa_kernel, IncrementalRwa
+from _code._storage import load_clean_data
+from _code._parallel import iterate_parallel
+from _code._result_sink import ResultSink
+from _code._online_stats import OnlineSummary
+from _code._instrumentation import ProgressReporter
+from _code._swap_kernel import SwapPlan
+from _code._factor_model import grade_rwa_moments
+from _code.simulate_approach_mgs_movements import result_columns as mgs_movements_columns, run_movements_chunk
+from _code.simulate_approach_mgs_movements import factor_columns, load_migration
+from _code.simulate_approach_bucket_swaps import run_shuffling_chunk
+
+# Parameters keying results of grid points, not applicable parameters are missing
+parameter_columns = ['point', 'simulator', 'approach', 'mean', 'std_dev', 'rho', 'horizon', 'swaps_variant',
+                     'swaps_scale']
+string_parameters = ['simulator', 'approach', 'swaps_variant']
+
+# Columns of bucket swaps result, in addition to columns shared with mgs movements result
+bucket_swaps_columns = ['weighted_pd', 'weighted_pd_new']
+
+
+def make_grid(mgs_movements=None, bucket_swaps=None):
+    """
+    Returns grid points as all combinations of given parameter values of each simulator
+    :param mgs_movements: dictionary with lists of 'approach', 'mean', 'std_dev', 'rho' and 'horizon', e.g.
+                          {'approach': ['normal'], 'mean': [0.0], 'std_dev': [1.5, 2.0]}. Mean and standard
+                          deviation are ignored by linear approach, correlation rho is used by factor approach only
+                          and horizon by transition approach only
+    :param bucket_swaps: dictionary with lists of 'swaps_variant' and 'swaps_scale', e.g.
+                         {'swaps_variant': ['base'], 'swaps_scale': [1.0, 1.5]}
+    :return: list of dictionaries with parameters of one simulation each
+    """
+    points = []
+    if mgs_movements is not None:
+        approaches = mgs_movements.get('approach', ['normal'])
+        means = mgs_movements.get('mean', [0.0])
+        std_devs = mgs_movements.get('std_dev', [1.5])
+        rhos = mgs_movements.get('rho', [0.25])
+        horizons = mgs_movements.get('horizon', [1])
+        for approach, mean, std_dev, rho, horizon in itertools.product(approaches, means, std_devs, rhos, horizons):
+            point = {'simulator': 'mgs_movements', 'approach': approach}
+            if approach == 'normal':
+                point.update({'mean': mean, 'std_dev': std_dev})
+            if approach == 'factor':
+                point.update({'mean': mean, 'std_dev': std_dev, 'rho': rho})
+            if approach == 'transition':
+                point.update({'horizon': horizon})
+            if point not in points:
+                points.append(point)
+
+    if bucket_swaps is not None:
+        variants = bucket_swaps.get('swaps_variant', ['base'])
+        scales = bucket_swaps.get('swaps_scale', [1.0])
+        for variant, scale in itertools.product(variants, scales):
+            points.append({'simulator': 'bucket_swaps', 'swaps_variant': variant, 'swaps_scale': scale})
+
+    return points
+
+
+def get_swaps(df_swaps, bucket, scale=1.0):
+    """
+    Returns swaps matrix with number of obligors to be swapped, as in simulate_approach_bucket_swaps
+    :param df_swaps: DataFrame with columns 'from_bucket', 'to_bucket' and 'percent'
+    :param bucket: Series with bucket of each obligor
+    :param scale: factor applied to swapped percentages
+    """
+    counts = bucket.value_counts()
+    df_swaps = df_swaps[['from_bucket', 'to_bucket', 'percent']].copy()
+    df_swaps['swaps'] = (df_swaps['percent'] * scale * df_swaps['from_bucket'].map(counts).fillna(0)).astype(int)
+    return df_swaps
+
+
+def _run_sweep_chunk_task(shared, task):
+    point_index, first_scenario, n_scenarios, seed_sequence = task
+    point = shared['points'][point_index]
+
+    if point['simulator'] == 'mgs_movements':
+        approach_params = {c: point[c] for c in ['mean', 'std_dev', 'horizon'] if c in point}
+        df_chunk = run_movements_chunk(shared['df'], shared['kernel'], first_scenario, n_scenarios, seed_sequence,
+                                       point['approach'], approach_params, shared['sampling'],
+                                       migration=shared['migrations'].get(point_index),
+                                       rwa_moments=shared['rwa_moments'])
+    if point['simulator'] == 'bucket_swaps':
+        df_chunk = run_shuffling_chunk(shared['df'], shared['kernel'], shared['plans'][point_index],
+                                       first_scenario, n_scenarios, seed_sequence, shared['engine'],
+                                       shared['evaluator'])
+
+    # Missing columns of the other simulator and parameters have fixed types, so that all chunks share parquet schema
+    df_chunk = df_chunk.reindex(columns=shared['columns'])
+    df_chunk[shared['columns'][1:]] = df_chunk[shared['columns'][1:]].astype(np.float64)
+
+    # Key results by parameters of grid point
+    df_chunk['point'] = point_index
+    for c in parameter_columns[1:]:
+        if c in string_parameters:
+            df_chunk[c] = pd.Series(point.get(c), index=df_chunk.index, dtype='string')
+        else:
+            df_chunk[c] = float(point.get(c, np.nan))
+    return df_chunk
+
+
+def get_save_path(name):
+    """
+    Returns path of sweep result relative to data path, without extension
+    """
+    return f'result_data/result_sweep_{name}'
+
+
+def main(grid, n_simulations, name='sweep', swaps_variants=None, chunk_size=1000, seed=None, n_workers=1,
+         engine=None, write_rows=True, segments=(), compact=False, quantiles=(0.5, 0.75, 0.99), sampling='random'):
+    """
+    Runs simulations of all grid points sharing loaded data and RWA kernel, and writes one result keyed by
+    parameters of grid points. All grid points use the same random streams (common random numbers), so that
+    differences between grid points are not blurred by sampling noise. Result of a grid point is the same as of
+    batched simulation with the same seed and chunk_size.
+    :param grid: list of grid points, see make_grid
+    :param n_simulations: number of scenarios of each grid point
+    :param name: name of sweep used in paths of results
+    :param swaps_variants: dictionary of swaps matrices in format of config_swaps_matrix (columns 'from_bucket',
+                           'to_bucket' and 'percent') by name, swaps matrix of config is available as 'base'
+    :param chunk_size: number of scenarios held in memory at once by each worker
+    :param seed: seed of numpy SeedSequence from which streams of chunks are spawned
+    :param n_workers: number of worker processes, chunks of all grid points are distributed over workers
+    :param engine: swap kernel engine, see swap_sources
+    :param write_rows: if False, only summary of grid points is saved
+    :param segments: segmentations of RWA breakdowns added to results, see segment_columns of _rwa_kernel
+    :param compact: if True, obligor and deal data are held in compact dtypes, see _compact
+    :param quantiles: quantile levels of summary of grid points
+    :param sampling: sampling of movements of mgs_movements grid points, see draw_uniforms of
+                     simulate_approach_mgs_movements. Swaps of bucket_swaps grid points are drawn at random, and
+                     importance sampling (tilt) is not supported in sweeps, as summaries of grid points are unweighted
+    :return: DataFrame with summary of RWA after stress, one row per grid point
+    """
+
+    # Read obligor data and attach bucket information
+    df = load_clean_data('clean_obligor_data_merged', compact=compact)
+    df.rename(columns={'pd_updated': 'pd', 'mgs_updated': 'mgs'}, inplace=True)
+    config_mgs = load_clean_data('config_mgs_mapping', columns=['mgs', 'bucket'])
+    df = pd.merge(df, config_mgs, on=['mgs'], how='left', validate='m:1')
+    assert df['bucket'].isnull().sum() == 0
+
+    # Build RWA kernel from deals data once for all grid points
+    kernel = load_rwa_kernel(df['cis_code'], segments, compact)
+
+    # Translate swaps matrices of grid points to swap plans
+    swaps_variants = {'base': load_clean_data('config_swaps_matrix'), **(swaps_variants or {})}
+    plans = {}
+    for i, point in enumerate(grid):
+        if point['simulator'] == 'bucket_swaps':
+            df_swaps = get_swaps(swaps_variants[point['swaps_variant']], df['bucket'], point['swaps_scale'])
+            plans[i] = SwapPlan(df['bucket'].to_numpy(), df_swaps)
+
+    # Migration models of factor and transition approaches, built once per grid point
+    migrations = {i: load_migration(point['approach'], point) for i, point in enumerate(grid)
+                  if point['simulator'] == 'mgs_movements' and point['approach'] in ['factor', 'transition']}
+
+    # Sums of obligor RWAs by grade of factor approach, shared by its grid points
+    rwa_moments = None
+    if any(point['simulator'] == 'mgs_movements' and point['approach'] == 'factor' for point in grid):
+        rwa_moments = grade_rwa_moments(kernel, df['mgs'].to_numpy())
+
+    segment_columns = [f'rwa_{s}' for s in kernel.segment_names()] + [f'rwa_new_{s}' for s in kernel.segment_names()]
+    result_columns = mgs_movements_columns + bucket_swaps_columns + segment_columns + factor_columns
+    columns = parameter_columns + result_columns
+
+    # Split scenarios of every grid point into chunks, grid points share random streams of chunks
+    starts = list(range(0, n_simulations, chunk_size))
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(starts))
+    tasks = [(i, start, min(chunk_size, n_simulations - start), seed_sequence)
+             for i in range(len(grid))
+             for start, seed_sequence in zip(starts, seed_sequences)]
+
+    print(f'Sweep: starting {len(grid)} grid points of {n_simulations} scenarios with seed = {seed}...')
+    shared = {'df': df[['mgs', 'pd', 'ead']], 'kernel': kernel, 'points': grid, 'plans': plans, 'engine': engine,
+              'sampling': sampling, 'migrations': migrations, 'rwa_moments': rwa_moments,
+              'evaluator': IncrementalRwa(kernel, df['pd'].to_numpy(dtype=float)), 'columns': result_columns}
+
+    # Run chunks of all grid points, saving results as chunks finish
+    summary_columns = ['rwa_new', 'average_pd_new', 'weighted_pd_new']
+    summary_columns = summary_columns + [f'rwa_new_{s}' for s in kernel.segment_names()]
+    summaries = [OnlineSummary(summary_columns, quantiles) for _ in grid]
+    save_path = get_save_path(name)
+    with ResultSink(save_path, columns, write_rows=write_rows) as sink:
+        progress = ProgressReporter('Sweep', len(grid) * n_simulations)
+        results = iterate_parallel(_run_sweep_chunk_task, tasks, shared, n_workers)
+        for df_chunk in results:
+            sink.append(df_chunk)
+            summaries[df_chunk['point'].iloc[0]].update(df_chunk)
+            progress.update(len(df_chunk))
+        progress.close()
+
+    # Summarise grid points in one row each
+    rows = []
+    for i, (point, summary) in enumerate(zip(grid, summaries)):
+        row = {'point': i, **{c: point.get(c) for c in parameter_columns[1:]}, 'rwa': kernel.rwa}
+        for c, column_summary in summary.to_dict().items():
+            if column_summary['moments']['n'] == 0:
+                continue
+            row[f'{c}_mean'] = column_summary['moments']['mean']
+            row[f'{c}_std'] = column_summary['moments']['std']
+            for q, value in column_summary['quantiles'].items():
+                row[f'{c}_p{100 * float(q):g}'] = value
+        rows.append(row)
+    df_summary = pd.DataFrame(rows)
+    df_summary.to_parquet(config.data_path + save_path + '_points.parquet', index=False)
+
+    print(df_summary[parameter_columns + ['rwa', 'rwa_new_mean', 'rwa_new_std']].to_string(index=False))
+
+    return df_summary
+
+
+if __name__ == '__main__':
+    main(make_grid(mgs_movements={'approach': ['linear', 'normal'], 'mean': [0.0], 'std_dev': [1.5, 2.0]},
+                   bucket_swaps={'swaps_variant': ['base'], 'swaps_scale': [1.0]}),
+         n_simulations=1000)
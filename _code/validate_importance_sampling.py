@@ -0,0 +1,119 @@
+import os
+import tempfile
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+# Cases of importance sampling, tilt of each approach is in its own units, see run_movements_chunk
+validation_cases = [
+    ('factor', {'mean': 0.0, 'std_dev': 0.15, 'rho': 0.25}, 2.5),
+    ('normal', {'mean': 0.0, 'std_dev': 1.5}, 0.05),
+    ('linear', None, 0.05)
+]
+
+
+def run_validation(n_deals, cases, quantiles, n_brute_force, n_scenarios, n_replicates, seed):
+    """
+    Generates synthetic portfolio of n_deals and compares tail quantiles of importance sampled runs with a brute
+    force run. Runs in a fresh process with RWA_SENSITIVITY_DATA_PATH set to a temporary folder, so that modules
+    read the synthetic data.
+    """
+    from _code import generate_synthetic_data
+    from _code._online_stats import weighted_quantile
+    from _code._rwa_kernel import load_rwa_kernel
+    from _code._storage import load_clean_data
+    from _code.simulate_approach_mgs_movements import load_migration, run_movements_batched
+
+    generate_synthetic_data.main(n_deals, seed=seed, raw=False)
+    df = load_clean_data('clean_obligor_data_merged')
+    df.rename(columns={'pd_updated': 'pd', 'mgs_updated': 'mgs'}, inplace=True)
+    kernel = load_rwa_kernel(df['cis_code'])
+
+    rows = []
+    for approach, approach_params, tilt in cases:
+        migration = load_migration(approach, approach_params)
+
+        # Brute force reference, split into plain runs of n_scenarios to measure their standard error
+        rwa_new = run_movements_batched(df, kernel, n_brute_force, approach, approach_params, seed=seed,
+                                        migration=migration)['rwa_new'].to_numpy()
+        reference = np.quantile(rwa_new, quantiles)
+        n_splits = n_brute_force // n_scenarios
+        estimates_plain = np.array([np.quantile(split, quantiles)
+                                    for split in rwa_new[:n_splits * n_scenarios].reshape(n_splits, n_scenarios)])
+
+        # Importance sampled replicates of n_scenarios each, on streams independent of brute force run
+        estimates = []
+        effective_n = []
+        for replicate in range(n_replicates):
+            df_result = run_movements_batched(df, kernel, n_scenarios, approach, approach_params,
+                                              seed=(seed, replicate + 1), migration=migration, tilt=tilt)
+            weights = df_result['likelihood_ratio'].to_numpy()
+            estimates.append(weighted_quantile(df_result['rwa_new'], weights, quantiles))
+            effective_n.append(weights.sum() ** 2 / (weights ** 2).sum())
+        estimates = np.array(estimates)
+
+        for i, q in enumerate(quantiles):
+            se_plain = np.std(estimates_plain[:, i], ddof=1)
+            se = np.std(estimates[:, i], ddof=1)
+            rows.append([
+                approach,
+                tilt,
+                q,
+                reference[i],
+                estimates[:, i].mean(),
+                (estimates[:, i].mean() - reference[i]) / se * np.sqrt(n_replicates),
+                se_plain,
+                se,
+                (se_plain / se) ** 2,
+                np.mean(effective_n)
+            ])
+
+    return rows
+
+
+def main(n_deals=1000, cases=validation_cases, quantiles=(0.99, 0.999), n_brute_force=10 ** 6,
+         n_scenarios=10 ** 4, n_replicates=20, seed=0):
+    """
+    Validates importance sampling of RWA tails on a small synthetic portfolio. Weighted quantiles of importance
+    sampled runs are compared with quantiles of a brute force run, and their standard errors over replicates
+    with standard errors of plain runs of the same size.
+    :param n_deals: size of synthetic portfolio in number of deals
+    :param cases: list of tuples (approach, approach_params, tilt), see validation_cases
+    :param quantiles: quantile levels of RWA after movements to be validated
+    :param n_brute_force: number of scenarios of brute force run
+    :param n_scenarios: number of scenarios of each importance sampled replicate
+    :param n_replicates: number of importance sampled replicates
+    :param seed: seed of synthetic portfolio and simulations
+    :return: DataFrame with brute force and importance sampled quantiles, z_score of their difference and
+             variance_reduction, the ratio of variances of plain and importance sampled estimates
+    """
+    context = multiprocessing.get_context('spawn')
+    data_path = os.environ.get('RWA_SENSITIVITY_DATA_PATH')
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            os.environ['RWA_SENSITIVITY_DATA_PATH'] = directory + '/'
+            with context.Pool(processes=1) as pool:
+                rows = pool.apply(run_validation, (n_deals, cases, quantiles, n_brute_force, n_scenarios,
+                                                   n_replicates, seed))
+    finally:
+        if data_path is None:
+            os.environ.pop('RWA_SENSITIVITY_DATA_PATH', None)
+        else:
+            os.environ['RWA_SENSITIVITY_DATA_PATH'] = data_path
+
+    columns = ['approach', 'tilt', 'quantile', 'brute_force', 'importance_sampling', 'z_score',
+               'se_plain', 'se_importance_sampling', 'variance_reduction', 'effective_n']
+    df_result = pd.DataFrame(rows, columns=columns)
+    print(df_result.to_string(index=False))
+
+    # Differences beyond sampling noise of replicates point to biased likelihood ratios
+    for _, row in df_result[df_result['z_score'].abs() > 3].iterrows():
+        print(f'Validation: p{100 * row["quantile"]:g} of {row["approach"]} approach deviates from brute force '
+              f'by {row["z_score"]:.1f} standard errors')
+
+    return df_result
+
+
+if __name__ == '__main__':
+    main()
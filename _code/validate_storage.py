@@ -0,0 +1,90 @@
+import os
+import tempfile
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+
+def make_chunks():
+    """
+    Returns chunks of deal data whose column types differ between chunks - all missing text and PD in the first
+    chunk, integers in the first chunk and a missing value in the second one
+    """
+    return [
+        pd.DataFrame({'cis_code': [1, 2, 3],
+                      'pd_model': [None, None, None],
+                      'pd_incumbent': [np.nan, np.nan, np.nan],
+                      'grading_id': [10, 11, 12]}),
+        pd.DataFrame({'cis_code': [4, 5],
+                      'pd_model': ['model_a', None],
+                      'pd_incumbent': [0.01, 0.02],
+                      'grading_id': [13, np.nan]}),
+        pd.DataFrame({'cis_code': [6],
+                      'pd_model': ['model_b'],
+                      'pd_incumbent': [0.03],
+                      'grading_id': [14]})
+    ]
+
+
+def run_validation(storage_formats):
+    """
+    Writes chunks with CleanDataWriter and compares the artifact with the concatenated chunks saved at once. Runs in
+    a fresh process with RWA_SENSITIVITY_DATA_PATH set to a temporary folder.
+    """
+    from _code._storage import CleanDataWriter, load_clean_data, save_clean_data
+
+    os.makedirs(os.environ['RWA_SENSITIVITY_DATA_PATH'] + 'clean_data', exist_ok=True)
+    chunks = make_chunks()
+
+    rows = []
+    for storage_format in storage_formats:
+        save_clean_data(pd.concat(chunks, ignore_index=True), 'expected', storage_format, export_csv=False)
+        expected = load_clean_data('expected', storage_format=storage_format)
+
+        writer = CleanDataWriter('streamed', storage_format, export_csv=False)
+        for df in chunks:
+            writer.append(df)
+        writer.close()
+        streamed = load_clean_data('streamed', storage_format=storage_format)
+
+        try:
+            pd.testing.assert_frame_equal(streamed, expected)
+            error = ''
+        except AssertionError as e:
+            error = str(e)
+        rows.append([storage_format, len(streamed), error])
+
+    return rows
+
+
+def main(storage_formats=('feather', 'parquet')):
+    """
+    Validates that clean_data artifacts written from chunks by CleanDataWriter are the same as saved at once,
+    including chunks whose first one has all values of a column missing
+    :param storage_formats: columnar formats to be validated
+    :return: DataFrame with number of rows and assertion error of each format, empty if artifacts are the same
+    """
+    context = multiprocessing.get_context('spawn')
+    data_path = os.environ.get('RWA_SENSITIVITY_DATA_PATH')
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            os.environ['RWA_SENSITIVITY_DATA_PATH'] = directory + '/'
+            with context.Pool(processes=1) as pool:
+                rows = pool.apply(run_validation, (storage_formats,))
+    finally:
+        if data_path is None:
+            os.environ.pop('RWA_SENSITIVITY_DATA_PATH', None)
+        else:
+            os.environ['RWA_SENSITIVITY_DATA_PATH'] = data_path
+
+    df_result = pd.DataFrame(rows, columns=['storage_format', 'n_rows', 'error'])
+    print(df_result.to_string(index=False))
+    for _, row in df_result[df_result['error'] != ''].iterrows():
+        print(f'Validation: streamed {row["storage_format"]} artifact differs from artifact saved at once')
+
+    return df_result
+
+
+if __name__ == '__main__':
+    main()
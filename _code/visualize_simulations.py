@@ -1,18 +1,33 @@
 import numpy as np
 import pandas as pd
 
-import matplotlib.pyplot as plt
-import seaborn as sns
+from _code._result_sink import read_result
+from _code._online_stats import load_summary, weighted_quantile
 
 from _code._config import Confs
 config = Confs()
 
 
-def main():
+# Quantile levels of stress values marked in graphs of results, graphs of summaries mark levels of the summary
+plot_quantiles = [0.5, 0.75, 0.99, 0.999]
+quantile_colors = {0.5: 'green', 0.75: 'red', 0.99: 'darkorange', 0.999: 'purple'}
+
+
+def main(from_summary=False, results_tag='result_bucket_swaps'):
+    # Plotting libraries are slow to import, import them only when graphs are created
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 
     # Read data with simulations result - adjust depending on simulation to be visualised
-    results_tag = 'result_bucket_swaps'
-    df = pd.read_excel(config.data_path + f'result_data/{results_tag}.xlsx')
+    if from_summary:
+        summary = load_summary(config.data_path + f'result_data/{results_tag}_summary.json')
+    else:
+        df = read_result(f'result_data/{results_tag}')
+
+    # Importance sampled scenarios are weighted by their likelihood ratios
+    weights = None
+    if not from_summary and 'likelihood_ratio' in df.columns:
+        weights = df['likelihood_ratio'].to_numpy()
 
     # Define parameters for plotting
     plot_configurations = [
@@ -42,29 +57,49 @@ def main():
         dimension = plot_configuration['dimension']
         dimension_function = plot_configuration['dimension_function']
 
-        # Plot distribution
-        sns.distplot(x=df[column_name_after_stress], hist=True, kde=False,
-                     color='darkblue',
-                     hist_kws={'edgecolor': 'black'},
-                     kde_kws={'linewidth': 1})
+        # Skip values not available in results, e.g. weighted PD in analytic RWA distribution
+        columns = summary.keys() if from_summary else df.columns
+        if column_name_after_stress not in columns:
+            continue
 
-        # Add key verticals - pre-stress value, p50 stress value, p75 stress value
-        value_now = df[column_name_pre_stress].mean()
+        # Plot distribution
+        if from_summary:
+            histogram = summary[column_name_after_stress]['histogram']
+            plt.hist(histogram['edges'][:-1], bins=histogram['edges'], weights=histogram['counts'],
+                     color='darkblue', edgecolor='black')
+        else:
+            sns.distplot(x=df[column_name_after_stress], hist=True, kde=False,
+                         color='darkblue',
+                         hist_kws={'edgecolor': 'black', 'weights': weights},
+                         kde_kws={'linewidth': 1})
+
+        # Get key values - pre-stress value and quantiles of stress value, levels available in summary are used
+        if from_summary:
+            value_now = summary[column_name_pre_stress]['moments']['mean']
+            values = {float(p): v for p, v in summary[column_name_after_stress]['quantiles'].items()}
+        else:
+            value_now = df[column_name_pre_stress].mean()
+            if weights is not None:
+                values = weighted_quantile(df[column_name_after_stress], weights, plot_quantiles)
+            else:
+                values = np.quantile(df[column_name_after_stress], plot_quantiles)
+            values = dict(zip(plot_quantiles, values))
+
+        # Add key verticals
         plt.axvline(value_now, color='grey')
-
-        value_p50 = np.percentile(df[column_name_after_stress], 50)
-        plt.axvline(value_p50, color='green')
-
-        value_p75 = np.percentile(df[column_name_after_stress], 75)
-        plt.axvline(value_p75, color='red')
+        for p in sorted(values):
+            plt.axvline(values[p], color=quantile_colors.get(p, 'black'))
 
         # Add title to graph
+        title_values = [f'{"Median" if p == 0.5 else f"p{100 * p:g}"} {tag} is '
+                        f'{dimension_function(values[p]):,}{dimension}' for p in sorted(values)]
+        title_values = '\n'.join(', '.join(title_values[i:i + 2]) for i in range(0, len(title_values), 2))
         plt.title(f'{tag} distribution,'
                   f'starting {tag} is {dimension_function(value_now):,}{dimension} \n'
-                  f'Median {tag} is {dimension_function(value_p50):,}{dimension},'
-                  f'75th perc. {tag} is {dimension_function(value_p75):,}{dimension}')
+                  f'{title_values}')
 
-        # Save visualization
+        # Save visualization, layout keeps multi-line title within the figure
+        plt.tight_layout()
         plt.savefig(config.data_path + f'result_data/graphs/{results_tag}_{column_name_after_stress}_distribution.png')
         plt.close()
 